@@ -0,0 +1,82 @@
+"""Micro-benchmark: per-file render time with and without the compiled report template.
+
+Usage: python benchmarks/bench_render.py [--files N] [--rows N]
+"""
+import os
+import sys
+import time
+import tempfile
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scripts'))
+
+from jinja2 import FileSystemBytecodeCache
+import json_to_html
+from permset_model import PermissionSet
+
+
+def make_document(rows):
+    """Build a parsed permission set document with the given number of field permission rows."""
+    return {"PermissionSet": {
+        "label": "Benchmark",
+        "description": "Synthetic permission set",
+        "fieldPermissions": [
+            {"editable": "false", "field": f"Object{i % 20}.Field{i}__c", "readable": "true"}
+            for i in range(rows)
+        ],
+        "objectPermissions": [
+            {"allowCreate": "true", "allowDelete": "false", "allowEdit": "true", "allowRead": "true",
+             "modifyAllRecords": "false", "object": f"Object{i}", "viewAllRecords": "false"}
+            for i in range(20)
+        ],
+    }}
+
+
+def time_per_file(render, files):
+    """Return per-file render times in milliseconds."""
+    timings = []
+    for _ in range(files):
+        start = time.perf_counter()
+        render()
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def report(label, timings):
+    print(f"{label:<40} mean {statistics.mean(timings):8.2f} ms   "
+          f"p50 {statistics.median(timings):8.2f} ms   total {sum(timings):9.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark report template compilation and rendering")
+    parser.add_argument('--files', type=int, default=200, help="Number of files to render (default: 200)")
+    parser.add_argument('--rows', type=int, default=50, help="Field permission rows per file (default: 50)")
+    args = parser.parse_args()
+
+    permission_set = PermissionSet.from_document(make_document(args.rows))
+
+    def render_recompiling():
+        # What export_html_file used to do for every file
+        template = json_to_html.make_report_environment().from_string(json_to_html.make_template())
+        template.render(permission_set=permission_set)
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        json_to_html.get_report_template(cache_dir)
+
+        def render_compiled():
+            json_to_html.get_report_template().render(permission_set=permission_set)
+
+        def cold_start(with_cache):
+            env = json_to_html.make_report_environment(FileSystemBytecodeCache(cache_dir) if with_cache else None)
+            env.get_template('permission_set.html')
+
+        print(f"{args.files} files, {args.rows} field permission rows each")
+        report("before: compile template per file", time_per_file(render_recompiling, args.files))
+        report("after: compiled once per process", time_per_file(render_compiled, args.files))
+        report("process start: compile from source", time_per_file(lambda: cold_start(False), 20))
+        report("process start: load bytecode cache", time_per_file(lambda: cold_start(True), 20))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+"""Benchmark suite: throughput and latency of each pipeline stage on synthetic permission sets.
+
+For every size preset of generate_permission_sets.py (small, medium, org) the permission sets
+are generated once, then each stage is run serially and timed per item, keeping the fastest of
+--rounds rounds with the garbage collector paused (as timeit does) to keep noise down:
+
+  xml_to_json    export_xml_to_json per XML file
+  json_to_html   export_html_file per JSON file (template compiled beforehand)
+  compare_files  compare_delta.compare_files over the whole HTML directory, repeated
+  diff_rows      compare_delta.diff_permission_sets of every set against an edited copy, repeated
+
+Results are compared with the stored baselines (benchmarks/baselines.json): a stage whose
+throughput fell more than --threshold below its baseline is reported as a regression and the
+exit status is 1. Baselines depend on the machine, so none are checked in: record them on the
+runner that checks them with --save_baseline. Baselines recorded on another machine (Python
+version, architecture or CPU count) are shown but not checked. On small shared machines
+run-to-run noise reaches about 40%, hence the default threshold of 50%.
+
+Usage: python benchmarks/bench_stages.py [--sizes small,medium] [--threshold 0.5] [--save_baseline]
+"""
+import gc
+import os
+import sys
+import json
+import time
+import random
+import logging
+import platform
+import tempfile
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scripts'))
+
+from generate_permission_sets import SIZES, write_size
+from pipeline_metrics import summarize_durations
+import xml_to_json
+import json_to_html
+import compare_delta
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines.json")
+
+# Repetitions of the stages that process the whole directory in one call
+WHOLE_RUN_REPEATS = 20
+
+
+def time_items(function, items, rounds):
+    """Call function on every item, rounds times; returns (total seconds, per-item durations) of the fastest round."""
+    best = None
+    for _ in range(rounds):
+        durations = []
+        gc.collect()
+        gc.disable()
+        try:
+            for item in items:
+                start = time.perf_counter()
+                function(item)
+                durations.append(time.perf_counter() - start)
+        finally:
+            gc.enable()
+        if best is None or sum(durations) < sum(best):
+            best = durations
+    return sum(best), best
+
+
+def stage_result(items, seconds, durations):
+    summary = summarize_durations(durations)
+    return {
+        "items": items,
+        "seconds": round(seconds, 4),
+        "items_per_s": round(items / seconds, 1) if seconds else None,
+        "p50_ms": round(summary["p50_s"] * 1000, 3),
+        "p99_ms": round(summary["p99_s"] * 1000, 3),
+    }
+
+
+def edit_snapshot(snapshot, rng, fraction=0.1):
+    """Return a copy of snapshot in which a fraction of the sets has the last cell of one row flipped."""
+    edited = {}
+    for name, entry in snapshot.items():
+        sections = {section: [list(row) for row in rows] for section, rows in entry["sections"].items()}
+        if sections and rng.random() < fraction:
+            rows = sections[rng.choice(sorted(sections))]
+            row = rows[rng.randrange(len(rows))]
+            row[-1] = "false" if row[-1] == "true" else "true"
+        edited[name] = {"attributes": entry["attributes"], "sections": sections}
+    return edited
+
+
+def run_size(size, work_dir, rounds):
+    """Generate one size preset in work_dir and benchmark every stage on it."""
+    xml_dir, json_dir, html_dir = (os.path.join(work_dir, size, part) for part in ("xml", "json", "html"))
+    files = write_size(xml_dir, size)
+    os.makedirs(json_dir)
+    os.makedirs(html_dir)
+    results = {}
+
+    seconds, durations = time_items(
+        lambda file: xml_to_json.export_xml_to_json(os.path.join(xml_dir, file),
+                                                    os.path.join(json_dir, file.removesuffix('.xml') + '.json')),
+        files, rounds)
+    results["xml_to_json"] = stage_result(len(files), seconds, durations)
+
+    json_to_html.get_report_template()
+    json_files = sorted(os.listdir(json_dir))
+    seconds, durations = time_items(
+        lambda file: json_to_html.export_html_file(os.path.join(json_dir, file), html_dir, "BENCH"), json_files, rounds)
+    results["json_to_html"] = stage_result(len(json_files), seconds, durations)
+
+    # The master sheet misses a few reports and lists a few that no longer exist
+    html_files = sorted(os.listdir(html_dir))
+    json_data = [{"HTML": file, "ID": str(100000 + i)} for i, file in enumerate(html_files[5:])]
+    json_data += [{"HTML": f"Retired{i}.permissionset-meta.html", "ID": str(900000 + i)} for i in range(5)]
+    seconds, durations = time_items(lambda _: compare_delta.compare_files(html_dir, json_data), range(WHOLE_RUN_REPEATS),
+                                    rounds)
+    results["compare_files"] = stage_result(len(json_data) * WHOLE_RUN_REPEATS, seconds, durations)
+
+    snapshot = {name: compare_delta.snapshot_permission_set(permission_set)
+                for name, permission_set in compare_delta.load_permission_sets(json_dir)}
+    edited = edit_snapshot(snapshot, random.Random(0))
+    seconds, durations = time_items(lambda _: compare_delta.diff_permission_sets(snapshot, edited),
+                                    range(WHOLE_RUN_REPEATS), rounds)
+    results["diff_rows"] = stage_result(len(snapshot) * WHOLE_RUN_REPEATS, seconds, durations)
+    return results
+
+
+def machine_fingerprint():
+    """Describe this machine the way baselines record where they were measured."""
+    return {"python": platform.python_version(), "machine": platform.machine(), "cpus": os.cpu_count()}
+
+
+def load_baselines(path):
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def find_regressions(results, baselines, threshold):
+    """Return "size/stage" descriptions of every stage whose throughput fell more than threshold below its baseline."""
+    regressions = []
+    for size, stages in results.items():
+        for stage, result in stages.items():
+            baseline = baselines.get(size, {}).get(stage, {}).get("items_per_s")
+            if baseline and result["items_per_s"] < baseline * (1 - threshold):
+                regressions.append(f"{size}/{stage}: {result['items_per_s']}/s vs baseline {baseline}/s "
+                                   f"({result['items_per_s'] / baseline - 1:+.0%})")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark every pipeline stage on synthetic permission sets")
+    parser.add_argument('--sizes', default="small,medium", help=f"Comma separated presets out of {', '.join(SIZES)} (default: small,medium)")
+    parser.add_argument('--rounds', type=int, default=3, help="Runs of every stage; the fastest counts (default: 3)")
+    parser.add_argument('--baseline', default=BASELINE_FILE, help="Stored baselines (default: benchmarks/baselines.json)")
+    parser.add_argument('--threshold', type=float, default=0.5, help="Allowed throughput drop before a stage counts as regressed (default: 0.5)")
+    parser.add_argument('--save_baseline', action='store_true', help="Record this run's results as the baselines of the sizes run")
+    parser.add_argument('--output', help="Also write the results to this JSON file")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    sizes = args.sizes.split(',')
+    unknown = [size for size in sizes if size not in SIZES]
+    if unknown:
+        parser.error(f"Unknown size(s): {', '.join(unknown)}")
+
+    baselines = load_baselines(args.baseline)
+    results = {}
+    print(f"{'size':<7} {'stage':<14} {'items':>7} {'items/s':>10} {'p50 ms':>9} {'p99 ms':>9} {'baseline/s':>11}")
+    with tempfile.TemporaryDirectory() as work_dir:
+        for size in sizes:
+            results[size] = run_size(size, work_dir, args.rounds)
+            for stage, result in results[size].items():
+                baseline = baselines.get(size, {}).get(stage, {}).get("items_per_s", "-")
+                print(f"{size:<7} {stage:<14} {result['items']:>7} {result['items_per_s']:>10} "
+                      f"{result['p50_ms']:>9} {result['p99_ms']:>9} {baseline:>11}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=4)
+    if args.save_baseline:
+        baselines.update(results)
+        baselines["recorded_on"] = machine_fingerprint()
+        with open(args.baseline, 'w') as f:
+            json.dump(baselines, f, indent=4, sort_keys=True)
+            f.write('\n')
+        print(f"Saved baselines for {', '.join(sizes)} to {args.baseline}")
+        return
+
+    if not baselines:
+        print(f"No baselines in {args.baseline}; record them on this machine with --save_baseline")
+        return
+    if baselines.get("recorded_on") != machine_fingerprint():
+        print(f"Baselines were recorded on {baselines.get('recorded_on')}, not on this machine "
+              f"({machine_fingerprint()}); not checking for regressions")
+        return
+    regressions = find_regressions(results, baselines, args.threshold)
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""Load benchmark: Confluence upload throughput against the local fake server at several concurrency levels.
+
+For every worker count, all pages are uploaded with update_confluence and the run reports pages/s,
+p50/p99 per-page latency and the requests the server saw. With --ledger, each level first fills a
+ledger in an untimed run so the timed run measures the cached-version path (and --edit_fraction
+of pages are "edited by hand" in between to exercise 409 handling).
+
+Usage: python benchmarks/bench_upload.py [--pages N] [--latency S] [--levels 1,4,16]
+"""
+import os
+import sys
+import json
+import time
+import logging
+import tempfile
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scripts'))
+
+from fake_confluence import FakeConfluence, start_fake_confluence, add_master_sheet
+from pipeline_metrics import enable_pipeline_metrics
+import update_confluence
+import read_confluence_db
+
+
+def write_pages(directory, html_to_ids, revision):
+    """Write one small report per page; revision changes every body so nothing is skipped as unchanged."""
+    for item in html_to_ids:
+        with open(os.path.join(directory, item["HTML"]), 'w') as f:
+            f.write(f"<h1>{item['HTML']}</h1>\n<p><small>2024-Jan-01 | BENCH</small></p>\n"
+                    f"<table><tr><td>revision</td><td>{revision}</td></tr></table>")
+
+
+def run_level(fake, map_file, html_dir, workers, ledger_file=None):
+    """Upload every page once with the given number of workers; returns the measurements."""
+    fake.reset_counts()
+    metrics = enable_pipeline_metrics()
+    start = time.perf_counter()
+    results = update_confluence.parallel_confluence_html_updates(map_file, html_dir, workers=workers,
+                                                                 ledger_file=ledger_file)
+    elapsed = time.perf_counter() - start
+    upload = metrics.as_dict()["update_confluence.upload"]
+    item_times = upload.get("item_times", {})
+    return {
+        "workers": workers,
+        "seconds": round(elapsed, 3),
+        "pages_per_s": round(len(results) / elapsed, 1),
+        "p50_ms": round(item_times.get("p50_s", 0) * 1000, 1),
+        "p99_ms": round(item_times.get("p99_s", 0) * 1000, 1),
+        "failed": sum(1 for result in results if result.status == "failed"),
+        "requests": fake.stats(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the Confluence upload path against a fake server")
+    parser.add_argument('--pages', type=int, default=200, help="Pages to upload per level (default: 200)")
+    parser.add_argument('--levels', default="1,4,8,16,32", help="Comma separated worker counts (default: 1,4,8,16,32)")
+    parser.add_argument('--latency', type=float, default=0.05, help="Server latency per request in seconds (default: 0.05)")
+    parser.add_argument('--jitter', type=float, default=0.02, help="Uniform extra server latency in seconds (default: 0.02)")
+    parser.add_argument('--max_concurrency', type=int, help="Server answers 429 above this many requests in flight")
+    parser.add_argument('--rate_limit', type=float, help="Server answers 429 above this many requests per second")
+    parser.add_argument('--failure_rate', type=float, default=0.0, help="Probability of a 502/503/504 response")
+    parser.add_argument('--shards', type=int, default=1, help="Split the master sheet across this many child pages")
+    parser.add_argument('--ledger', action='store_true', help="Measure uploads with a warm version ledger")
+    parser.add_argument('--edit_fraction', type=float, default=0.0, help="With --ledger, pages edited by hand before the timed run")
+    parser.add_argument('--output', help="Also write the results to this JSON file")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    fake = FakeConfluence(latency=args.latency, jitter=args.jitter, max_concurrency=args.max_concurrency,
+                          rate_limit=args.rate_limit, failure_rate=args.failure_rate, seed=0)
+    html_to_ids = [{"HTML": f"PermSet{i}.html", "ID": str(100000 + i)} for i in range(args.pages)]
+    for item in html_to_ids:
+        fake.add_page(item["ID"], item["HTML"][:-len(".html")])
+    add_master_sheet(fake, "1", html_to_ids, args.shards)
+    server, base_url = start_fake_confluence(fake)
+    os.environ["CONFLUENCE_BASE_URL"] = base_url
+
+    levels = [int(level) for level in args.levels.split(',')]
+    report = {"pages": args.pages, "latency_s": args.latency, "ledger": args.ledger, "levels": []}
+    with tempfile.TemporaryDirectory() as work_dir:
+        map_file = os.path.join(work_dir, "html_to_ids.json")
+
+        fake.reset_counts()
+        start = time.perf_counter()
+        read_confluence_db.get_webpage("1", map_file, children=args.shards > 1)
+        report["master_sheet_ms"] = round((time.perf_counter() - start) * 1000, 1)
+        print(f"Master sheet: {args.pages} rows on {args.shards} page(s) fetched and parsed in {report['master_sheet_ms']} ms")
+
+        print(f"{args.pages} pages, {args.latency * 1000:.0f} ms latency"
+              f"{', warm ledger' if args.ledger else ''}")
+        print(f"{'workers':>7} {'pages/s':>9} {'p50 ms':>8} {'p99 ms':>8} {'failed':>6}  requests")
+        for revision, workers in enumerate(levels):
+            ledger_file = None
+            if args.ledger:
+                ledger_file = os.path.join(work_dir, f"ledger-{workers}.json")
+                write_pages(work_dir, html_to_ids, f"{revision}-warm")
+                update_confluence.parallel_confluence_html_updates(map_file, work_dir, workers=workers,
+                                                                   ledger_file=ledger_file)
+                fake.edit_pages(args.edit_fraction)
+            write_pages(work_dir, html_to_ids, revision)
+            result = run_level(fake, map_file, work_dir, workers, ledger_file)
+            report["levels"].append(result)
+            requests = ' '.join(f"{kind}={count}" for kind, count in sorted(result["requests"].items()))
+            print(f"{workers:>7} {result['pages_per_s']:>9} {result['p50_ms']:>8} {result['p99_ms']:>8} "
+                  f"{result['failed']:>6}  {requests}")
+
+    server.shutdown()
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=4)
+
+
+if __name__ == "__main__":
+    main()
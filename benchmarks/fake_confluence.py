@@ -0,0 +1,276 @@
+"""Local stand-in for the Confluence content REST API used by the pipeline scripts.
+
+Serves GET/PUT /wiki/rest/api/content/{id}, GET /wiki/rest/api/content/{id}/child/page and
+GET /wiki/rest/api/content/search (CQL "id in (...)"), keeping page versions in memory with
+Confluence's conflict rule: a PUT must carry version + 1 or it is answered with 409. Latency,
+throttling (429 with Retry-After) and 5xx failures can be injected.
+
+Point the scripts at it with CONFLUENCE_BASE_URL=http://127.0.0.1:<port>/wiki.
+
+Usage: python benchmarks/fake_confluence.py [--port 8080] [--latency 0.05] [--max_concurrency 8] ...
+"""
+import re
+import json
+import time
+import random
+import argparse
+import threading
+from collections import Counter
+from urllib.parse import urlparse, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+CONTENT_PATH = re.compile(r'^/wiki/rest/api/content/(\d+)$')
+CHILD_PATH = re.compile(r'^/wiki/rest/api/content/(\d+)/child/page$')
+SEARCH_PATH = '/wiki/rest/api/content/search'
+
+
+class FakeConfluence:
+    """In-memory pages plus the fault injection settings, shared by every request handler thread.
+
+    latency/jitter   seconds added to every request (jitter is a uniform extra on top)
+    max_concurrency  answer 429 while more than this many requests are in flight
+    rate_limit       answer 429 above this many requests/second (token bucket, burst of one second)
+    retry_after      Retry-After seconds sent with 429s (None to send no header)
+    failure_rate     probability of answering 502/503/504 instead of handling the request
+    search_limit     largest page of search results returned, whatever limit was asked for
+    """
+
+    def __init__(self, latency=0.0, jitter=0.0, max_concurrency=None, rate_limit=None, retry_after=1,
+                 failure_rate=0.0, search_limit=50, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.max_concurrency = max_concurrency
+        self.rate_limit = rate_limit
+        self.retry_after = retry_after
+        self.failure_rate = failure_rate
+        self.search_limit = search_limit
+        self.random = random.Random(seed)
+        self.pages = {}
+        self.counts = Counter()
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self._tokens = rate_limit or 0
+        self._refilled = time.monotonic()
+        self._lock = threading.Lock()
+
+    def add_page(self, page_id, title, body='', version=1, parent=None):
+        with self._lock:
+            self.pages[str(page_id)] = {"id": str(page_id), "title": title, "version": version, "body": body,
+                                        "parent": str(parent) if parent is not None else None}
+
+    def edit_pages(self, fraction):
+        """Bump the version of a random fraction of pages, as if they had been edited by hand."""
+        with self._lock:
+            edited = self.random.sample(sorted(self.pages), int(len(self.pages) * fraction))
+            for page_id in edited:
+                self.pages[page_id]["version"] += 1
+        return edited
+
+    def reset_counts(self):
+        with self._lock:
+            self.counts.clear()
+            self.peak_in_flight = 0
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counts, peak_in_flight=self.peak_in_flight)
+
+    def admit(self, kind):
+        """Count a request and decide whether to serve it: returns None, or (status, headers) to fail with."""
+        with self._lock:
+            self.counts[kind] += 1
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+            if self.max_concurrency and self.in_flight > self.max_concurrency:
+                return self._throttle(self.retry_after)
+            if self.rate_limit:
+                now = time.monotonic()
+                self._tokens = min(self.rate_limit, self._tokens + (now - self._refilled) * self.rate_limit)
+                self._refilled = now
+                if self._tokens < 1:
+                    return self._throttle(self.retry_after)
+                self._tokens -= 1
+            if self.failure_rate and self.random.random() < self.failure_rate:
+                status = self.random.choice((502, 503, 504))
+                self.counts[str(status)] += 1
+                return status, {}
+        return None
+
+    def _throttle(self, retry_after):
+        self.counts["429"] += 1
+        return 429, {"Retry-After": str(retry_after)} if retry_after is not None else {}
+
+    def release(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def delay(self):
+        seconds = self.latency + (self.random.uniform(0, self.jitter) if self.jitter else 0)
+        if seconds:
+            time.sleep(seconds)
+
+    def page_json(self, page, expand=''):
+        data = {"id": page["id"], "type": "page", "title": page["title"], "version": {"number": page["version"]}}
+        if 'body.storage' in expand:
+            data["body"] = {"storage": {"value": page["body"], "representation": "storage"}}
+        return data
+
+    def get_page(self, page_id, expand):
+        with self._lock:
+            page = self.pages.get(page_id)
+            return (200, self.page_json(page, expand)) if page else (404, {"message": "No content found"})
+
+    def get_children(self, page_id, start, limit, expand):
+        limit = min(limit, self.search_limit)
+        with self._lock:
+            if page_id not in self.pages:
+                return 404, {"message": "No content found"}
+            children = [page for page in self.pages.values() if page["parent"] == page_id]
+            results = [self.page_json(page, expand) for page in children[start:start + limit]]
+        links = {"next": f"/rest/api/content/{page_id}/child/page?start={start + limit}"} if start + limit < len(children) else {}
+        return 200, {"results": results, "start": start, "limit": limit, "size": len(results), "_links": links}
+
+    def search(self, cql, start, limit, expand):
+        if not re.match(r'^\s*id\s+in\s*\(', cql):
+            return 400, {"message": f"Unsupported CQL: {cql}"}
+        ids = re.findall(r'\d+', cql)
+        limit = min(limit, self.search_limit)
+        with self._lock:
+            matches = [self.pages[page_id] for page_id in ids if page_id in self.pages]
+            results = [self.page_json(page, expand) for page in matches[start:start + limit]]
+        links = {"next": f"/rest/api/content/search?start={start + limit}"} if start + limit < len(matches) else {}
+        return 200, {"results": results, "start": start, "limit": limit, "size": len(results), "_links": links}
+
+    def put_page(self, page_id, data):
+        with self._lock:
+            page = self.pages.get(page_id)
+            if page is None:
+                return 404, {"message": "No content found"}
+            version = data.get("version", {}).get("number")
+            if version != page["version"] + 1:
+                self.counts["409"] += 1
+                return 409, {"message": f"Version must be incremented on update. Current version is: {page['version']}"}
+            page.update(version=version, title=data.get("title", page["title"]),
+                        body=data.get("body", {}).get("storage", {}).get("value", ""))
+            return 200, self.page_json(page)
+
+
+class FakeConfluenceHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are separate writes; with Nagle on, delayed ACKs add ~40ms to every keep-alive request
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def send_json(self, status, data, headers=None):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def handle_request(self, kind, handler):
+        fake = self.server.fake
+        rejected = fake.admit(kind)
+        try:
+            fake.delay()
+            if rejected:
+                status, headers = rejected
+                self.send_json(status, {"message": "Injected failure"}, headers)
+            else:
+                self.send_json(*handler())
+        finally:
+            fake.release()
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        expand = query.get('expand', '')
+        if url.path == SEARCH_PATH:
+            self.handle_request("search", lambda: self.server.fake.search(
+                query.get('cql', ''), int(query.get('start', 0)), int(query.get('limit', 25)), expand))
+            return
+        match = CONTENT_PATH.match(url.path)
+        child_match = CHILD_PATH.match(url.path)
+        if match:
+            self.handle_request("get", lambda: self.server.fake.get_page(match.group(1), expand))
+        elif child_match:
+            self.handle_request("children", lambda: self.server.fake.get_children(
+                child_match.group(1), int(query.get('start', 0)), int(query.get('limit', 25)), expand))
+        else:
+            self.send_json(404, {"message": f"Not found: {url.path}"})
+
+    def do_PUT(self):
+        data = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        match = CONTENT_PATH.match(urlparse(self.path).path)
+        if match:
+            self.handle_request("put", lambda: self.server.fake.put_page(match.group(1), data))
+        else:
+            self.send_json(404, {"message": f"Not found: {self.path}"})
+
+
+def start_fake_confluence(fake, host='127.0.0.1', port=0):
+    """Serve fake on a background thread; returns (server, base_url). Call server.shutdown() to stop."""
+    server = ThreadingHTTPServer((host, port), FakeConfluenceHandler)
+    server.daemon_threads = True
+    server.fake = fake
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}/wiki"
+
+
+def add_master_sheet(fake, master_id, html_to_ids, shards=1):
+    """Add the master sheet: a table of HTML file name -> page ID rows, as read_confluence_db expects.
+
+    With shards > 1 the rows are split across that many child pages of master_id (IDs master_id1,
+    master_id2, ...), each holding one table, and master_id itself only links to them.
+    """
+    def table(items):
+        rows = ''.join(f"<tr><td>{item['HTML']}</td><td>{item['ID']}</td></tr>" for item in items)
+        return f"<table><tr><th>HTML</th><th>ID</th></tr>{rows}</table>"
+
+    if shards <= 1:
+        fake.add_page(master_id, "Master Sheet", table(html_to_ids))
+        return
+    fake.add_page(master_id, "Master Sheet", "<p>See the child pages.</p>")
+    for shard in range(shards):
+        fake.add_page(f"{master_id}{shard + 1}", f"Master Sheet {shard + 1}", table(html_to_ids[shard::shards]),
+                      parent=master_id)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a local fake Confluence server")
+    parser.add_argument('--port', type=int, default=8080, help="Port to listen on (default: 8080)")
+    parser.add_argument('--pages', type=int, default=100, help="Pages to create, with IDs from 100000 (default: 100)")
+    parser.add_argument('--master_id', default="9994318", help="Page ID of the generated master sheet (default: 9994318)")
+    parser.add_argument('--shards', type=int, default=1, help="Split the master sheet across this many child pages")
+    parser.add_argument('--latency', type=float, default=0.0, help="Seconds added to every request")
+    parser.add_argument('--jitter', type=float, default=0.0, help="Uniform random extra latency in seconds")
+    parser.add_argument('--max_concurrency', type=int, help="Answer 429 above this many requests in flight")
+    parser.add_argument('--rate_limit', type=float, help="Answer 429 above this many requests per second")
+    parser.add_argument('--retry_after', type=float, default=1, help="Retry-After seconds sent with 429s (default: 1)")
+    parser.add_argument('--failure_rate', type=float, default=0.0, help="Probability of a 502/503/504 response")
+    args = parser.parse_args()
+
+    fake = FakeConfluence(latency=args.latency, jitter=args.jitter, max_concurrency=args.max_concurrency,
+                          rate_limit=args.rate_limit, retry_after=args.retry_after, failure_rate=args.failure_rate)
+    html_to_ids = [{"HTML": f"PermSet{i}.html", "ID": str(100000 + i)} for i in range(args.pages)]
+    for item in html_to_ids:
+        fake.add_page(item["ID"], item["HTML"][:-len(".html")])
+    add_master_sheet(fake, args.master_id, html_to_ids, args.shards)
+
+    server, base_url = start_fake_confluence(fake, port=args.port)
+    print(f"Serving {args.pages} pages at {base_url} (master sheet {args.master_id}); Ctrl+C to stop")
+    try:
+        while True:
+            time.sleep(5)
+    except KeyboardInterrupt:
+        server.shutdown()
+        print(json.dumps(fake.stats(), indent=4))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""Generate synthetic Salesforce permission sets (.permissionset-meta.xml) for benchmarks and local runs.
+
+Rows are spread over every section the report reads (permset_model.PERMISSION_SET_SECTIONS:
+fieldPermissions, objectPermissions, tabSettings, classAccesses, ...). Row counts vary per file
+around the requested sizes, a fraction of the sets gets one row per section (xmltodict then
+yields a dict, not a list) and a few get a much larger fieldPermissions section, like the
+admin-style sets of a real org.
+
+Usage: python benchmarks/generate_permission_sets.py -o DIR [--size medium] [--sets N] [--fields N] ...
+"""
+import os
+import sys
+import random
+import argparse
+from xml.sax.saxutils import escape
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scripts'))
+
+from permset_model import PERMISSION_SET_SECTIONS, FieldPermission
+
+NAMESPACE = "http://soap.sforce.com/2006/04/metadata"
+
+# name -> (sets, mean fieldPermissions rows, mean objectPermissions rows, mean rows of every other section)
+SIZES = {
+    "small": (20, 100, 10, 3),
+    "medium": (200, 300, 30, 8),
+    "org": (1500, 400, 40, 10),
+}
+
+# Share of sets with a single row per section, and of sets with 10x the field permissions
+SINGLE_FRACTION = 0.1
+LARGE_FRACTION = 0.02
+
+
+def _bool(rng, p_true=0.5):
+    return "true" if rng.random() < p_true else "false"
+
+
+def _element(tag, fields):
+    return f"    <{tag}>\n" + "".join(f"        <{key}>{escape(str(value))}</{key}>\n" for key, value in fields) + f"    </{tag}>\n"
+
+
+def section_rows(section, count, rng, objects):
+    """Return count [(child, value)] entries for one section, with the children the report reads."""
+    row_type = PERMISSION_SET_SECTIONS[section][0]
+    rows = []
+    for i in range(count):
+        if row_type is FieldPermission:
+            readable = _bool(rng, 0.9)
+            rows.append([("editable", _bool(rng, 0.4) if readable == "true" else "false"),
+                         ("field", f"{objects[i % len(objects)]}.Field{i}__c"), ("readable", readable)])
+            continue
+        row = []
+        for index, field in enumerate(row_type._fields):
+            if index == 0:
+                # The identifying column: unique within the section
+                value = f"{objects[i % len(objects)]}{i // len(objects) or ''}" if field == "object" else f"{field[0].upper()}{field[1:]}{i}"
+            elif field == "visibility":
+                value = rng.choice(("Visible", "Available", "None", "DefaultOn"))
+            else:
+                value = _bool(rng, 0.3)
+            row.append((field, value))
+        rows.append(sorted(row))
+    return rows
+
+
+# Sections with a mean row count of "others" in SIZES
+OTHER_SECTIONS = tuple(section for section in PERMISSION_SET_SECTIONS
+                       if section not in ("fieldPermissions", "objectPermissions"))
+
+
+def generate_permission_set_xml(name, fields, objects, others, rng, single=False):
+    """Return the XML of one permission set with about the given number of rows per section.
+
+    With single, every non-empty section has exactly one row (the dict shape once parsed).
+    """
+    object_names = [f"Object{i}__c" for i in range(max(1, objects))]
+    counts = {"fieldPermissions": fields, "objectPermissions": objects}
+    counts.update((section, others) for section in OTHER_SECTIONS)
+
+    elements = {
+        "description": f"    <description>Synthetic permission set {escape(name)}</description>\n",
+        "hasActivationRequired": f"    <hasActivationRequired>{_bool(rng, 0.1)}</hasActivationRequired>\n",
+        "label": f"    <label>{escape(name)}</label>\n",
+    }
+    for section, mean in counts.items():
+        count = min(1, mean) if single else max(0, int(rng.gauss(mean, mean / 4)))
+        elements[section] = "".join(_element(section, row) for row in section_rows(section, count, rng, object_names))
+
+    # Salesforce writes the elements in alphabetical order, sections and single values alike
+    parts = [f'<?xml version="1.0" encoding="UTF-8"?>\n<PermissionSet xmlns="{NAMESPACE}">\n']
+    parts.extend(elements[tag] for tag in sorted(elements))
+    parts.append("</PermissionSet>\n")
+    return "".join(parts)
+
+
+def write_permission_sets(output_dir, sets, fields, objects, others, seed=0, single_fraction=SINGLE_FRACTION,
+                          large_fraction=LARGE_FRACTION):
+    """Write sets permission sets to output_dir; returns the file names written."""
+    rng = random.Random(seed)
+    os.makedirs(output_dir, exist_ok=True)
+    files = []
+    for i in range(sets):
+        name = f"Synthetic{i:05d}"
+        shape = rng.random()
+        single = shape < single_fraction
+        scale = 10 if single_fraction <= shape < single_fraction + large_fraction else 1
+        xml = generate_permission_set_xml(name, fields * scale, objects, others, rng, single)
+        file = f"{name}.permissionset-meta.xml"
+        with open(os.path.join(output_dir, file), 'w', encoding='utf-8') as f:
+            f.write(xml)
+        files.append(file)
+    return files
+
+
+def write_size(output_dir, size, seed=0):
+    """Write the permission sets of one of the SIZES presets."""
+    return write_permission_sets(output_dir, *SIZES[size], seed=seed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate synthetic permission set XML files")
+    parser.add_argument('--output_dir', '-o', required=True, help="Directory to write the .permissionset-meta.xml files to")
+    parser.add_argument('--size', choices=sorted(SIZES), default="small", help="Preset for the options below (default: small)")
+    parser.add_argument('--sets', type=int, help="Number of permission sets")
+    parser.add_argument('--fields', type=int, help="Mean fieldPermissions rows per set")
+    parser.add_argument('--objects', type=int, help="Mean objectPermissions rows per set")
+    parser.add_argument('--others', type=int, help="Mean rows of every other section per set")
+    parser.add_argument('--single_fraction', type=float, default=SINGLE_FRACTION, help=f"Share of sets with one row per section (default: {SINGLE_FRACTION})")
+    parser.add_argument('--large_fraction', type=float, default=LARGE_FRACTION, help=f"Share of sets with 10x the field permissions (default: {LARGE_FRACTION})")
+    parser.add_argument('--seed', type=int, default=0, help="Random seed (default: 0)")
+    args = parser.parse_args()
+
+    preset = SIZES[args.size]
+    sets, fields, objects, others = (value if value is not None else default for value, default
+                                     in zip((args.sets, args.fields, args.objects, args.others), preset))
+    files = write_permission_sets(args.output_dir, sets, fields, objects, others, seed=args.seed,
+                                  single_fraction=args.single_fraction, large_fraction=args.large_fraction)
+    print(f"Wrote {len(files)} permission sets to {args.output_dir}")
+
+
+if __name__ == "__main__":
+    main()
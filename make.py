@@ -13,6 +13,8 @@ def main():
     context = dict()
     context["workflow_name"] = 'Salesforce Permission Set Report'
     context["CONFLUENCE_MASTER_ID"] = "9994318"
+    # Read the master sheet from the child pages of CONFLUENCE_MASTER_ID instead of the page itself
+    context["CONFLUENCE_MASTER_CHILDREN"] = False
     context["prefix"] = ' '*10
     context["python_version"] = '3.12'  
     context["sf_install"] = True
@@ -53,11 +55,6 @@ def main():
         'name': 'xmltodict',
         'comment': 'XML library for converting XML Permissionsets to JSON'
     })
-    context['python_dependencies'].append({
-        "version": ">=4.12.3,<5.0.0",
-        "name": "beautifulsoup4",
-        "comment": "HTML Parser library for Confluence HTML to JSON"
-    })
 
     # Cron schedule(s); empty if not needed
     context['scheduled'] = []
@@ -72,6 +69,36 @@ def main():
 
     # Files to write
     context['files'] = []
+    context['files'].append({
+        "name": "Permission Set Model",
+        "path": "${{ GITHUB_WORKSPACE }}/permset_model.py",
+        "comment": "This module normalizes parsed permission sets for rendering and diffing",
+        "content": read_file_content("scripts/permset_model.py"),
+    })
+    context['files'].append({
+        "name": "Permission Set Store",
+        "path": "${{ GITHUB_WORKSPACE }}/permset_store.py",
+        "comment": "This module reads and writes the single-file permission set store",
+        "content": read_file_content("scripts/permset_store.py"),
+    })
+    context['files'].append({
+        "name": "Pipeline Metrics",
+        "path": "${{ GITHUB_WORKSPACE }}/pipeline_metrics.py",
+        "comment": "This module records per-stage timings and cProfile output",
+        "content": read_file_content("scripts/pipeline_metrics.py"),
+    })
+    context['files'].append({
+        "name": "Confluence Client",
+        "path": "${{ GITHUB_WORKSPACE }}/confluence_client.py",
+        "comment": "This module provides the pooled HTTP client for Confluence APIs",
+        "content": read_file_content("scripts/confluence_client.py"),
+    })
+    context['files'].append({
+        "name": "Permission Set Changeset",
+        "path": "${{ GITHUB_WORKSPACE }}/permset_changeset.py",
+        "comment": "This script computes which permission sets changed since the last successful run",
+        "content": read_file_content("scripts/permset_changeset.py"),
+    })
     context['files'].append({
         "name": "XML to JSON",
         "path": "${{ GITHUB_WORKSPACE }}/xml_to_json.py",
@@ -102,38 +129,197 @@ def main():
         "comment": "This script compares HTML files to JSON data",
         "content": read_file_content("scripts/compare_delta.py"),
     })
+    context['files'].append({
+        "name": "Pipeline",
+        "path": "${{ GITHUB_WORKSPACE }}/pipeline.py",
+        "comment": "This script runs every stage above in one process, overlapping independent stages",
+        "content": read_file_content("scripts/pipeline.py"),
+    })
 
-    context["execute_python"] = []
-    context["execute_python"].append({
-        "name": "XML to JSON",
-        "comment": "Convert XML Permissionsets to JSON for table creation",
-        "path": "./xml_to_json.py",
-        "args": '-i "$GITHUB_WORKSPACE/salesforce/force-app/main/default/permissionsets" -o "$GITHUB_WORKSPACE/salesforce/permset"'
+    # Render XML straight to HTML in one step instead of going through per-file JSON
+    context["fused_xml_to_html"] = False
+    # Keep the JSON intermediate in one permsets.ndjson store instead of one file per permission set
+    context["permset_store"] = False
+    store_arg = ' --store' if context["permset_store"] else ''
+
+    # Directories restored from and saved to the Actions cache between runs
+    context["caches"] = []
+    context["caches"].append({
+        "name": "Jinja bytecode",
+        "comment": "Compiled HTML report template, so rendering skips template compilation",
+        "path": ".jinja-cache",
+        "key": "jinja-bytecode-${{ hashFiles('json_to_html.py') }}"
     })
-    context["execute_python"].append({
-        "name": "JSON to HTML",
-        "comment": "Convert JSON Permissionsets to HTML",
-        "path": "./json_to_html.py",
-        "args": '-i "$GITHUB_WORKSPACE/salesforce/permset" -o "$GITHUB_WORKSPACE/permset-html"'
+
+    # Content hashes of what was last written to each page; unchanged pages are not PUT again
+    context["confluence_ledger"] = ".confluence-ledger.json"
+    ledger_arg = f' --ledger "$GITHUB_WORKSPACE/{context["confluence_ledger"]}"' if context["confluence_ledger"] else ''
+    if context["confluence_ledger"]:
+        # The ledger changes every run, so save it under a fresh key and restore the newest one
+        context["caches"].append({
+            "name": "Confluence ledger",
+            "comment": "Page content hashes from the previous run",
+            "path": context["confluence_ledger"],
+            "key": "confluence-ledger-${{ github.run_id }}",
+            "restore_keys": "confluence-ledger-"
+        })
+    # Master sheet rows and the page version they were read from, reused while the version is unchanged
+    context["caches"].append({
+        "name": "Confluence master sheet",
+        "comment": "HTML to ID rows from the previous run",
+        "path": ["html_to_ids.json", "html_to_ids.json.meta"],
+        "key": "confluence-master-sheet-${{ github.run_id }}",
+        "restore_keys": "confluence-master-sheet-"
     })
-    context["execute_python"].append({
+
+    # Previous run's permission rows, so compare_delta can report row-level changes
+    context["permset_snapshot"] = ".permset-snapshot.json"
+    if context["permset_snapshot"]:
+        context["caches"].append({
+            "name": "Permission set snapshot",
+            "comment": "Permission rows from the previous run",
+            "path": context["permset_snapshot"],
+            "key": "permset-snapshot-${{ github.run_id }}",
+            "restore_keys": "permset-snapshot-"
+        })
+
+    # Only process the permission sets changed since the last successful run; the state that run
+    # left is cached and only committed once every step succeeded
+    context["incremental"] = False
+    context["permset_state"] = ".permset-state.json"
+    if context["incremental"]:
+        context["caches"].append({
+            "name": "Permission set state",
+            "comment": "Source file hashes as of the last successful run",
+            "path": context["permset_state"],
+            "key": "permset-state-${{ github.run_id }}",
+            "restore_keys": "permset-state-"
+        })
+    changeset_arg = ' --changeset "$GITHUB_WORKSPACE/changeset.json"' if context["incremental"] else ''
+
+    context["execute_python"] = []
+    read_master_step = {
         "name": "Read Confluence DB",
         "comment": "Retrieve the latest HTML to Confluence IDs from Confluence's Master Sheet",
         "path": "./read_confluence_db.py",
         "args": f'-p "{context["CONFLUENCE_MASTER_ID"]}" -o "$GITHUB_WORKSPACE/html_to_ids.json"'
-    })
+                + (' --children' if context["CONFLUENCE_MASTER_CHILDREN"] else '')
+    }
+    if context["incremental"]:
+        # The master sheet is read first so that pages new since the last run are filled too
+        context["execute_python"].append(read_master_step)
+        context["execute_python"].append({
+            "name": "Compute Change Set",
+            "comment": "List the permission sets changed since the last successful run, or whose page is new",
+            "path": "./permset_changeset.py",
+            "args": f'compute -i "$GITHUB_WORKSPACE/salesforce/force-app/main/default/permissionsets" -e .xml -s "$GITHUB_WORKSPACE/{context["permset_state"]}" -c "$GITHUB_WORKSPACE/changeset.json"'
+                    + ' -m "$GITHUB_WORKSPACE/html_to_ids.json"' + ledger_arg
+                    + (f' --snapshot "$GITHUB_WORKSPACE/{context["permset_snapshot"]}"' if context["permset_snapshot"] else '')
+        })
+    json_dir = "$GITHUB_WORKSPACE/permset-json" if context["fused_xml_to_html"] else "$GITHUB_WORKSPACE/salesforce/permset"
+    if context["fused_xml_to_html"]:
+        context["execute_python"].append({
+            "name": "XML to HTML",
+            "comment": "Convert XML Permissionsets to HTML, keeping JSON as a side output for artifacts",
+            "path": "./json_to_html.py",
+            "args": '--from-xml -i "$GITHUB_WORKSPACE/salesforce/force-app/main/default/permissionsets" -o "$GITHUB_WORKSPACE/permset-html" -j "$GITHUB_WORKSPACE/permset-json" --template_cache "$GITHUB_WORKSPACE/.jinja-cache"' + changeset_arg
+        })
+    else:
+        context["execute_python"].append({
+            "name": "XML to JSON",
+            "comment": "Convert XML Permissionsets to JSON for table creation",
+            "path": "./xml_to_json.py",
+            "args": '-i "$GITHUB_WORKSPACE/salesforce/force-app/main/default/permissionsets" -o "$GITHUB_WORKSPACE/salesforce/permset" --executor process' + store_arg + changeset_arg
+        })
+        context["execute_python"].append({
+            "name": "JSON to HTML",
+            "comment": "Convert JSON Permissionsets to HTML",
+            "path": "./json_to_html.py",
+            "args": '-i "$GITHUB_WORKSPACE/salesforce/permset" -o "$GITHUB_WORKSPACE/permset-html" --template_cache "$GITHUB_WORKSPACE/.jinja-cache"' + store_arg + changeset_arg
+        })
+    if not context["incremental"]:
+        context["execute_python"].append(read_master_step)
     context["execute_python"].append({
         "name": "Update Confluence Pages",
         "comment": "Parallelly update Confluence pages with new HTML content",
         "path": "./update_confluence.py",
-        "args": '-i "$GITHUB_WORKSPACE/html_to_ids.json" -p "$GITHUB_WORKSPACE/permset-html/"'
+        "args": '-i "$GITHUB_WORKSPACE/html_to_ids.json" -p "$GITHUB_WORKSPACE/permset-html/"' + ledger_arg + changeset_arg
     })
     context["execute_python"].append({
         "name": "Compare Delta",
         "comment": "Compare HTML files to JSON data",
         "path": "./compare_delta.py",
         "args": '-i "$GITHUB_WORKSPACE/permset-html" -m "$GITHUB_WORKSPACE/html_to_ids.json" -o "$GITHUB_WORKSPACE/differences.json"'
+                + (f' -j "{json_dir}" -s "$GITHUB_WORKSPACE/{context["permset_snapshot"]}"'
+                   + ('' if context["fused_xml_to_html"] else store_arg) if context["permset_snapshot"] else '')
+                + changeset_arg
     })
+    if context["incremental"]:
+        context["execute_python"].append({
+            "name": "Commit Change Set",
+            "comment": "Record this run's source file hashes for the next run",
+            "path": "./permset_changeset.py",
+            "args": f'commit -s "$GITHUB_WORKSPACE/{context["permset_state"]}" -c "$GITHUB_WORKSPACE/changeset.json"'
+        })
+
+    # Run every stage above as one step through pipeline.py instead of one interpreter per script
+    context["single_step_pipeline"] = False
+    # With the single step, stream each permission set through convert, render and upload so the
+    # first pages are uploaded while the rest are still rendering (JSON goes to permset-json)
+    context["pipelined_upload"] = False
+    if context["pipelined_upload"]:
+        json_dir = "$GITHUB_WORKSPACE/permset-json"
+    if not context["fused_xml_to_html"] and not (context["single_step_pipeline"] and context["pipelined_upload"]):
+        # xml_to_json's output and its content-hash manifest, so permission sets whose XML is
+        # unchanged since the previous run are not converted again
+        context["caches"].append({
+            "name": "Permission set JSON",
+            "comment": "xml_to_json output and manifest from the previous run",
+            "path": "salesforce/permset",
+            "key": "permset-json-${{ github.run_id }}",
+            "restore_keys": "permset-json-"
+        })
+    if context["single_step_pipeline"]:
+        context["execute_python"] = [{
+            "name": "Pipeline",
+            "comment": "Convert, render, read the master sheet, update Confluence pages and compare in one process",
+            "path": "./pipeline.py",
+            "args": '-i "$GITHUB_WORKSPACE/salesforce/force-app/main/default/permissionsets"'
+                    + f' -j "{json_dir}" -o "$GITHUB_WORKSPACE/permset-html" --template_cache "$GITHUB_WORKSPACE/.jinja-cache"'
+                    + (' --pipelined' if context["pipelined_upload"] else ' --fused' if context["fused_xml_to_html"] else store_arg)
+                    + f' -p "{context["CONFLUENCE_MASTER_ID"]}" -m "$GITHUB_WORKSPACE/html_to_ids.json"'
+                    + (' --children' if context["CONFLUENCE_MASTER_CHILDREN"] else '') + ledger_arg
+                    + ' -d "$GITHUB_WORKSPACE/differences.json"'
+                    + (f' -s "$GITHUB_WORKSPACE/{context["permset_snapshot"]}"' if context["permset_snapshot"] else '')
+                    + (f' --state "$GITHUB_WORKSPACE/{context["permset_state"]}" --changeset "$GITHUB_WORKSPACE/changeset.json"'
+                       if context["incremental"] else '')
+        }]
+
+    # Per-stage timing report (uploaded next to differences.json) and optional cProfile dumps
+    context["stage_timings"] = "timings.json"
+    context["stage_profiles"] = None  # e.g. "profiles" to dump cProfile output per stage
+    if context["single_step_pipeline"] and context["pipelined_upload"]:
+        # pipeline.py --pipelined runs convert, render and upload concurrently and rejects --profile,
+        # so there are no profiles to pass, compress or upload
+        context["stage_profiles"] = None
+    for step in context["execute_python"]:
+        if context["stage_timings"]:
+            step["args"] += f' --timings "$GITHUB_WORKSPACE/{context["stage_timings"]}"'
+        if context["stage_profiles"]:
+            step["args"] += f' --profile "$GITHUB_WORKSPACE/{context["stage_profiles"]}"'
+
+    # Peak memory per stage and per permission set in the timing report, and a cap on the
+    # estimated memory of the files converted or rendered at once (pipeline.py --pipelined is
+    # bounded by its queues instead)
+    context["memory_report"] = False
+    context["memory_budget_mb"] = None  # e.g. 2048 on a 7 GB runner
+    for step in context["execute_python"]:
+        if step["path"] not in ("./xml_to_json.py", "./json_to_html.py", "./pipeline.py"):
+            continue
+        if context["memory_report"] and context["stage_timings"]:
+            step["args"] += ' --memory'
+        if context["memory_budget_mb"] and not (step["path"] == "./pipeline.py" and context["pipelined_upload"]):
+            step["args"] += f' --memory_budget {context["memory_budget_mb"]}'
 
     # Compress folders to make easier uploading for artifacts
     context["compress_folders"] = []
@@ -147,6 +333,12 @@ def main():
         "path": "permset-json",
         "target": "permset-json.tgz"
     })
+    if context["stage_profiles"]:
+        context["compress_folders"].append({
+            "comment": "cProfile output per stage",
+            "path": context["stage_profiles"],
+            "target": f'{context["stage_profiles"]}.tgz'
+        })
     context["compress_folders"].append({
         "comment": "XML Permissionset files",
         "path": "salesforce/force-app/main/default/permissionsets",
@@ -158,6 +350,14 @@ def main():
     context["upload_artifacts"].append({
         "path": "differences.json"
     })
+    if context["stage_timings"]:
+        context["upload_artifacts"].append({
+            "path": context["stage_timings"]
+        })
+    if context["stage_profiles"]:
+        context["upload_artifacts"].append({
+            "path": f'{context["stage_profiles"]}.tgz'
+        })
     context["upload_artifacts"].append({
         "path": "permset-html.tgz"
     })
@@ -207,6 +407,12 @@ def main():
     python_text = inject_py_file(python_text, 'scripts/read_confluence_db.py')
     python_text = inject_py_file(python_text, 'scripts/update_confluence.py')
     python_text = inject_py_file(python_text, 'scripts/compare_delta.py')
+    python_text = inject_py_file(python_text, 'scripts/permset_changeset.py')
+    # Shared modules are injected last so they end up ahead of the scripts using them
+    python_text = inject_py_file(python_text, 'scripts/permset_model.py')
+    python_text = inject_py_file(python_text, 'scripts/permset_store.py')
+    python_text = inject_py_file(python_text, 'scripts/pipeline_metrics.py')
+    python_text = inject_py_file(python_text, 'scripts/confluence_client.py')
     save_dist(output=python_text, file="local_win_python.py")
 
 def inject_py_file(python_text: str, file: str):
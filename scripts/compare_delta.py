@@ -2,16 +2,34 @@ import os
 import json
 import requests
 import logging
+from collections import Counter
 
+try:
+    from pipeline_metrics import add_stage_items, enable_pipeline_metrics, pipeline_stage, write_pipeline_metrics
+    from permset_model import PermissionSet, PERMISSION_SET_ATTRIBUTES, PERMISSION_SET_SECTIONS
+    from permset_store import PermsetStoreReader
+    from permset_changeset import load_changeset
+except ImportError:
+    # Inlined ahead of this script in local_win_python.py
+    pass
 
 def load_json(json_file):
     """Load the HTML to ID mappings from the JSON file."""
     with open(json_file, 'r') as f:
         return json.load(f)
 
-def compare_files(html_dir, json_data):
-    """Compare HTML files in the directory with the JSON file data."""
-    html_files = set(f for f in os.listdir(html_dir) if f.endswith('.html'))
+def compare_files(html_dir, json_data, changeset=None):
+    """Compare HTML files in the directory with the JSON file data.
+
+    With a changeset the HTML files are those of every current permission set it names, since
+    an incremental run only renders the changed ones.
+    """
+    if changeset is not None:
+        html_files = set(name + '.html' for name in changeset.names)
+    else:
+        # Dotfiles are not reports, e.g. a .xml_to_json-manifest.html left over from versions
+        # of json_to_html that rendered the xml_to_json manifest
+        html_files = set(f for f in os.listdir(html_dir) if f.endswith('.html') and not f.startswith('.'))
     json_files = set(entry['HTML'] for entry in json_data)
 
     # New HTML files
@@ -32,6 +50,104 @@ def compare_files(html_dir, json_data):
 
     return differences
 
+def load_permission_sets(json_dir, store=False, names=None):
+    """Yield (name, PermissionSet) for every permission set xml_to_json wrote to json_dir, or only those in names."""
+    if store:
+        with PermsetStoreReader(json_dir) as reader:
+            for name in reader.names():
+                if names is not None and name not in names:
+                    continue
+                yield name, PermissionSet.from_document(reader.get(name), name)
+        return
+    for file in sorted(os.listdir(json_dir)):
+        # Dotfiles such as the xml_to_json manifest are not permission sets
+        if file.endswith('.json') and not file.startswith('.'):
+            name = file.removesuffix('.json')
+            if names is not None and name not in names:
+                continue
+            yield name, PermissionSet.from_document(load_json(os.path.join(json_dir, file)), name)
+
+def snapshot_permission_set(permission_set):
+    """Reduce a PermissionSet to the JSON-serializable attributes and rows the next run diffs against."""
+    return {
+        "attributes": {attribute: getattr(permission_set, attribute) for attribute in PERMISSION_SET_ATTRIBUTES},
+        "sections": {section: [list(row) for row in rows] for section, rows in permission_set.sections() if rows},
+    }
+
+def diff_section(row_type, key_width, old_rows, new_rows):
+    """Diff two row lists of one section, matching rows on their first key_width fields.
+
+    Rows are hashed into {key: row} maps, so the diff is linear in the number of rows. Rows whose
+    key is repeated on either side (e.g. a field listed twice) cannot be matched one to one; they
+    are compared as whole rows instead, as multisets, and only ever show up as added or removed.
+    Returns {"added", "removed", "changed"} lists of row dicts (changed as before/after pairs),
+    or None.
+    """
+    old_keys = Counter(tuple(row[:key_width]) for row in old_rows)
+    new_keys = Counter(tuple(row[:key_width]) for row in new_rows)
+    repeated = {key for key in old_keys | new_keys if old_keys[key] > 1 or new_keys[key] > 1}
+
+    old = {key: tuple(row) for row in old_rows if (key := tuple(row[:key_width])) not in repeated}
+    new = {key: tuple(row) for row in new_rows if (key := tuple(row[:key_width])) not in repeated}
+    old_repeated = Counter(tuple(row) for row in old_rows if tuple(row[:key_width]) in repeated)
+    new_repeated = Counter(tuple(row) for row in new_rows if tuple(row[:key_width]) in repeated)
+    if old == new and old_repeated == new_repeated:
+        return None
+
+    def as_dict(row):
+        return dict(zip(row_type._fields, row))
+
+    def in_key_order(rows):
+        return sorted(rows, key=lambda row: (str(row[:key_width]), str(row)))
+
+    added = [new[key] for key in new.keys() - old.keys()] + list((new_repeated - old_repeated).elements())
+    removed = [old[key] for key in old.keys() - new.keys()] + list((old_repeated - new_repeated).elements())
+    return {
+        "added": [as_dict(row) for row in in_key_order(added)],
+        "removed": [as_dict(row) for row in in_key_order(removed)],
+        "changed": [{"before": as_dict(old[key]), "after": as_dict(new[key])}
+                    for key in sorted(old.keys() & new.keys(), key=str) if old[key] != new[key]],
+    }
+
+def diff_permission_sets(previous, current):
+    """Compare two {name: snapshot} maps and return one difference entry per added, removed or changed set."""
+    differences = []
+    for name in sorted(current.keys() - previous.keys()):
+        rows = sum(len(rows) for rows in current[name]["sections"].values())
+        differences.append({"status": "added", "permission_set": name, "file": name + '.html', "rows": rows})
+    for name in sorted(previous.keys() - current.keys()):
+        rows = sum(len(rows) for rows in previous[name]["sections"].values())
+        differences.append({"status": "removed", "permission_set": name, "file": name + '.html', "rows": rows})
+
+    for name in sorted(current.keys() & previous.keys()):
+        old, new = previous[name], current[name]
+        if old == new:
+            continue
+        attributes = {attribute: {"before": old["attributes"].get(attribute), "after": new["attributes"].get(attribute)}
+                      for attribute in PERMISSION_SET_ATTRIBUTES
+                      if old["attributes"].get(attribute) != new["attributes"].get(attribute)}
+        sections = {}
+        for section, (row_type, key_width) in PERMISSION_SET_SECTIONS.items():
+            section_diff = diff_section(row_type, key_width, old["sections"].get(section, []), new["sections"].get(section, []))
+            if section_diff:
+                sections[section] = section_diff
+        if attributes or sections:
+            differences.append({"status": "changed", "permission_set": name, "file": name + '.html',
+                                "attributes": attributes, "sections": sections})
+    return differences
+
+def load_snapshot(snapshot_file):
+    """Load the previous run's snapshot, or None when there is none yet."""
+    try:
+        return load_json(snapshot_file)
+    except FileNotFoundError:
+        return None
+
+def save_snapshot(snapshot_file, snapshot):
+    with open(f"{snapshot_file}.tmp", 'w') as f:
+        json.dump(snapshot, f, separators=(',', ':'))
+    os.replace(f"{snapshot_file}.tmp", snapshot_file)
+
 def save_json(output_file, data):
     """Save the comparison results to a JSON file."""
     with open(output_file, 'w') as f:
@@ -47,28 +163,87 @@ def send_permission_set_change_alert(changes):
     else:
         logging.error(f'Failed to send notification: {response.status_code} - {response.text}')
 
-def calculate_diffs(input_dir: str, map_file: str, output: str):
-    logging.basicConfig(level=logging.INFO)
+def calculate_diffs(input_dir: str, map_file: str, output: str, json_dir=None, snapshot=None, store=False,
+                    changeset=None, html_to_ids=None, current_rows=None):
+    """Write the differences of this run to output and send an alert when there are any.
+
+    HTML files new to or missing from the master sheet are always reported. With json_dir (the
+    xml_to_json output, a permsets.ndjson store when store=True) and a snapshot file, every
+    permission set is also diffed row by row against the snapshot the previous run left, which is
+    then replaced with this run's once the alert was sent.
 
-    # Load JSON data
-    json_data = load_json(map_file)
+    With a changeset (see permset_changeset.py) only the changed permission sets are read; the
+    others keep their rows from the previous snapshot and the removed ones are dropped from it.
+    Without a previous snapshot every permission set is read, so the baseline covers them all.
 
-    # Compare HTML files in the directory with JSON data
-    differences = compare_files(input_dir, json_data)
+    When the caller already holds them, html_to_ids are the master sheet rows (map_file is not
+    read) and current_rows maps each permission set that would be read from json_dir to its
+    snapshot_permission_set() (json_dir is not read).
+    """
+    logging.basicConfig(level=logging.INFO)
+
+    with pipeline_stage("compare_delta.compare"):
+        # Load JSON data
+        json_data = load_json(map_file) if html_to_ids is None else html_to_ids
+
+        # Compare HTML files in the directory with JSON data
+        differences = compare_files(input_dir, json_data, changeset)
+    add_stage_items("compare_delta.compare", len(json_data))
+
+    if json_dir and snapshot:
+        with pipeline_stage("compare_delta.rows"):
+            previous = load_snapshot(snapshot)
+            current = {}
+            if changeset is not None and previous is not None:
+                current = {name: rows for name, rows in previous.items() if name not in changeset.removed}
+            if current_rows is not None:
+                current.update(current_rows)
+            else:
+                names = changeset.changed if changeset is not None and previous is not None else None
+                current.update((name, snapshot_permission_set(permission_set)) for name, permission_set
+                               in load_permission_sets(json_dir, store, names))
+            if previous is None:
+                logging.info(f"No snapshot at {snapshot} yet; recording {len(current)} permission sets as the baseline")
+                if changeset is not None and len(current) < len(changeset.names):
+                    logging.warning(f"Only {len(current)} of {len(changeset.names)} permission sets have JSON in {json_dir}; "
+                                    f"the others enter the snapshot once they change")
+            else:
+                row_differences = diff_permission_sets(previous, current)
+                logging.info(f"{len(row_differences)} of {len(current)} permission sets added, removed or changed")
+                differences.extend(row_differences)
+        add_stage_items("compare_delta.rows", len(current))
 
     # Save the differences to the output JSON file
     save_json(output, differences)
 
     # Send notification if there are any differences
     if differences:
-        send_permission_set_change_alert(differences)
+        with pipeline_stage("compare_delta.notify"):
+            send_permission_set_change_alert(differences)
+
+    # Only move the snapshot on once the alert went out; when it fails, the next run diffs
+    # against the same snapshot and reports these rows again
+    if json_dir and snapshot:
+        save_snapshot(snapshot, current)
 
 if __name__ == "__main__":
     import argparse
     parser = argparse.ArgumentParser(description="Compare HTML files to JSON data.")
-    parser.add_argument("-i", "input_dir", help="Input directory with HTML files")
-    parser.add_argument("-m", "map_file", help="JSON file with HTML to ID mappings")
+    parser.add_argument("-i", "--input_dir", required=True, help="Input directory with HTML files")
+    parser.add_argument("-m", "--map_file", required=True, help="JSON file with HTML to ID mappings")
     parser.add_argument("-o", "--output", help="Output file for the differences", default="differences.json")
+    parser.add_argument("-j", "--json_dir", required=False, help="xml_to_json output directory, for row-level differences")
+    parser.add_argument("-s", "--snapshot", required=False, help="Snapshot of the previous run's permission rows; replaced with this run's")
+    parser.add_argument("--store", action="store_true", help="Read permission sets from the permsets.ndjson store in --json_dir")
+    parser.add_argument("--changeset", required=False, help="Only diff the permission sets changed in this change set file")
+    parser.add_argument("--timings", required=False, help="Write per-stage timings to this JSON report")
+    parser.add_argument("--profile", required=False, help="Dump cProfile output per stage into this directory")
     args = parser.parse_args()
 
-    calculate_diffs(input_dir=args.input_dir, map_file=args.map_file, output=args.output)
+    if args.timings or args.profile:
+        enable_pipeline_metrics(profile_dir=args.profile)
+    try:
+        calculate_diffs(input_dir=args.input_dir, map_file=args.map_file, output=args.output, json_dir=args.json_dir,
+                        snapshot=args.snapshot, store=args.store, changeset=load_changeset(args.changeset))
+    finally:
+        write_pipeline_metrics(args.timings)
@@ -0,0 +1,258 @@
+import os
+import time
+import random
+import logging
+import threading
+from email.utils import parsedate_to_datetime
+import requests
+from requests.adapters import HTTPAdapter
+from requests.auth import HTTPBasicAuth
+
+
+def get_confluence_env():
+    """Retrieve environment variables for Confluence."""
+    return {
+        "space": os.getenv('CONFLUENCE_SPACE'),
+        "email": os.getenv('CONFLUENCE_EMAIL'),
+        "instance": os.getenv('CONFLUENCE_INSTANCE'),
+        "api_token": os.getenv('CONFLUENCE_TOKEN'),
+    }
+
+
+class PageVersionConflict(Exception):
+    """Raised when Confluence rejects an update because the page is no longer at the expected version."""
+
+
+# Responses that mean "slow down or try again": throttling and overloaded/unreachable upstreams
+RETRY_STATUSES = (429, 502, 503, 504)
+
+
+def parse_retry_after(value):
+    """Return the delay in seconds requested by a Retry-After header (seconds or HTTP date), or None."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class RequestScheduler:
+    """Pace requests shared by every worker thread of a client.
+
+    Three limits apply before a request may start:
+      - a pause set from Retry-After, which holds back every worker, not just the throttled one;
+      - a token bucket of rate requests/second (bursts up to burst), when a rate is given;
+      - an AIMD concurrency limit: +1/limit per success up to max_concurrency, halved on a
+        throttled response. Only requests started after the last decrease can halve it again, so
+        one burst of 429s counts once while throttling that persists keeps backing off.
+    """
+
+    def __init__(self, max_concurrency, rate=None, burst=None, min_concurrency=1):
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.concurrency = float(max_concurrency)
+        self.rate = rate
+        self.burst = burst or (max(1.0, rate) if rate else 0)
+        self.tokens = self.burst
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self.throttled = 0
+        self.retries = 0
+        self._refilled = time.monotonic()
+        self._decreased = float('-inf')
+        self._cond = threading.Condition()
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self._refilled) * self.rate)
+        self._refilled = now
+
+    def acquire(self):
+        """Block until a request may start; returns its start time, to be passed to release()."""
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    self._cond.wait(self.paused_until - now)
+                    continue
+                if self.in_flight >= int(self.concurrency):
+                    self._cond.wait()
+                    continue
+                if self.rate:
+                    self._refill(now)
+                    if self.tokens < 1:
+                        self._cond.wait((1 - self.tokens) / self.rate)
+                        continue
+                    self.tokens -= 1
+                self.in_flight += 1
+                return now
+
+    def release(self, started, throttled=False, retry_after=None):
+        """Finish a request started at started, adjusting the concurrency limit from its outcome."""
+        with self._cond:
+            self.in_flight -= 1
+            now = time.monotonic()
+            if throttled:
+                self.throttled += 1
+                if started >= self._decreased:
+                    self.concurrency = max(self.min_concurrency, self.concurrency / 2)
+                    self._decreased = now
+                if retry_after:
+                    self.paused_until = max(self.paused_until, now + retry_after)
+            else:
+                self.concurrency = min(self.max_concurrency, self.concurrency + 1 / self.concurrency)
+            self._cond.notify_all()
+
+    def record_retry(self):
+        with self._cond:
+            self.retries += 1
+
+    def stats(self):
+        with self._cond:
+            return {"concurrency": round(self.concurrency, 2), "throttled": self.throttled, "retries": self.retries}
+
+
+class ConfluenceClient:
+    """Confluence REST client sharing one pooled keep-alive Session between worker threads.
+
+    Every request reuses authenticated connections from the pool instead of paying a fresh TCP
+    and TLS handshake, and every request has explicit connect/read timeouts. CONFLUENCE_BASE_URL
+    (e.g. http://127.0.0.1:8080/wiki) points the client at a stand-in server instead of
+    https://<instance>.atlassian.net/wiki.
+
+    Requests go through a RequestScheduler: responses in RETRY_STATUSES and connection errors are
+    retried up to max_retries times, honoring Retry-After or else backing off exponentially with
+    full jitter (capped at backoff_max seconds).
+    """
+
+    def __init__(self, pool_size=10, connect_timeout=10, read_timeout=60, base_url=None, rate_limit=None,
+                 max_retries=5, backoff_base=0.5, backoff_max=30.0):
+        confluence_env = get_confluence_env()
+        self.space = confluence_env["space"]
+        self.base_url = (base_url or os.getenv('CONFLUENCE_BASE_URL')
+                         or f"https://{confluence_env['instance']}.atlassian.net/wiki").rstrip('/')
+        self.timeout = (connect_timeout, read_timeout)
+
+        self.session = requests.Session()
+        self.session.auth = HTTPBasicAuth(confluence_env["email"], confluence_env["api_token"])
+        self.session.headers.update({"Accept": "application/json"})
+        # One pool per host; size it to the number of workers so none of them waits for a connection
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=True)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        self.scheduler = RequestScheduler(pool_size, rate=rate_limit)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+    def _backoff(self, attempt):
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def _request(self, method, url, **kwargs):
+        """Send a request through the scheduler, retrying throttled and transient failures."""
+        for attempt in range(self.max_retries + 1):
+            started = self.scheduler.acquire()
+            try:
+                response = self.session.request(method, url, timeout=self.timeout, **kwargs)
+            except requests.ConnectionError as e:
+                self.scheduler.release(started, throttled=True)
+                if attempt == self.max_retries:
+                    raise
+                delay = self._backoff(attempt)
+                logging.warning(f"{method} {url} failed ({e}); retrying in {delay:.1f}s")
+            else:
+                retryable = response.status_code in RETRY_STATUSES
+                retry_after = parse_retry_after(response.headers.get("Retry-After")) if retryable else None
+                self.scheduler.release(started, throttled=retryable, retry_after=retry_after)
+                if not retryable or attempt == self.max_retries:
+                    return response
+                # With Retry-After the scheduler already holds every worker back until it passes
+                delay = 0 if retry_after is not None else self._backoff(attempt)
+                logging.warning(f"{method} {url} returned {response.status_code}; retrying in {retry_after or delay:.1f}s")
+            self.scheduler.record_retry()
+            time.sleep(delay)
+
+    def get_content_url(self, page_id):
+        """Construct the Confluence API URL for a page."""
+        return f"{self.base_url}/rest/api/content/{page_id}"
+
+    def get_page(self, page_id, expand=None):
+        """Fetch a Confluence page, optionally expanding e.g. 'body.storage' or 'version'."""
+        params = {"expand": expand} if expand else None
+        response = self._request("GET", self.get_content_url(page_id), params=params)
+        if response.status_code == 200:
+            return response.json()
+        raise Exception(f"Failed to fetch the page: {response.status_code} - {response.text}")
+
+    def search_content(self, cql, expand=None, start=0, limit=50):
+        """Run one page of a CQL content search, returning the raw response (results, size, _links)."""
+        params = {"cql": cql, "start": start, "limit": limit}
+        if expand:
+            params["expand"] = expand
+        response = self._request("GET", f"{self.base_url}/rest/api/content/search", params=params)
+        if response.status_code == 200:
+            return response.json()
+        raise Exception(f"Failed to search content: {response.status_code} - {response.text}")
+
+    def search_all_content(self, cql, expand=None, limit=50):
+        """Yield every result of a CQL content search, following pagination until there is no next page."""
+        start = 0
+        while True:
+            page = self.search_content(cql, expand=expand, start=start, limit=limit)
+            results = page.get("results", [])
+            yield from results
+            if not results or "next" not in page.get("_links", {}):
+                return
+            start += len(results)
+
+    def get_child_pages(self, page_id, expand=None, limit=50):
+        """Yield every child page of a page, following pagination until there is no next page."""
+        start = 0
+        while True:
+            params = {"start": start, "limit": limit}
+            if expand:
+                params["expand"] = expand
+            response = self._request("GET", f"{self.get_content_url(page_id)}/child/page", params=params)
+            if response.status_code != 200:
+                raise Exception(f"Failed to fetch the child pages: {response.status_code} - {response.text}")
+            page = response.json()
+            results = page.get("results", [])
+            yield from results
+            if not results or "next" not in page.get("_links", {}):
+                return
+            start += len(results)
+
+    def update_page(self, page_id, html_content, version, page_title):
+        """Replace a page's storage body, writing it as the given version number."""
+        data = {
+            "version": {"number": version},
+            "title": page_title,
+            "type": "page",
+            "space": {"key": self.space},
+            "body": {
+                "storage": {
+                    "value": html_content,
+                    "representation": "storage"
+                }
+            }
+        }
+        response = self._request("PUT", self.get_content_url(page_id), json=data)
+        if response.status_code == 200:
+            return response.json()
+        if response.status_code == 409:
+            raise PageVersionConflict(f"Failed to update the page: {response.status_code} - {response.text}")
+        raise Exception(f"Failed to update the page: {response.status_code} - {response.text}")
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -1,11 +1,23 @@
-from jinja2 import Environment, FileSystemLoader
+from jinja2 import Environment, DictLoader, FileSystemBytecodeCache
 import os
 import json
 import logging
-from concurrent.futures import ThreadPoolExecutor
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import argparse
 import datetime
 
+try:
+    from permset_model import PermissionSet
+    from permset_store import PermsetStoreReader
+    from permset_changeset import load_changeset
+    from pipeline_metrics import (enable_pipeline_metrics, pipeline_stage, measured_stage_item, write_pipeline_metrics,
+                                  MemoryBudget, MEMORY_PER_INPUT_BYTE, estimate_item_memory, submit_within_budget)
+except ImportError:
+    # local_win_python.py inlines the shared modules ahead of this script
+    pass
+
 def make_template():
     return """
 <body>
@@ -27,7 +39,7 @@ def make_template():
 {%- if permission_set.sessionTimeout %}
 <p><strong>Session Timeout:</strong> {{ permission_set.sessionTimeout }}</p>
 {%- endif %}
-<p><small>YYYY-MM-DD | #ORG</small></p>
+<p><small>{{ report_date }} | {{ org_name }}</small></p>
 <hr />
 
 {% if permission_set.objectPermissions %}
@@ -47,35 +59,17 @@ def make_template():
         </tr>
     </thead>
     <tbody>
-        {%- if permission_set.objectPermissions is iterable %}
-            {%- if permission_set.objectPermissions is mapping %}
-                <tr>
-                    <td>{{ permission_set.objectPermissions.object }}</td>
-                    <td>{{ permission_set.objectPermissions.allowCreate }}</td>
-                    <td>{{ permission_set.objectPermissions.allowRead }}</td>
-                    <td>{{ permission_set.objectPermissions.allowEdit }}</td>
-                    <td>{{ permission_set.objectPermissions.allowDelete }}</td>
-                    <td>{{ permission_set.objectPermissions.modifyAllRecords }}</td>
-                    <td>{{ permission_set.objectPermissions.viewAllRecords }}</td>
-                </tr>
-            {%- else %}
                 {%- for object_permission in permission_set.objectPermissions %}
                 <tr>
-                    <td>{{ object_permission.object }}</td>
-                    <td>{{ object_permission.allowCreate }}</td>
-                    <td>{{ object_permission.allowRead }}</td>
-                    <td>{{ object_permission.allowEdit }}</td>
-                    <td>{{ object_permission.allowDelete }}</td>
-                    <td>{{ object_permission.modifyAllRecords }}</td>
-                    <td>{{ object_permission.viewAllRecords }}</td>
+                    <td>{{ object_permission.object | cell }}</td>
+                    <td>{{ object_permission.allowCreate | cell }}</td>
+                    <td>{{ object_permission.allowRead | cell }}</td>
+                    <td>{{ object_permission.allowEdit | cell }}</td>
+                    <td>{{ object_permission.allowDelete | cell }}</td>
+                    <td>{{ object_permission.modifyAllRecords | cell }}</td>
+                    <td>{{ object_permission.viewAllRecords | cell }}</td>
                 </tr>
                 {%- endfor %}
-            {%- endif %}
-        {%- else %}
-            <tr>
-                <td colspan="7">No object permissions available.</td>
-            </tr>
-        {%- endif %}
     </tbody>
 </table>
 
@@ -96,31 +90,14 @@ def make_template():
         </tr>
     </thead>
     <tbody>
-        {%- if permission_set.fieldPermissions is iterable %}
-        {%- if permission_set.fieldPermissions is mapping %}
-        {# This means that we have only one field permission. #}
-        <tr>
-            <td>{{ permission_set.fieldPermissions.field.split('.')[0] if permission_set.fieldPermissions.field is not none else '' }}</td>
-            <td>{{ permission_set.fieldPermissions.field.split('.')[1] if permission_set.fieldPermissions.field is not none and permission_set.fieldPermissions.field.split('.')|length > 1 else '' }}</td>
-            <td>{{ permission_set.fieldPermissions.readable }}</td>
-            <td>{{ permission_set.fieldPermissions.editable }}</td>
-        </tr>
-        {%- else %}
             {%- for field_permission in permission_set.fieldPermissions %}
-            {# This means that we have multiple field permissions. #}
-            <tr> 
-                <td>{{ field_permission.field.split('.')[0] if field_permission.field is not none else '' }}</td>
-                <td>{{ field_permission.field.split('.')[1] if field_permission.field is not none and field_permission.field.split('.')|length > 1 else '' }}</td>
-                <td>{{ field_permission.readable }}</td>
-                <td>{{ field_permission.editable }}</td>
-            </tr>
-            {%- endfor %}
-        {%- endif %}
-        {%- else %}
             <tr>
-                <td colspan="4">No field permissions available.</td>
+                <td>{{ field_permission.object | cell }}</td>
+                <td>{{ field_permission.field | cell }}</td>
+                <td>{{ field_permission.readable | cell }}</td>
+                <td>{{ field_permission.editable | cell }}</td>
             </tr>
-        {%- endif %}
+            {%- endfor %}
     </tbody>
 </table>
 
@@ -139,25 +116,12 @@ def make_template():
         </tr>
     </thead>
     <tbody>
-        {%- if permission_set.applicationVisibility is iterable %}
-            {%- if permission_set.applicationVisibility is mapping %}
-                <tr>
-                    <td>{{ permission_set.applicationVisibility.application }}</td>
-                    <td>{{ permission_set.applicationVisibility.visibility }}</td>
-                </tr>
-            {%- else %}
                 {%- for application_visibility in permission_set.applicationVisibility %}
                 <tr>
-                    <td>{{ application_visibility.application }}</td>
-                    <td>{{ application_visibility.visibility }}</td>
+                    <td>{{ application_visibility.application | cell }}</td>
+                    <td>{{ application_visibility.visibility | cell }}</td>
                 </tr>
                 {%- endfor %}
-            {%- endif %}
-        {%- else %}
-            <tr>
-                <td colspan="2">No application visibility available.</td>
-            </tr>
-        {%- endif %}
     </tbody>
 </table>
 
@@ -176,25 +140,12 @@ def make_template():
         </tr>
     </thead>
     <tbody>
-        {%- if permission_set.tabSettings is iterable %}
-            {%- if permission_set.tabSettings is mapping %}
-                <tr>
-                    <td>{{ permission_set.tabSettings.tab }}</td>
-                    <td>{{ permission_set.tabSettings.visibility }}</td>
-                </tr>
-            {%- else %}
                 {%- for tab_setting in permission_set.tabSettings %}
                 <tr>
-                    <td>{{ tab_setting.tab }}</td>
-                    <td>{{ tab_setting.visibility }}</td>
+                    <td>{{ tab_setting.tab | cell }}</td>
+                    <td>{{ tab_setting.visibility | cell }}</td>
                 </tr>
                 {%- endfor %}
-            {%- endif %}
-        {%- else %}
-            <tr>
-                <td colspan="2">No tab settings available.</td>
-            </tr>
-        {%- endif %}
     </tbody>
 </table>
 
@@ -213,25 +164,12 @@ def make_template():
         </tr>
     </thead>
     <tbody>
-        {%- if permission_set.classAccesses is iterable %}
-            {%- if permission_set.classAccesses is mapping %}
-                <tr>
-                    <td>{{ permission_set.classAccesses.apexClass }}</td>
-                    <td>{{ permission_set.classAccesses.enabled }}</td>
-                </tr>
-            {%- else %}
                 {%- for apex_class_permission in permission_set.classAccesses %}
                 <tr>
-                    <td>{{ apex_class_permission.apexClass }}</td>
-                    <td>{{ apex_class_permission.enabled }}</td>
+                    <td>{{ apex_class_permission.apexClass | cell }}</td>
+                    <td>{{ apex_class_permission.enabled | cell }}</td>
                 </tr>
                 {%- endfor %}
-            {%- endif %}
-        {%- else %}
-            <tr>
-                <td colspan="2">No apex class permissions available.</td>
-            </tr>
-        {%- endif %}
     </tbody>
 </table>
 
@@ -250,25 +188,12 @@ def make_template():
         </tr>
     </thead>
     <tbody>
-        {%- if permission_set.apexPagePermissions is iterable %}
-            {%- if permission_set.apexPagePermissions is mapping %}
-                <tr>
-                    <td>{{ permission_set.apexPagePermissions.apexPage }}</td>
-                    <td>{{ permission_set.apexPagePermissions.enabled }}</td>
-                </tr>
-            {%- else %}
                 {%- for apex_page_permission in permission_set.apexPagePermissions %}
                 <tr>
-                    <td>{{ apex_page_permission.apexPage }}</td>
-                    <td>{{ apex_page_permission.enabled }}</td>
+                    <td>{{ apex_page_permission.apexPage | cell }}</td>
+                    <td>{{ apex_page_permission.enabled | cell }}</td>
                 </tr>
                 {%- endfor %}
-            {%- endif %}
-        {%- else %}
-            <tr>
-                <td colspan="2">No apex page permissions available.</td>
-            </tr>
-        {%- endif %}
     </tbody>
 </table>
 
@@ -286,23 +211,11 @@ def make_template():
         </tr>
     </thead>
     <tbody>
-        {%- if permission_set.loginIpRanges is iterable %}
-            {%- if permission_set.loginIpRanges is mapping %}
-                <tr>
-                    <td>{{ permission_set.loginIpRanges.loginIpRange }}</td>
-                </tr>
-            {%- else %}
                 {%- for login_ip_range in permission_set.loginIpRanges %}
                 <tr>
-                    <td>{{ login_ip_range.loginIpRange }}</td>
+                    <td>{{ login_ip_range.loginIpRange | cell }}</td>
                 </tr>
                 {%- endfor %}
-            {%- endif %}
-        {%- else %}
-            <tr>
-                <td colspan="2">No login IP ranges available.</td>
-            </tr>
-        {%- endif %}
     </tbody>
 </table>
 
@@ -320,23 +233,11 @@ def make_template():
         </tr>
     </thead>
     <tbody>
-        {%- if permission_set.loginHours is iterable %}
-            {%- if permission_set.loginHours is mapping %}
-                <tr>
-                    <td>{{ permission_set.loginHours.loginHours }}</td>
-                </tr>
-            {%- else %}
                 {%- for login_hour in permission_set.loginHours %}
                 <tr>
-                    <td>{{ login_hour.loginHours }}</td>
+                    <td>{{ login_hour.loginHours | cell }}</td>
                 </tr>
                 {%- endfor %}
-            {%- endif %}
-        {%- else %}
-            <tr>
-                <td colspan="2">No login hours available.</td>
-            </tr>
-        {%- endif %}
     </tbody>
 </table>
 
@@ -355,25 +256,12 @@ def make_template():
         </tr>
     </thead>
     <tbody>
-        {%- if permission_set.recordTypePermissions is iterable %}
-            {%- if permission_set.recordTypePermissions is mapping %}
-                <tr>
-                    <td>{{ permission_set.recordTypePermissions.recordType }}</td>
-                    <td>{{ permission_set.recordTypePermissions.enabled }}</td>
-                </tr>
-            {%- else %}
                 {%- for record_type_permission in permission_set.recordTypePermissions %}
                 <tr>
-                    <td>{{ record_type_permission.recordType }}</td>
-                    <td>{{ record_type_permission.enabled }}</td>
+                    <td>{{ record_type_permission.recordType | cell }}</td>
+                    <td>{{ record_type_permission.enabled | cell }}</td>
                 </tr>
                 {%- endfor %}
-            {%- endif %}
-        {%- else %}
-            <tr>
-                <td colspan="2">No record type permissions available.</td>
-            </tr>
-        {%- endif %}
     </tbody>
 </table>
 
@@ -392,25 +280,12 @@ def make_template():
         </tr>
     </thead>
     <tbody>
-        {%- if permission_set.customPermissions is iterable %}
-            {%- if permission_set.customPermissions is mapping %}
-                <tr>
-                    <td>{{ permission_set.customPermissions.customPermission }}</td>
-                    <td>{{ permission_set.customPermissions.enabled }}</td>
-                </tr>
-            {%- else %}
                 {%- for custom_permission in permission_set.customPermissions %}
                 <tr>
-                    <td>{{ custom_permission.customPermission }}</td>
-                    <td>{{ custom_permission.enabled }}</td>
+                    <td>{{ custom_permission.customPermission | cell }}</td>
+                    <td>{{ custom_permission.enabled | cell }}</td>
                 </tr>
                 {%- endfor %}
-            {%- endif %}
-        {%- else %}
-            <tr>
-                <td colspan="2">No custom permissions available.</td>
-            </tr>
-        {%- endif %}
     </tbody>
 </table>
 
@@ -428,23 +303,11 @@ def make_template():
         </tr>
     </thead>
     <tbody>
-        {%- if permission_set.oauthScopes is iterable %}
-            {%- if permission_set.oauthScopes is mapping %}
-                <tr>
-                    <td>{{ permission_set.oauthScopes.oauthScope }}</td>
-                </tr>
-            {%- else %}
                 {%- for oauth_scope in permission_set.oauthScopes %}
                 <tr>
-                    <td>{{ oauth_scope.oauthScope }}</td>
+                    <td>{{ oauth_scope.oauthScope | cell }}</td>
                 </tr>
                 {%- endfor %}
-            {%- endif %}
-        {%- else %}
-            <tr>
-                <td colspan="2">No OAuth scopes available.</td>
-            </tr>
-        {%- endif %}
     </tbody>
 </table>
 
@@ -463,25 +326,12 @@ def make_template():
         </tr>
     </thead>
     <tbody>
-        {%- if permission_set.otherSettings is iterable %}
-            {%- if permission_set.otherSettings is mapping %}
-                <tr>
-                    <td>{{ permission_set.otherSettings.setting }}</td>
-                    <td>{{ permission_set.otherSettings.value }}</td>
-                </tr>
-            {%- else %}
                 {%- for other_setting in permission_set.otherSettings %}
                 <tr>
-                    <td>{{ other_setting.setting }}</td>
-                    <td>{{ other_setting.value }}</td>
+                    <td>{{ other_setting.setting | cell }}</td>
+                    <td>{{ other_setting.value | cell }}</td>
                 </tr>
                 {%- endfor %}
-            {%- endif %}
-        {%- else %}
-            <tr>
-                <td colspan="2">No other settings available.</td>
-            </tr>
-        {%- endif %}
     </tbody>
 </table>
 
@@ -492,61 +342,258 @@ def make_template():
 </body>
 """
 
-def export_html_file(json_file, output_dir, org_name):
+_REPORT_TEMPLATE = None
+_REPORT_TEMPLATE_LOCK = threading.Lock()
+
+def format_cell(value):
+    """Standardize true and false table cells for ease of use."""
+    if value == 'true':
+        return "<span style='color: #E08738; font-weight: bold'>TRUE</span>"
+    if value == 'false':
+        return 'FALSE'
+    return value
+
+def make_report_environment(bytecode_cache=None):
+    """Return a jinja2 Environment that can compile the report template, with the filters it uses."""
+    env = Environment(loader=DictLoader({'permission_set.html': make_template()}), bytecode_cache=bytecode_cache)
+    env.filters['cell'] = format_cell
+    return env
+
+def get_report_template(cache_dir=None):
+    """Return the report template, compiling it at most once per process.
+
+    The compiled bytecode is cached on disk in cache_dir (default: permset-jinja-cache in the
+    system temp directory), so new processes and CI runs restoring that directory skip compilation.
+    """
+    global _REPORT_TEMPLATE
+    if _REPORT_TEMPLATE is None:
+        with _REPORT_TEMPLATE_LOCK:
+            if _REPORT_TEMPLATE is None:
+                cache_dir = cache_dir or os.path.join(tempfile.gettempdir(), 'permset-jinja-cache')
+                os.makedirs(cache_dir, exist_ok=True)
+                env = make_report_environment(FileSystemBytecodeCache(cache_dir))
+                _REPORT_TEMPLATE = env.get_template('permission_set.html')
+    return _REPORT_TEMPLATE
+
+def get_report_context(permission_set, org_name):
+    """Build the template variables for a parsed permission set document (normalized via PermissionSet)."""
+    # Cell styling and the date/org stamp are applied while rendering, so the output is produced
+    # in a single pass with no post-processing copies of the document.
+    timestamp = datetime.datetime.now().strftime('%Y-%b-%d')
+    return {"permission_set": PermissionSet.from_document(permission_set), "report_date": timestamp, "org_name": org_name}
+
+def render_permission_set_html(permission_set, org_name):
+    """Render the HTML report for a parsed permission set document."""
+    return get_report_template().render(get_report_context(permission_set, org_name))
+
+def write_permission_set_html(permission_set, org_name, html_file, stream=False):
+    """Render the HTML report for a parsed permission set document to html_file.
+
+    With stream=True the template output is written chunk by chunk through a buffered file
+    handle instead of being built as one string, so peak memory does not grow with table size.
+    """
+    if not stream:
+        html_content = render_permission_set_html(permission_set, org_name)
+        with open(html_file, 'w') as f:
+            f.write(html_content)
+        return
+
+    chunks = get_report_template().generate(get_report_context(permission_set, org_name))
+    with open(html_file, 'w', buffering=1024 * 1024) as f:
+        for chunk in chunks:
+            f.write(chunk)
+
+def export_html_file(json_file, output_dir, org_name, stream=False):
     with open(json_file, 'r') as f:
         permission_set = json.load(f)
-    
-    
-
-    # Create a Jinja2 environment and render the template
-    env = Environment(loader=FileSystemLoader('.'))
-    template = env.from_string(make_template())
-    html_content = template.render(permission_set=permission_set['PermissionSet'])
-    timestamp = datetime.datetime.now().strftime('%Y-%b-%d')
-    html_content = html_content.replace('YYYY-MM-DD', timestamp)
-    html_content = html_content.replace('#ORG', org_name)
-
-    # standardize the true and false values for ease of use
-    html_content = html_content.replace("<td>false</td>", "<td>FALSE</td>")
-    html_content = html_content.replace("<td>true</td>", "<td><span style='color: #E08738; font-weight: bold'>TRUE</span></td>")
 
     html_file = os.path.join(output_dir, os.path.basename(json_file).removesuffix('.json') + '.html')
-    
-    with open(html_file, 'w') as f:
-        f.write(html_content)
+    write_permission_set_html(permission_set, org_name, html_file, stream)
 
     logging.info(f"Converted {json_file} to {html_file}")
 
-def process_json_to_html_files(input_dir, output_dir, extension, org_name):
-    """Process files with the specified extension in the input directory and save them as HTML in the output directory."""
+def load_xml_permission_set(xml_file, json_dir=None):
+    """Parse an XML permission set; returns (name, parsed document).
+
+    When json_dir is given the parsed document is also written there as indented JSON, matching
+    xml_to_json's output, for artifact upload.
+    """
+    import xmltodict
+    with open(xml_file, 'r', encoding='utf-8') as f:
+        permission_set = xmltodict.parse(f.read())
+
+    name = os.path.basename(xml_file).removesuffix('.xml')
+    if json_dir:
+        with open(os.path.join(json_dir, name + '.json'), 'w', encoding='utf-8') as f:
+            json.dump(permission_set, f, indent=4)
+    return name, permission_set
+
+def export_html_from_xml(xml_file, output_dir, org_name, json_dir=None, stream=False):
+    """Parse an XML permission set and render it to HTML in one step, without a JSON intermediate."""
+    name, permission_set = load_xml_permission_set(xml_file, json_dir)
+
+    html_file = os.path.join(output_dir, name + '.html')
+    write_permission_set_html(permission_set, org_name, html_file, stream)
+
+    logging.info(f"Converted {xml_file} to {html_file}")
+
+def export_html_from_store(reader, name, output_dir, org_name, stream=False):
+    """Render one permission set read by name from a PermsetStoreReader."""
+    html_file = os.path.join(output_dir, name + '.html')
+    write_permission_set_html(reader.get(name), org_name, html_file, stream)
+
+    logging.info(f"Converted {name} to {html_file}")
+
+def remove_stale_outputs(changeset, output_dir, json_dir=None):
+    """Delete the HTML (and fused JSON) output of the permission sets a change set lists as removed."""
+    for name in changeset.removed:
+        for path in (os.path.join(output_dir, name + '.html'), json_dir and os.path.join(json_dir, name + '.json')):
+            if path and os.path.exists(path):
+                os.remove(path)
+                logging.info(f"Removed {path}")
+
+def wait_for_renders(futures):
+    """Wait for render futures mapped to the file or name they render; log failures and return how many failed."""
+    failures = 0
+    for future in as_completed(futures):
+        try:
+            future.result()
+        except Exception as e:
+            failures += 1
+            logging.error(f"Failed to convert {futures[future]}: {e}")
+    return failures
+
+def process_json_to_html_files(input_dir, output_dir, extension, org_name, store=False, template_cache=None,
+                               stream=False, changeset=None, memory_budget=None):
+    """Process files with the specified extension in the input directory and save them as HTML in the output directory.
+
+    With store=True the input directory holds a permsets.ndjson store written by xml_to_json
+    --store, and every permission set in it is rendered. template_cache is the directory used
+    for the compiled template's bytecode cache. stream=True writes each report to disk as it is
+    rendered (see write_permission_set_html). With a changeset (see permset_changeset.py) only the
+    permission sets it lists as changed are rendered and the reports of removed ones are deleted.
+    memory_budget (bytes) caps the estimated memory of the reports rendered at once (see
+    pipeline_metrics.MemoryBudget). Failed reports are logged and reported with a RuntimeError
+    once every one has been attempted.
+    """
     logging.basicConfig(level=logging.DEBUG)
+    get_report_template(template_cache)
     
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
         logging.debug(f"Created output directory: {output_dir}")
-
-    # Find files with the given extension in the input directory
-    files = [f for f in os.listdir(input_dir) if f.endswith(extension)]
+    if changeset is not None:
+        remove_stale_outputs(changeset, output_dir)
+
+    budget = MemoryBudget(memory_budget) if memory_budget else None
+    if store:
+        with pipeline_stage("json_to_html.render"), PermsetStoreReader(input_dir) as reader, ThreadPoolExecutor() as executor:
+            names = reader.names()
+            if changeset is not None:
+                names = [name for name in names if name in changeset.changed]
+            logging.debug(f"Found {len(names)} permission sets in the store in {input_dir}")
+            futures = {submit_within_budget(executor, budget, reader.index[name][1] * MEMORY_PER_INPUT_BYTE, measured_stage_item,
+                                            "json_to_html.render", name, export_html_from_store, reader, name, output_dir, org_name,
+                                            stream): name
+                       for name in names}
+            failures = wait_for_renders(futures)
+        logging.info(f"Converted {len(names) - failures} permission sets to HTML in {output_dir}")
+        if failures:
+            raise RuntimeError(f"Failed to convert {failures} of {len(names)} permission sets to HTML")
+        return
+
+    # Find files with the given extension in the input directory, skipping dotfiles such as
+    # the xml_to_json manifest
+    files = [f for f in os.listdir(input_dir) if f.endswith(extension) and not f.startswith('.')]
+    if changeset is not None:
+        files = [f for f in files if os.path.splitext(f)[0] in changeset.changed]
     logging.debug(f"Found {len(files)} files with extension {extension} in {input_dir} - {files}")
 
-    with ThreadPoolExecutor() as executor:
+    futures = {}
+    with pipeline_stage("json_to_html.render"), ThreadPoolExecutor() as executor:
         for file in files:
             json_filename = os.path.join(input_dir, file)
 
             # Submit each file for parallel processing
             logging.debug(f"Processing {json_filename}")
-            executor.submit(export_html_file, json_filename, output_dir, org_name)
+            futures[submit_within_budget(executor, budget, estimate_item_memory(json_filename), measured_stage_item,
+                                         "json_to_html.render", file, export_html_file, json_filename, output_dir, org_name,
+                                         stream)] = file
+        failures = wait_for_renders(futures)
+
+    logging.info(f"Converted {len(files) - failures} files to HTML in {output_dir}")
+    if failures:
+        raise RuntimeError(f"Failed to convert {failures} of {len(files)} files to HTML")
+
+def process_xml_to_html_files(input_dir, output_dir, extension, org_name, json_dir=None, template_cache=None,
+                              stream=False, changeset=None, memory_budget=None):
+    """Render XML permission sets in the input directory straight to HTML in the output directory.
+
+    This is the fused alternative to process_xml_to_json_files followed by process_json_to_html_files;
+    JSON is only written when json_dir is given. A changeset and memory_budget limit the work as in
+    process_json_to_html_files.
+    """
+    logging.basicConfig(level=logging.DEBUG)
+    get_report_template(template_cache)
 
-    logging.info(f"Converted {len(files)} files to HTML in {output_dir}")
+    for directory in (output_dir, json_dir):
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+            logging.debug(f"Created output directory: {directory}")
+
+    # Find files with the given extension in the input directory
+    files = [f for f in os.listdir(input_dir) if f.endswith(extension)]
+    if changeset is not None:
+        files = [f for f in files if os.path.splitext(f)[0] in changeset.changed]
+        remove_stale_outputs(changeset, output_dir, json_dir)
+    logging.debug(f"Found {len(files)} files with extension {extension} in {input_dir} - {files}")
+
+    budget = MemoryBudget(memory_budget) if memory_budget else None
+    with pipeline_stage("json_to_html.render"), ThreadPoolExecutor() as executor:
+        futures = {submit_within_budget(executor, budget, estimate_item_memory(os.path.join(input_dir, file)),
+                                        measured_stage_item, "json_to_html.render", file, export_html_from_xml,
+                                        os.path.join(input_dir, file), output_dir, org_name, json_dir, stream): file
+                   for file in files}
+        failures = wait_for_renders(futures)
+
+    logging.info(f"Converted {len(files) - failures} files to HTML in {output_dir}")
+    if failures:
+        raise RuntimeError(f"Failed to convert {failures} of {len(files)} files to HTML")
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Convert JSON files to HTML tables")
     parser.add_argument('--input_dir', '-i', required=True, help="Directory containing JSON files")
     parser.add_argument('--output_dir', '-o', required=True, help="Directory to save HTML files")
-    parser.add_argument('--extension', '-e', default='.json', help="File extension to process (default: .json)")
+    parser.add_argument('--extension', '-e', default=None, help="File extension to process (default: .json, or .xml with --from-xml)")
     parser.add_argument('-a', '--alias', default='PROD', help="Alias of the organization (default: PROD)")
+    parser.add_argument('--from-xml', action='store_true', help="Render XML permission sets directly, skipping the JSON intermediate")
+    parser.add_argument('--json_dir', '-j', default=None, help="With --from-xml, also write JSON files to this directory")
+    parser.add_argument('--store', action='store_true', help="Read permission sets from the permsets.ndjson store in the input directory")
+    parser.add_argument('--template_cache', default=None, help="Directory for the compiled template bytecode cache (default: system temp dir)")
+    parser.add_argument('--stream', action='store_true', help="Stream each report to disk while rendering to bound peak memory")
+    parser.add_argument('--changeset', default=None, help="Only render the permission sets changed in this change set file")
+    parser.add_argument('--timings', default=None, help="Write per-stage timings to this JSON report")
+    parser.add_argument('--profile', default=None, help="Dump cProfile output per stage into this directory")
+    parser.add_argument('--memory', action='store_true', help="Also record peak memory per stage and per file in the --timings report")
+    parser.add_argument('--memory_budget', type=float, default=None, help="Limit parallel rendering to this estimated memory (MB)")
 
     args = parser.parse_args()
 
+    if args.timings or args.profile or args.memory:
+        enable_pipeline_metrics(profile_dir=args.profile, memory=args.memory)
+    memory_budget = args.memory_budget and int(args.memory_budget * 1024 * 1024)
+
+    changeset = load_changeset(args.changeset)
+
     # Process the files with the specified extension and convert them to HTML
-    process_json_to_html_files(args.input_dir, args.output_dir, args.extension, args.alias)
+    try:
+        if args.from_xml:
+            process_xml_to_html_files(args.input_dir, args.output_dir, args.extension or '.xml', args.alias, json_dir=args.json_dir,
+                                      template_cache=args.template_cache, stream=args.stream, changeset=changeset,
+                                      memory_budget=memory_budget)
+        else:
+            process_json_to_html_files(args.input_dir, args.output_dir, args.extension or '.json', args.alias, store=args.store,
+                                       template_cache=args.template_cache, stream=args.stream, changeset=changeset,
+                                       memory_budget=memory_budget)
+    finally:
+        write_pipeline_metrics(args.timings)
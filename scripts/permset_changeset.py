@@ -0,0 +1,176 @@
+import os
+import json
+import hashlib
+from collections import namedtuple
+
+try:
+    from pipeline_metrics import add_stage_items, enable_pipeline_metrics, pipeline_stage, write_pipeline_metrics
+except ImportError:
+    # Inlined ahead of this script in local_win_python.py
+    pass
+
+# A change set lists, by name (the source file name without its extension, e.g.
+# "Admin.permissionset-meta"), the permission sets that changed or were removed since the last
+# successful run, plus every current name. It is computed once at the start of a run and every
+# stage limits itself to it; the state it was computed against only moves forward when the
+# whole run succeeded and commits it. A permission set whose XML did not change still counts
+# as changed while its Confluence page has not been filled (see add_page_changes).
+Changeset = namedtuple('Changeset', ['changed', 'removed', 'names'])
+
+
+def hash_file(path):
+    """Return the SHA-256 hex digest of a file's content."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def load_run_state(state_file):
+    """Load {name: {size, mtime, sha256}} as of the last successful run; empty before the first."""
+    try:
+        with open(state_file, 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def compute_changeset(input_dir, extension, state_file, full=False):
+    """Compare the source files in input_dir against the last successful run's state.
+
+    Files whose size and mtime are unchanged keep their recorded hash; the others are hashed, so
+    a fresh checkout with new mtimes but the same content is not reported as changed. full=True
+    counts every permission set as changed, e.g. when compare_delta's snapshot is missing and its
+    baseline has to be rebuilt from all of them. Returns the change set as a JSON-serializable
+    dict, including the state to commit once the run succeeds.
+    """
+    previous = load_run_state(state_file)
+    state = {}
+    for file in sorted(os.listdir(input_dir)):
+        if not file.endswith(extension):
+            continue
+        file_path = os.path.join(input_dir, file)
+        name = os.path.splitext(file)[0]
+        stat = os.stat(file_path)
+        entry = previous.get(name)
+        if entry and entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime:
+            sha256 = entry["sha256"]
+        else:
+            sha256 = hash_file(file_path)
+        state[name] = {"size": stat.st_size, "mtime": stat.st_mtime, "sha256": sha256}
+        if entry and "page_id" in entry:
+            state[name]["page_id"] = entry["page_id"]
+
+    return {
+        "changed": [name for name in state if full or previous.get(name, {}).get("sha256") != state[name]["sha256"]],
+        "removed": sorted(name for name in previous if name not in state),
+        "names": sorted(state),
+        "state": state,
+    }
+
+
+def load_ledger_pages(ledger_file):
+    """Return the IDs of the pages update_confluence's ledger has written; None without a ledger."""
+    if not ledger_file:
+        return None
+    try:
+        with open(ledger_file, 'r') as f:
+            return set(json.load(f))
+    except FileNotFoundError:
+        return set()
+
+
+def add_page_changes(changeset, html_to_ids, ledger_pages=None):
+    """Also mark as changed the permission sets whose Confluence page still needs filling.
+
+    That is every master sheet row (html_to_ids, as written by read_confluence_db) that was not
+    on the sheet at the last successful run or now points at another page, and, with
+    ledger_pages, every row whose page the ledger has no record of writing. Records each
+    permission set's page ID in the change set's state and returns how many were added.
+    """
+    state = changeset["state"]
+    pages = {}
+    for item in html_to_ids:
+        name = os.path.splitext(item["HTML"])[0]
+        if name in state:
+            pages.setdefault(name, str(item["ID"]))
+
+    changed = set(changeset["changed"])
+    added = 0
+    for name, entry in state.items():
+        page_id = pages.get(name)
+        if page_id is None:
+            entry.pop("page_id", None)
+            continue
+        if name not in changed and (entry.get("page_id") != page_id
+                                    or (ledger_pages is not None and page_id not in ledger_pages)):
+            changed.add(name)
+            added += 1
+        entry["page_id"] = page_id
+    changeset["changed"] = [name for name in state if name in changed]
+    return added
+
+
+def write_changeset(changeset_file, changeset):
+    with open(f"{changeset_file}.tmp", 'w') as f:
+        json.dump(changeset, f, indent=4)
+    os.replace(f"{changeset_file}.tmp", changeset_file)
+
+
+def load_changeset(changeset_file):
+    """Load a change set written by compute; None when no change set file is given."""
+    if not changeset_file:
+        return None
+    with open(changeset_file, 'r') as f:
+        changeset = json.load(f)
+    return Changeset(frozenset(changeset["changed"]), frozenset(changeset["removed"]), frozenset(changeset["names"]))
+
+
+def commit_changeset(changeset_file, state_file):
+    """Record the state a change set was computed from as the last successful run's."""
+    with open(changeset_file, 'r') as f:
+        state = json.load(f)["state"]
+    with open(f"{state_file}.tmp", 'w') as f:
+        json.dump(state, f, separators=(',', ':'), sort_keys=True)
+    os.replace(f"{state_file}.tmp", state_file)
+
+
+if __name__ == "__main__":
+    import argparse
+    import logging
+
+    parser = argparse.ArgumentParser(description="Compute or commit the change set of a run")
+    parser.add_argument('action', choices=['compute', 'commit'], help="compute at the start of a run, commit once every stage succeeded")
+    parser.add_argument('--changeset', '-c', default='changeset.json', help="Change set file (default: changeset.json)")
+    parser.add_argument('--state', '-s', required=True, help="State of the last successful run")
+    parser.add_argument('--input_dir', '-i', help="With compute, directory containing the XML permission sets")
+    parser.add_argument('--extension', '-e', default='.xml', help="With compute, file extension to process (default: .xml)")
+    parser.add_argument('--map_file', '-m', help="With compute, master sheet rows read this run; also process sets whose page is new")
+    parser.add_argument('--ledger', help="With compute and --map_file, also process sets whose page this ledger never wrote")
+    parser.add_argument('--snapshot', help="With compute, count every set as changed while this compare_delta snapshot does not exist")
+    parser.add_argument('--timings', default=None, help="Write per-stage timings to this JSON report")
+    parser.add_argument('--profile', default=None, help="Dump cProfile output per stage into this directory")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if args.timings or args.profile:
+        enable_pipeline_metrics(profile_dir=args.profile)
+    try:
+        if args.action == 'compute':
+            with pipeline_stage("changeset.compute"):
+                changeset = compute_changeset(args.input_dir, args.extension, args.state,
+                                              full=bool(args.snapshot) and not os.path.exists(args.snapshot))
+                if args.map_file:
+                    with open(args.map_file, 'r') as f:
+                        pages = add_page_changes(changeset, json.load(f), load_ledger_pages(args.ledger))
+                    logging.info(f"{pages} unchanged permission sets have a Confluence page to fill")
+                write_changeset(args.changeset, changeset)
+            add_stage_items("changeset.compute", len(changeset["names"]))
+            logging.info(f"{len(changeset['changed'])} of {len(changeset['names'])} permission sets changed, "
+                         f"{len(changeset['removed'])} removed since the last successful run")
+        else:
+            commit_changeset(args.changeset, args.state)
+            logging.info(f"Committed {args.changeset} to {args.state}")
+    finally:
+        write_pipeline_metrics(args.timings)
@@ -0,0 +1,97 @@
+from collections import namedtuple
+
+# One tuple-backed row type per permission set section. Field names match the ones the HTML
+# report has always used, so templates and diffing code can address rows by attribute.
+ObjectPermission = namedtuple('ObjectPermission', ['object', 'allowCreate', 'allowRead', 'allowEdit', 'allowDelete', 'modifyAllRecords', 'viewAllRecords'])
+FieldPermission = namedtuple('FieldPermission', ['object', 'field', 'readable', 'editable'])
+ApplicationVisibility = namedtuple('ApplicationVisibility', ['application', 'visibility'])
+TabSetting = namedtuple('TabSetting', ['tab', 'visibility'])
+ClassAccess = namedtuple('ClassAccess', ['apexClass', 'enabled'])
+ApexPagePermission = namedtuple('ApexPagePermission', ['apexPage', 'enabled'])
+LoginIpRange = namedtuple('LoginIpRange', ['loginIpRange'])
+LoginHour = namedtuple('LoginHour', ['loginHours'])
+RecordTypePermission = namedtuple('RecordTypePermission', ['recordType', 'enabled'])
+CustomPermission = namedtuple('CustomPermission', ['customPermission', 'enabled'])
+OauthScope = namedtuple('OauthScope', ['oauthScope'])
+OtherSetting = namedtuple('OtherSetting', ['setting', 'value'])
+
+# Section name -> (row type, number of leading row fields that identify a row within the section)
+PERMISSION_SET_SECTIONS = {
+    'objectPermissions': (ObjectPermission, 1),
+    'fieldPermissions': (FieldPermission, 2),
+    'applicationVisibility': (ApplicationVisibility, 1),
+    'tabSettings': (TabSetting, 1),
+    'classAccesses': (ClassAccess, 1),
+    'apexPagePermissions': (ApexPagePermission, 1),
+    'loginIpRanges': (LoginIpRange, 1),
+    'loginHours': (LoginHour, 1),
+    'recordTypePermissions': (RecordTypePermission, 1),
+    'customPermissions': (CustomPermission, 1),
+    'oauthScopes': (OauthScope, 1),
+    'otherSettings': (OtherSetting, 1),
+}
+
+PERMISSION_SET_ATTRIBUTES = ('label', 'description', 'hasActivationRequired', 'userLicense', 'sessionTimeout')
+
+# Most cells are one of these two strings; sharing one object per value keeps 30k-row sets small.
+_SHARED_VALUES = {'true': 'true', 'false': 'false'}
+
+
+def _as_list(value):
+    """Normalize xmltodict's single-child dict / list-of-children shapes to a list."""
+    if value is None:
+        return []
+    if isinstance(value, list):
+        return value
+    return [value]
+
+
+def _shared(value):
+    return _SHARED_VALUES.get(value, value) if isinstance(value, str) else value
+
+
+def _make_row(row_type, entry):
+    """Build a row from one xmltodict entry; missing keys render as empty cells."""
+    if not isinstance(entry, dict):
+        entry = {}
+    if row_type is FieldPermission:
+        # Split 'Object.Field' once here rather than on every render
+        field = entry.get('field', '')
+        parts = field.split('.') if field is not None else ['']
+        return FieldPermission(parts[0], parts[1] if len(parts) > 1 else '',
+                               _shared(entry.get('readable', '')), _shared(entry.get('editable', '')))
+    return row_type._make(_shared(entry.get(key, '')) for key in row_type._fields)
+
+
+class PermissionSet:
+    """A permission set normalized once from its xmltodict document.
+
+    Every section is a tuple of rows, however many entries the XML had, so consumers never need
+    to distinguish the single-child dict shape from the list shape.
+    """
+    __slots__ = ('name',) + PERMISSION_SET_ATTRIBUTES + tuple(PERMISSION_SET_SECTIONS)
+
+    def __init__(self, name='', **values):
+        self.name = name
+        for attribute in PERMISSION_SET_ATTRIBUTES:
+            setattr(self, attribute, values.get(attribute, ''))
+        for section in PERMISSION_SET_SECTIONS:
+            setattr(self, section, tuple(values.get(section, ())))
+
+    @classmethod
+    def from_document(cls, document, name=''):
+        """Build a PermissionSet from a parsed document, with or without the PermissionSet root key."""
+        data = document.get('PermissionSet', document) or {}
+        values = {attribute: data.get(attribute, '') for attribute in PERMISSION_SET_ATTRIBUTES}
+        for section, (row_type, _) in PERMISSION_SET_SECTIONS.items():
+            values[section] = [_make_row(row_type, entry) for entry in _as_list(data.get(section))]
+        return cls(name, **values)
+
+    def sections(self):
+        """Yield (section name, rows) for every section, including empty ones."""
+        for section in PERMISSION_SET_SECTIONS:
+            yield section, getattr(self, section)
+
+    def __repr__(self):
+        counts = ', '.join(f'{section}={len(rows)}' for section, rows in self.sections() if rows)
+        return f'PermissionSet({self.name!r}, {counts})'
@@ -0,0 +1,136 @@
+import os
+import json
+import mmap
+import threading
+
+# A permission set store is two files:
+#   permsets.ndjson      append-only, one compact JSON document per line
+#   permsets.ndjson.idx  JSON object mapping each permission set name to [offset, length]
+# Re-appending a name supersedes the older record; the index always points at the latest one.
+PERMSET_STORE_NAME = 'permsets.ndjson'
+
+
+def get_store_paths(directory):
+    """Return the (data, index) paths of the store kept in a directory."""
+    data_path = os.path.join(directory, PERMSET_STORE_NAME)
+    return data_path, data_path + '.idx'
+
+
+def encode_store_record(document):
+    """Serialize a parsed permission set to the compact bytes stored on one line."""
+    return json.dumps(document, separators=(',', ':')).encode('utf-8')
+
+
+def load_store_index(directory):
+    """Load a store's index, returning an empty one when the store does not exist yet."""
+    _, index_path = get_store_paths(directory)
+    try:
+        with open(index_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+class PermsetStoreWriter:
+    """Append permission sets to a directory's store; safe to share between threads.
+
+    The index is only rewritten on close(), so readers never see a half-written store.
+    """
+
+    def __init__(self, directory, compact_ratio=0.5):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.data_path, self.index_path = get_store_paths(directory)
+        self.index = load_store_index(directory)
+        if not os.path.exists(self.data_path):
+            self.index = {}
+        self.compact_ratio = compact_ratio
+        self._lock = threading.Lock()
+        self._file = open(self.data_path, 'ab')
+        self._file.seek(0, os.SEEK_END)
+
+    def append_record(self, name, record):
+        """Append pre-encoded bytes (see encode_store_record) under name."""
+        with self._lock:
+            offset = self._file.tell()
+            self._file.write(record)
+            self._file.write(b'\n')
+            self.index[name] = [offset, len(record)]
+
+    def append(self, name, document):
+        """Serialize and append a parsed permission set under name."""
+        self.append_record(name, encode_store_record(document))
+
+    def remove(self, name):
+        """Drop name from the index; its bytes are reclaimed by the next compaction."""
+        with self._lock:
+            self.index.pop(name, None)
+
+    def close(self):
+        """Flush the data file, compact it if mostly dead records, and write the index."""
+        with self._lock:
+            self._file.close()
+            live = sum(length + 1 for _, length in self.index.values())
+            if os.path.getsize(self.data_path) * self.compact_ratio > live:
+                self._compact()
+            with open(self.index_path + '.tmp', 'w', encoding='utf-8') as f:
+                json.dump(self.index, f, separators=(',', ':'), sort_keys=True)
+            os.replace(self.index_path + '.tmp', self.index_path)
+
+    def _compact(self):
+        """Rewrite the data file with only the records the index points at."""
+        index = {}
+        with open(self.data_path, 'rb') as src, open(self.data_path + '.tmp', 'wb') as dst:
+            for name, (offset, length) in sorted(self.index.items(), key=lambda item: item[1][0]):
+                src.seek(offset)
+                index[name] = [dst.tell(), length]
+                dst.write(src.read(length + 1))
+        os.replace(self.data_path + '.tmp', self.data_path)
+        self.index = index
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class PermsetStoreReader:
+    """Memory-map a directory's store and look permission sets up by name."""
+
+    def __init__(self, directory):
+        self.data_path, self.index_path = get_store_paths(directory)
+        self.index = load_store_index(directory)
+        self._file = open(self.data_path, 'rb')
+        size = os.fstat(self._file.fileno()).st_size
+        # mmap cannot map an empty file
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+
+    def names(self):
+        return sorted(self.index)
+
+    def __contains__(self, name):
+        return name in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    def get_record(self, name):
+        """Return the raw encoded bytes stored for name."""
+        offset, length = self.index[name]
+        return self._map[offset:offset + length]
+
+    def get(self, name):
+        """Return the parsed permission set stored under name."""
+        return json.loads(self.get_record(name))
+
+    def close(self):
+        if isinstance(self._map, mmap.mmap):
+            self._map.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
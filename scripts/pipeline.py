@@ -0,0 +1,305 @@
+import os
+import time
+import queue
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from pipeline_metrics import enable_pipeline_metrics, pipeline_stage, measured_stage_item, write_pipeline_metrics
+from permset_changeset import (compute_changeset, add_page_changes, load_ledger_pages, write_changeset, load_changeset,
+                               commit_changeset)
+from xml_to_json import process_xml_to_json_files
+from json_to_html import (process_xml_to_html_files, process_json_to_html_files, load_xml_permission_set,
+                          write_permission_set_html, get_report_template, remove_stale_outputs)
+from read_confluence_db import get_webpage
+from update_confluence import parallel_confluence_html_updates, stream_confluence_html_updates
+from compare_delta import calculate_diffs, snapshot_permission_set
+from permset_model import PermissionSet
+
+# Runs the five pipeline scripts as stages of one process: jinja2, requests and the parsers are
+# imported once, and stages whose inputs are ready run side by side on threads, so the master
+# sheet is read from Confluence while permission sets are still being converted and rendered:
+#
+#   convert  (xml_to_json; folded into render with --fused)
+#   render   (json_to_html)       after convert
+#   master   (read_confluence_db; read before anything else with --state)
+#   upload   (update_confluence)  after render and master
+#   compare  (compare_delta)      after convert, render, master and upload
+#
+# The master sheet rows are handed from master to upload and compare in memory instead of being
+# read back from the map file.
+#
+# With --pipelined, convert, render and upload run at the same time instead, handing each
+# permission set on through bounded queues as soon as it is ready (see run_pipelined_stages).
+#
+# With a state file the run is incremental (see permset_changeset.py): a change set is computed
+# before any other stage and only committed once every stage succeeded.
+
+
+def run_stage_graph(stages, parallel=True):
+    """Run {name: (dependencies, function)} once each, as soon as all of a stage's dependencies finished.
+
+    Once a stage fails no further stages are started; the ones already running are waited for
+    and a RuntimeError naming the failed stages is raised. With parallel=False stages run one at
+    a time, in dependency order.
+    """
+    pending = dict(stages)
+    done = set()
+    failed = []
+    with ThreadPoolExecutor(max_workers=len(stages) if parallel else 1) as executor:
+        running = {}
+        while pending or running:
+            if not failed:
+                for name in [name for name, (dependencies, _) in pending.items() if done.issuperset(dependencies)]:
+                    if running and not parallel:
+                        break
+                    function = pending.pop(name)[1]
+                    logging.info(f"Pipeline stage {name} started")
+                    running[executor.submit(time_call, function)] = name
+            if not running:
+                if pending and not failed:
+                    raise ValueError(f"Pipeline stages with unmet dependencies: {', '.join(pending)}")
+                break
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                try:
+                    seconds = future.result()
+                except Exception as e:
+                    logging.error(f"Pipeline stage {name} failed: {e}")
+                    failed.append(name)
+                else:
+                    logging.info(f"Pipeline stage {name} finished in {seconds:.2f}s")
+                    done.add(name)
+    if failed:
+        skipped = sorted(pending)
+        raise RuntimeError(f"Pipeline stage(s) failed: {', '.join(failed)}"
+                           + (f"; not run: {', '.join(skipped)}" if skipped else ""))
+
+
+def time_call(function):
+    """Call function and return how many seconds it took; each stage records its own metrics."""
+    start = time.perf_counter()
+    function()
+    return time.perf_counter() - start
+
+
+class QueueStage:
+    """Apply function to every item of items on worker threads, handing results on through a bounded queue.
+
+    Iterating the stage yields results in the order they finish, and items may themselves be
+    another QueueStage. Workers block once queue_size results are waiting, so a slower consumer
+    holds this stage back and, through its input, every stage before it. Failed items are logged
+    with describe(item) and collected in failures instead of stopping the stage.
+    """
+
+    _DONE = object()
+
+    def __init__(self, name, function, items, workers, queue_size, describe=str):
+        self.name = name
+        self.function = function
+        self.describe = describe
+        self.failures = []
+        self._items = iter(items)
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._running = workers
+        self._lock = threading.Lock()
+        for _ in range(workers):
+            threading.Thread(target=self._work, daemon=True).start()
+
+    def _work(self):
+        while True:
+            # Workers share one input iterator, which may block on the previous stage's queue
+            with self._lock:
+                item = next(self._items, self._DONE)
+            if item is self._DONE:
+                break
+            try:
+                result = measured_stage_item(self.name, self.describe(item), self.function, item)
+            except Exception as e:
+                logging.error(f"Failed to process {self.describe(item)} in {self.name}: {e}")
+                with self._lock:
+                    self.failures.append(self.describe(item))
+                continue
+            self._queue.put(result)
+        with self._lock:
+            self._running -= 1
+            last = not self._running
+        if last:
+            self._queue.put(self._DONE)
+
+    def __iter__(self):
+        while (result := self._queue.get()) is not self._DONE:
+            yield result
+
+
+def run_pipelined_stages(args, changeset=None, html_to_ids=None):
+    """Convert, render and upload every permission set as one pipeline of bounded queues.
+
+    XML files are parsed (JSON is written to the JSON directory as a side output) on convert
+    workers, rendered on render workers and uploaded as each report is written, so the first
+    PUT goes out after one file instead of after all of them and rendering overlaps uploading.
+    The master sheet is read while the first files are converted, unless its rows are passed
+    in html_to_ids; until it is in, rendered reports wait in the queue. Compare runs once every
+    upload finished, diffing the rows of the permission sets parsed here rather than reading
+    the JSON back.
+    """
+    get_report_template(args.template_cache)
+    for directory in (args.json_dir, args.output_dir):
+        os.makedirs(directory, exist_ok=True)
+
+    files = [f for f in os.listdir(args.input_dir) if f.endswith(args.extension)]
+    if changeset is not None:
+        files = [f for f in files if os.path.splitext(f)[0] in changeset.changed]
+        remove_stale_outputs(changeset, args.output_dir, args.json_dir)
+    logging.info(f"Streaming {len(files)} permission sets through convert, render and upload")
+
+    # Rows of every permission set parsed, for compare's row-level diff
+    current_rows = {} if args.snapshot else None
+
+    def render(converted):
+        name, permission_set = converted
+        write_permission_set_html(permission_set, args.alias, os.path.join(args.output_dir, name + '.html'), args.stream)
+        if current_rows is not None:
+            current_rows[name] = snapshot_permission_set(PermissionSet.from_document(permission_set, name))
+        return name + '.html'
+
+    workers = args.render_workers or os.cpu_count() or 1
+    with pipeline_stage("pipeline.stream"), ThreadPoolExecutor(max_workers=1) as master_executor:
+        if html_to_ids is None:
+            master = master_executor.submit(get_webpage, page_id=args.page_id, output=args.map_file, children=args.children)
+        else:
+            master = master_executor.submit(lambda: html_to_ids)
+        converted = QueueStage("xml_to_json.convert", lambda file: load_xml_permission_set(
+            os.path.join(args.input_dir, file), args.json_dir), files, workers, args.queue_size)
+        rendered = QueueStage("json_to_html.render", render, converted, workers, args.queue_size,
+                              describe=lambda item: item[0])
+        html_to_ids = master.result()
+        stream_confluence_html_updates(rendered, args.map_file, os.path.join(args.output_dir, ''), workers=args.workers,
+                                       ledger_file=args.ledger, rate_limit=args.rate, changeset=changeset,
+                                       html_to_ids=html_to_ids)
+
+    failures = converted.failures + rendered.failures
+    if failures:
+        raise RuntimeError(f"Failed to convert or render {len(failures)} of {len(files)} permission sets: {', '.join(failures)}")
+
+    with pipeline_stage("pipeline.compare"):
+        calculate_diffs(input_dir=args.output_dir, map_file=args.map_file, output=args.differences,
+                        json_dir=args.json_dir if args.snapshot else None, snapshot=args.snapshot, changeset=changeset,
+                        html_to_ids=html_to_ids, current_rows=current_rows)
+
+
+def build_pipeline_stages(args, changeset=None, html_to_ids=None):
+    """Return the stage graph for the parsed command line arguments.
+
+    html_to_ids are the master sheet rows when they were already read; otherwise the master
+    stage reads them and hands them on to upload and compare.
+    """
+    json_dir = args.json_dir
+    html_prefix = os.path.join(args.output_dir, '')
+    memory_budget = args.memory_budget and int(args.memory_budget * 1024 * 1024)
+    stages = {}
+    if args.fused:
+        stages["render"] = ((), lambda: process_xml_to_html_files(
+            args.input_dir, args.output_dir, args.extension, args.alias, json_dir=json_dir,
+            template_cache=args.template_cache, stream=args.stream, changeset=changeset, memory_budget=memory_budget))
+        converted = "render"
+    else:
+        stages["convert"] = ((), lambda: process_xml_to_json_files(
+            args.input_dir, json_dir, args.extension, stream=args.stream, executor=args.executor,
+            store=args.store, changeset=changeset, memory_budget=memory_budget))
+        stages["render"] = (("convert",), lambda: process_json_to_html_files(
+            json_dir, args.output_dir, '.json', args.alias, store=args.store, template_cache=args.template_cache,
+            stream=args.stream, changeset=changeset, memory_budget=memory_budget))
+        converted = "convert"
+    master = {"html_to_ids": html_to_ids}
+
+    def read_master():
+        if master["html_to_ids"] is None:
+            master["html_to_ids"] = get_webpage(page_id=args.page_id, output=args.map_file, children=args.children)
+
+    stages["master"] = ((), read_master)
+    stages["upload"] = (("render", "master"), lambda: parallel_confluence_html_updates(
+        args.map_file, html_prefix, workers=args.workers, ledger_file=args.ledger,
+        rate_limit=args.rate, changeset=changeset, html_to_ids=master["html_to_ids"]))
+    # After upload like the standalone steps: no alert or new snapshot for a run whose upload failed
+    stages["compare"] = ((converted, "render", "master", "upload"), lambda: calculate_diffs(
+        input_dir=args.output_dir, map_file=args.map_file, output=args.differences,
+        json_dir=json_dir if args.snapshot else None, snapshot=args.snapshot,
+        store=args.store and not args.fused, changeset=changeset, html_to_ids=master["html_to_ids"]))
+    return stages
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Run the whole permission set pipeline in one process")
+    parser.add_argument('--input_dir', '-i', required=True, help="Directory containing the XML permission sets")
+    parser.add_argument('--extension', '-e', default='.xml', help="File extension to process (default: .xml)")
+    parser.add_argument('--json_dir', '-j', required=True, help="Directory for the JSON permission sets")
+    parser.add_argument('--output_dir', '-o', required=True, help="Directory for the HTML reports")
+    parser.add_argument('-a', '--alias', default='PROD', help="Alias of the organization (default: PROD)")
+    parser.add_argument('--fused', action='store_true', help="Render XML straight to HTML, writing JSON as a side output")
+    parser.add_argument('--store', action='store_true', help="Keep the JSON permission sets in a permsets.ndjson store")
+    parser.add_argument('--stream', action='store_true', help="Use the bounded-memory streaming converters")
+    parser.add_argument('--executor', choices=['thread', 'process', 'serial'], default='process', help="How XML files are converted (default: process)")
+    parser.add_argument('--template_cache', default=None, help="Directory for the compiled template bytecode cache")
+    parser.add_argument('-p', '--page_id', nargs="+", default=["9994318"], help="Confluence page ID(s) of the master sheet")
+    parser.add_argument('--children', action='store_true', help="Read the master sheet from the child pages of the given page(s)")
+    parser.add_argument('-m', '--map_file', default='html_to_ids.json', help="HTML to ID mappings file (default: html_to_ids.json)")
+    parser.add_argument('-w', '--workers', type=int, help="Maximum number of page updates in flight")
+    parser.add_argument('--rate', type=float, help="Maximum Confluence requests per second (default: unlimited)")
+    parser.add_argument('--ledger', help="JSON ledger of content last written to each page; unchanged pages are skipped")
+    parser.add_argument('-d', '--differences', default='differences.json', help="Output file for the differences (default: differences.json)")
+    parser.add_argument('-s', '--snapshot', help="Snapshot of the previous run's permission rows, for row-level differences")
+    parser.add_argument('--pipelined', action='store_true', help="Stream permission sets through convert, render and upload via bounded queues")
+    parser.add_argument('--render_workers', type=int, help="With --pipelined, convert and render threads each (default: CPU count)")
+    parser.add_argument('--queue_size', type=int, default=32, help="With --pipelined, reports waiting between stages before they block (default: 32)")
+    parser.add_argument('--state', help="Only process permission sets changed since the last successful run recorded here")
+    parser.add_argument('--changeset', default='changeset.json', help="With --state, change set file of this run (default: changeset.json)")
+    parser.add_argument('--timings', default=None, help="Write per-stage timings to this JSON report")
+    parser.add_argument('--profile', default=None, help="Dump cProfile output per stage into this directory (runs stages one at a time)")
+    parser.add_argument('--memory', action='store_true', help="Also record peak memory per stage and per permission set in the --timings report")
+    parser.add_argument('--memory_budget', type=float, default=None, help="Limit parallel conversion and rendering to this estimated memory (MB)")
+    args = parser.parse_args()
+    if args.pipelined and (args.store or args.profile):
+        parser.error("--pipelined cannot be combined with --store or --profile")
+    if args.pipelined and args.memory_budget:
+        # Parsed permission sets wait in the queues between stages; --queue_size bounds those instead
+        parser.error("--memory_budget cannot be combined with --pipelined; lower --queue_size or --render_workers")
+
+    logging.basicConfig(level=logging.INFO)
+    # The process pool starts while other stages' threads are running, and forking a threaded
+    # process can leave locks held in the child; forkserver children start from a clean process
+    if args.executor == 'process' and 'forkserver' in multiprocessing.get_all_start_methods():
+        multiprocessing.set_start_method('forkserver')
+    if args.timings or args.profile or args.memory:
+        enable_pipeline_metrics(profile_dir=args.profile, memory=args.memory)
+
+    try:
+        changeset = None
+        html_to_ids = None
+        if args.state:
+            # Master sheet rows new since the last run mark their permission sets as changed
+            html_to_ids = get_webpage(page_id=args.page_id, output=args.map_file, children=args.children)
+            with pipeline_stage("changeset.compute"):
+                # Without a snapshot compare rebuilds its baseline, which needs every permission set
+                computed = compute_changeset(args.input_dir, args.extension, args.state,
+                                             full=bool(args.snapshot) and not os.path.exists(args.snapshot))
+                add_page_changes(computed, html_to_ids, load_ledger_pages(args.ledger))
+                write_changeset(args.changeset, computed)
+            changeset = load_changeset(args.changeset)
+            logging.info(f"{len(changeset.changed)} of {len(changeset.names)} permission sets changed, "
+                         f"{len(changeset.removed)} removed since the last successful run")
+
+        if args.pipelined:
+            run_pipelined_stages(args, changeset, html_to_ids)
+        else:
+            # cProfile can only profile one thread's stage at a time
+            run_stage_graph(build_pipeline_stages(args, changeset, html_to_ids), parallel=not args.profile)
+
+        if args.state:
+            commit_changeset(args.changeset, args.state)
+    finally:
+        write_pipeline_metrics(args.timings)
@@ -0,0 +1,417 @@
+import os
+import sys
+import json
+import math
+import time
+import threading
+import contextlib
+import tracemalloc
+from collections import deque
+
+# Process-wide collector; None until enable_pipeline_metrics() is called, which keeps every
+# timing hook a no-op for runs that did not ask for --timings/--profile.
+_PIPELINE_METRICS = None
+
+
+# Items listed per stage in the memory report, largest traced peak first
+LARGEST_ITEMS = 10
+
+# Rough peak memory of parsing or rendering one permission set, per byte of its XML or JSON file
+MEMORY_PER_INPUT_BYTE = 12
+
+
+def get_rss_bytes():
+    """Return this process's current resident set size, or None where /proc is not available."""
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def get_peak_rss_bytes():
+    """Return the peak resident set size of this process or of any finished child, or None on Windows."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    return peak if os.uname().sysname == 'Darwin' else peak * 1024
+
+
+class TracedMemory:
+    """Attribute tracemalloc peaks to stages and items while sharing the one process-wide peak counter.
+
+    Resetting the peak would lose it for every other open stage, so each reset first folds the
+    peak into the stages still open. An item's peak is the traced memory above what was in use
+    when it started; the peak is only reset while no item is in flight, so the figure is exact
+    for items processed one at a time and an upper bound (it includes items running alongside)
+    otherwise.
+    """
+
+    def __init__(self):
+        self.open_stages = {}
+        self.items_in_flight = 0
+        self._lock = threading.Lock()
+
+    def _reset_peak(self):
+        peak = tracemalloc.get_traced_memory()[1]
+        for name, stage_peak in self.open_stages.items():
+            self.open_stages[name] = max(stage_peak, peak)
+        tracemalloc.reset_peak()
+
+    def start_stage(self, name):
+        with self._lock:
+            self._reset_peak()
+            self.open_stages[name] = 0
+
+    def end_stage(self, name):
+        """Return the traced peak in bytes since start_stage(name)."""
+        with self._lock:
+            return max(self.open_stages.pop(name, 0), tracemalloc.get_traced_memory()[1])
+
+    def start_item(self):
+        """Return the traced memory in use as an item starts, to be passed to end_item()."""
+        with self._lock:
+            if not self.items_in_flight:
+                self._reset_peak()
+            self.items_in_flight += 1
+            return tracemalloc.get_traced_memory()[0]
+
+    def end_item(self, started):
+        """Return the traced peak in bytes above what was in use when the item started."""
+        with self._lock:
+            self.items_in_flight -= 1
+            return max(0, tracemalloc.get_traced_memory()[1] - started)
+
+
+_TRACED_MEMORY = TracedMemory()
+
+
+def traced_call(func, *args, **kwargs):
+    """Call func with tracemalloc running; returns (result, traced peak bytes of the call, RSS bytes after it).
+
+    Starts tracemalloc when it is not running yet, e.g. in process pool workers.
+    """
+    if not tracemalloc.is_tracing():
+        tracemalloc.start()
+    started = _TRACED_MEMORY.start_item()
+    try:
+        result = func(*args, **kwargs)
+    finally:
+        peak = _TRACED_MEMORY.end_item(started)
+    return result, peak, get_rss_bytes()
+
+
+def _mb(value):
+    return round(value / (1024 * 1024), 2) if value is not None else None
+
+
+class PipelineMetrics:
+    """Collect wall/CPU time, item counts and per-item durations for named pipeline stages.
+
+    With memory=True tracemalloc runs for the whole process and every stage also records its
+    traced peak and RSS, plus the items (files) with the largest traced peaks.
+
+    With a profile_dir each stage dumps <profile_dir>/<stage>.prof, including the items it ran
+    on executor threads (see profile_item).
+    """
+
+    def __init__(self, profile_dir=None, memory=False):
+        self.profile_dir = profile_dir
+        self.memory = memory
+        self.stages = {}
+        self._lock = threading.Lock()
+        # Open stage name -> {thread ident: cProfile.Profile} of the items run on other threads
+        self._item_profilers = {}
+        if memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def _stage(self, name):
+        with self._lock:
+            return self.stages.setdefault(name, {"wall_s": 0.0, "cpu_s": 0.0, "items": 0, "item_times": [],
+                                                 "item_memory": []})
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """Time a stage; with a profile_dir the stage and the items it runs are also profiled with cProfile."""
+        profiler = None
+        if self.profile_dir:
+            import cProfile
+            with self._lock:
+                self._item_profilers[name] = {}
+            profiler = cProfile.Profile()
+            profiler.enable()
+        if self.memory:
+            _TRACED_MEMORY.start_stage(name)
+        cpu_start = sum(os.times()[:4])
+        wall_start = time.perf_counter()
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - wall_start
+            # os.times() includes children, so process-pool work is counted once the pool has exited
+            cpu = sum(os.times()[:4]) - cpu_start
+            stage = self._stage(name)
+            with self._lock:
+                stage["wall_s"] += wall
+                stage["cpu_s"] += cpu
+                if self.memory:
+                    memory = stage.setdefault("memory", {"traced_peak_mb": 0.0})
+                    memory["traced_peak_mb"] = max(memory["traced_peak_mb"], _mb(_TRACED_MEMORY.end_stage(name)))
+                    memory["rss_mb"] = _mb(get_rss_bytes())
+                    memory["peak_rss_mb"] = _mb(get_peak_rss_bytes())
+            if profiler:
+                import pstats
+                profiler.disable()
+                stats = pstats.Stats(profiler)
+                with self._lock:
+                    item_profilers = self._item_profilers.pop(name, {})
+                for item_profiler in item_profilers.values():
+                    stats.add(item_profiler)
+                os.makedirs(self.profile_dir, exist_ok=True)
+                stats.dump_stats(os.path.join(self.profile_dir, f"{name}.prof"))
+
+    def profile_item(self, name, func, *args, **kwargs):
+        """Call func under this thread's profiler for the open stage name.
+
+        Before Python 3.12 cProfile only sees the thread that enabled it, so items run on executor
+        threads are profiled per thread and merged into the stage's dump when it exits. From 3.12
+        on the stage's profiler already covers every thread and only one may be active, and the
+        thread that entered the stage is profiled by it either way; func is then called as is.
+        """
+        import cProfile
+        ident = threading.get_ident()
+        with self._lock:
+            profilers = self._item_profilers.get(name)
+            profiler = profilers.get(ident) if profilers is not None else None
+        if profilers is None or sys.getprofile() is not None:
+            return func(*args, **kwargs)
+        profiler = profiler or cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Another profiling tool is already active (the stage's, from Python 3.12 on)
+            return func(*args, **kwargs)
+        with self._lock:
+            profilers[ident] = profiler
+        try:
+            return func(*args, **kwargs)
+        finally:
+            profiler.disable()
+
+    def record_item(self, name, seconds):
+        """Record the duration of one item (file, page, ...) processed by a stage."""
+        stage = self._stage(name)
+        with self._lock:
+            stage["items"] += 1
+            stage["item_times"].append(seconds)
+
+    def record_item_memory(self, name, label, traced_peak, rss):
+        """Record the traced peak and RSS (bytes) of one item of a stage, labelled e.g. with its file name."""
+        stage = self._stage(name)
+        with self._lock:
+            stage["item_memory"].append((traced_peak, label, rss))
+
+    def add_items(self, name, count):
+        """Count items processed by a stage without timing them individually."""
+        stage = self._stage(name)
+        with self._lock:
+            stage["items"] += count
+
+    def as_dict(self):
+        """Return the JSON-serializable report for every stage recorded so far."""
+        report = {}
+        with self._lock:
+            for name, stage in self.stages.items():
+                entry = {"wall_s": round(stage["wall_s"], 6), "cpu_s": round(stage["cpu_s"], 6), "items": stage["items"]}
+                if stage["item_times"]:
+                    entry["item_times"] = summarize_durations(stage["item_times"])
+                if "memory" in stage or stage["item_memory"]:
+                    entry["memory"] = dict(stage.get("memory", {}))
+                if stage["item_memory"]:
+                    largest = sorted(stage["item_memory"], key=lambda item: item[0], reverse=True)[:LARGEST_ITEMS]
+                    # Items converted in worker processes are not traced by this process
+                    entry["memory"]["traced_peak_mb"] = max(entry["memory"].get("traced_peak_mb", 0.0), _mb(largest[0][0]))
+                    entry["memory"]["largest_items"] = [{"item": label, "traced_peak_mb": _mb(peak), "rss_mb": _mb(rss)}
+                                                        for peak, label, rss in largest]
+                report[name] = entry
+        return report
+
+
+def summarize_durations(durations):
+    """Return count, mean and nearest-rank percentiles (in seconds) for a list of durations."""
+    ordered = sorted(durations)
+
+    def percentile(p):
+        return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+    return {
+        "count": len(ordered),
+        "mean_s": round(sum(ordered) / len(ordered), 6),
+        "p50_s": round(percentile(50), 6),
+        "p90_s": round(percentile(90), 6),
+        "p99_s": round(percentile(99), 6),
+        "max_s": round(ordered[-1], 6),
+    }
+
+
+def enable_pipeline_metrics(profile_dir=None, memory=False):
+    """Start collecting stage metrics (and with memory=True, memory use) for this process and return the collector."""
+    global _PIPELINE_METRICS
+    _PIPELINE_METRICS = PipelineMetrics(profile_dir, memory)
+    return _PIPELINE_METRICS
+
+
+def get_pipeline_metrics():
+    """Return the active collector, or None when metrics are disabled."""
+    return _PIPELINE_METRICS
+
+
+def pipeline_stage(name):
+    """Context manager timing a stage when metrics are enabled."""
+    if _PIPELINE_METRICS is None:
+        return contextlib.nullcontext()
+    return _PIPELINE_METRICS.stage(name)
+
+
+def record_stage_item(name, seconds):
+    if _PIPELINE_METRICS is not None:
+        _PIPELINE_METRICS.record_item(name, seconds)
+
+
+def add_stage_items(name, count):
+    if _PIPELINE_METRICS is not None:
+        _PIPELINE_METRICS.add_items(name, count)
+
+
+def get_profile_dir():
+    """Return the directory cProfile output is dumped into, or None when profiling is off."""
+    return _PIPELINE_METRICS.profile_dir if _PIPELINE_METRICS is not None else None
+
+
+def profiled_stage_item(name, func, *args, **kwargs):
+    """Call func as one item of the named stage, profiled into the stage's dump when profiling is on."""
+    if get_profile_dir() is None:
+        return func(*args, **kwargs)
+    return _PIPELINE_METRICS.profile_item(name, func, *args, **kwargs)
+
+
+# Stage name -> cProfile.Profile of this process, in process pool workers (see profiled_worker_call)
+_WORKER_PROFILERS = {}
+
+
+def profiled_worker_call(name, profile_dir, func, *args, **kwargs):
+    """Call func in a process pool worker, adding it to this worker's profile of the named stage.
+
+    Workers have no stage of their own, so after every call each one rewrites its cumulative
+    profile to <profile_dir>/<name>.worker-<pid>.prof next to the stage's dump.
+    """
+    import cProfile
+    profiler = _WORKER_PROFILERS.setdefault(name, cProfile.Profile())
+    profiler.enable()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        profiler.disable()
+        os.makedirs(profile_dir, exist_ok=True)
+        profiler.dump_stats(os.path.join(profile_dir, f"{name}.worker-{os.getpid()}.prof"))
+
+
+def memory_tracking_enabled():
+    return _PIPELINE_METRICS is not None and _PIPELINE_METRICS.memory
+
+
+def record_item_memory(name, label, traced_peak, rss):
+    if _PIPELINE_METRICS is not None:
+        _PIPELINE_METRICS.record_item_memory(name, label, traced_peak, rss)
+
+
+def measured_stage_item(name, label, func, *args, **kwargs):
+    """Like timed_stage_item, also recording the item's memory under label when memory tracking is on."""
+    if not memory_tracking_enabled():
+        return timed_stage_item(name, func, *args, **kwargs)
+    start = time.perf_counter()
+    try:
+        result, traced_peak, rss = traced_call(profiled_stage_item, name, func, *args, **kwargs)
+    finally:
+        record_stage_item(name, time.perf_counter() - start)
+    record_item_memory(name, label, traced_peak, rss)
+    return result
+
+
+def timed_stage_item(name, func, *args, **kwargs):
+    """Call func and record its duration as one item of the named stage."""
+    start = time.perf_counter()
+    try:
+        return profiled_stage_item(name, func, *args, **kwargs)
+    finally:
+        record_stage_item(name, time.perf_counter() - start)
+
+
+def write_pipeline_metrics(path):
+    """Merge this process's stage metrics into the JSON report at path.
+
+    Each pipeline script runs in its own interpreter, so the report is read back and extended
+    rather than overwritten; stages recorded again replace their previous entry.
+    """
+    if _PIPELINE_METRICS is None or not path:
+        return
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            report = json.load(f)
+    except (FileNotFoundError, ValueError):
+        report = {}
+    report.setdefault("stages", {}).update(_PIPELINE_METRICS.as_dict())
+    with open(f'{path}.tmp', 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=4)
+    os.replace(f'{path}.tmp', path)
+
+
+class MemoryBudget:
+    """Admit work items, in arrival order, while their estimated memory fits within budget bytes.
+
+    An item larger than the whole budget is admitted once nothing else is in flight, so a few
+    giant permission sets lower the effective concurrency instead of failing.
+    """
+
+    def __init__(self, budget):
+        self.budget = budget
+        self.in_use = 0
+        self._waiting = deque()
+        self._cond = threading.Condition()
+
+    def acquire(self, weight):
+        with self._cond:
+            ticket = object()
+            self._waiting.append(ticket)
+            while self._waiting[0] is not ticket or (self.in_use and self.in_use + weight > self.budget):
+                self._cond.wait()
+            self._waiting.popleft()
+            self.in_use += weight
+            self._cond.notify_all()
+
+    def release(self, weight):
+        with self._cond:
+            self.in_use -= weight
+            self._cond.notify_all()
+
+
+def estimate_item_memory(path):
+    """Estimate the peak memory in bytes of parsing or rendering the file at path."""
+    return os.path.getsize(path) * MEMORY_PER_INPUT_BYTE
+
+
+def submit_within_budget(executor, budget, weight, func, *args, **kwargs):
+    """Submit func to executor, first waiting until weight bytes fit in budget (a MemoryBudget, or None for no limit)."""
+    if budget is None:
+        return executor.submit(func, *args, **kwargs)
+    budget.acquire(weight)
+    try:
+        future = executor.submit(func, *args, **kwargs)
+    except Exception:
+        budget.release(weight)
+        raise
+    future.add_done_callback(lambda _: budget.release(weight))
+    return future
@@ -1,77 +1,204 @@
+import os
+import json
+import logging
+import concurrent.futures
+from html.parser import HTMLParser
 
-def get_confluence_env():
-    """Retrieve environment variables for Confluence."""
-    import os
-    return {
-        "space": os.getenv('CONFLUENCE_SPACE'),
-        "email": os.getenv('CONFLUENCE_EMAIL'),
-        "instance": os.getenv('CONFLUENCE_INSTANCE'),
-        "api_token": os.getenv('CONFLUENCE_TOKEN'),
-    }
-
-def get_confluence_content_page_url(page_id: str, instance: str):
-    """Construct the Confluence API URL to fetch the page content."""
-    return f"https://{instance}.atlassian.net/wiki/rest/api/content/{page_id}?expand=body.storage"
-
-def fetch_confluence_page(url, auth):
-    """Fetch the Confluence page and return the response data."""
-    import requests
-    
-    response = requests.get(url, auth=auth)
-    if response.status_code == 200:
-        return response.json()
-    else:
-        raise Exception(f"Failed to fetch the page: {response.status_code} - {response.text}")
+try:
+    from pipeline_metrics import (add_stage_items, enable_pipeline_metrics, pipeline_stage, timed_stage_item,
+                                  write_pipeline_metrics)
+    from confluence_client import ConfluenceClient
+except ImportError:
+    # Inlined ahead of this script in local_win_python.py
+    pass
 
 def get_page_html_content(page_data):
     """Extract the HTML body content from the fetched page data."""
     return page_data['body']['storage']['value']
 
+class TableRowParser(HTMLParser):
+    """Collect the header and row cell texts of every table, as events arrive, without a document tree.
+
+    Cells of tables nested inside another table are part of their enclosing cell's text.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.tables = []
+        self.depth = 0
+        self._cell = None
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'table':
+            self.depth += 1
+            if self.depth == 1:
+                self.tables.append(([], []))
+        elif self.depth == 1 and tag in ('tr', 'th', 'td'):
+            # End tags of cells are optional in HTML
+            if self._cell:
+                self._end_cell()
+            if tag == 'tr':
+                self.tables[-1][1].append([])
+            else:
+                self._cell = (tag, [])
+
+    def handle_endtag(self, tag):
+        if not self.depth:
+            return
+        if tag == 'table':
+            if self.depth == 1 and self._cell:
+                self._end_cell()
+            self.depth -= 1
+        elif self.depth == 1 and tag in ('tr', 'th', 'td') and self._cell:
+            self._end_cell()
+
+    def handle_data(self, data):
+        if self._cell:
+            self._cell[1].append(data)
+
+    def _end_cell(self):
+        tag, parts = self._cell
+        headers, rows = self.tables[-1]
+        text = ''.join(parts).strip()
+        if tag == 'th':
+            headers.append(text)
+        elif rows:
+            rows[-1].append(text)
+        self._cell = None
+
+# Columns a table must have to be read as part of the master sheet
+MASTER_SHEET_HEADERS = ("HTML", "ID")
+
 def parse_table_to_dict(html_content):
-    """Parse the HTML content for table(s) and convert them to a JSON-compatible dictionary."""
-    from bs4 import BeautifulSoup
-    soup = BeautifulSoup(html_content, 'html.parser')
-    table = soup.find('table')  # Assumes there is at least one table in the content
+    """Parse the HTML to ID table(s) of the HTML content into a list of {header: cell text} rows.
 
-    if not table:
-        raise ValueError("No table found in the HTML content")
+    Every table with HTML and ID columns contributes its rows, in document order; other tables are
+    ignored.
+    """
+    parser = TableRowParser()
+    parser.feed(html_content)
+    parser.close()
 
-    headers = [header.get_text(strip=True) for header in table.find_all('th')]
     rows = []
-    
-    for row in table.find_all('tr')[1:]:  # Skip the header row
-        cells = [cell.get_text(strip=True) for cell in row.find_all('td')]
-        if len(cells) == len(headers):  # Ensure row has the correct number of cells
-            rows.append(dict(zip(headers, cells)))
-
+    tables = [(headers, table_rows) for headers, table_rows in parser.tables
+              if all(header in headers for header in MASTER_SHEET_HEADERS)]
+    if not tables:
+        raise ValueError("No HTML to ID table found in the HTML content")
+    for headers, table_rows in tables:
+        # The first row holds the headers; rows with a different number of cells are dropped
+        rows.extend(dict(zip(headers, cells)) for cells in table_rows[1:] if len(cells) == len(headers))
     return rows
 
-def get_webpage(page_id: str, output: str):
-    import logging
-    from requests.auth import HTTPBasicAuth
-    import json
+def get_cache_meta_path(output):
+    """Path of the file recording which pages and versions output was parsed from."""
+    return f"{output}.meta"
+
+def load_cached_versions(output):
+    """Return the {page_id: version} output was parsed from, or None when there is no usable cache."""
+    try:
+        with open(get_cache_meta_path(output), 'r') as f:
+            meta = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+    if not os.path.exists(output):
+        return None
+    return meta.get("pages")
+
+def save_json_atomic(data, path):
+    with open(f"{path}.tmp", 'w') as f:
+        json.dump(data, f)
+    os.replace(f"{path}.tmp", path)
 
+def get_master_sheet_versions(client, page_ids, children=False):
+    """Return {page_id: version} for the pages holding the master sheet, without fetching their bodies.
+
+    With children, the master sheet is every child page of the given pages; otherwise it is the
+    given pages themselves, looked up with one CQL search.
+    """
+    if children:
+        return {str(page['id']): page['version']['number']
+                for root in page_ids for page in client.get_child_pages(root, expand="version")}
+    if len(page_ids) == 1:
+        return {page_ids[0]: client.get_page(page_ids[0])['version']['number']}
+    cql = f"id in ({','.join(page_ids)})"
+    versions = {str(page['id']): page['version']['number']
+                for page in client.search_all_content(cql, expand="version", limit=len(page_ids))}
+    missing = [page_id for page_id in page_ids if page_id not in versions]
+    if missing:
+        raise ValueError(f"Master sheet pages not found: {', '.join(missing)}")
+    return {page_id: versions[page_id] for page_id in page_ids}
+
+def fetch_master_sheet_page(client, page_id):
+    """Fetch one master sheet page and parse its rows; returns (version, rows)."""
+    page_data = client.get_page(page_id, expand="body.storage,version")
+    try:
+        rows = parse_table_to_dict(get_page_html_content(page_data))
+    except ValueError as e:
+        raise ValueError(f"Master sheet page {page_id}: {e}")
+    return page_data['version']['number'], rows
+
+def merge_master_sheet_pages(pages):
+    """Merge [(page_id, rows)] in order, raising ValueError when an HTML file is listed more than once.
+
+    A repeated HTML file is a duplicate whether it is on another page or in another row or table
+    of the same page; the error names the page and ID of both listings.
+    """
+    locations = {}
+    merged = []
+    duplicates = []
+    for page_id, rows in pages:
+        for row in rows:
+            location = f"page {page_id}, ID {row['ID']}"
+            if row["HTML"] in locations:
+                duplicates.append(f"{row['HTML']} ({locations[row['HTML']]} and {location})")
+            else:
+                locations[row["HTML"]] = location
+                merged.append(row)
+    if duplicates:
+        raise ValueError(f"HTML files listed more than once in the master sheet: {', '.join(duplicates)}")
+    return merged
+
+def get_webpage(page_id, output: str, force=False, children=False, workers=8):
+    """Write the master sheet's HTML to ID rows to output and return them.
+
+    page_id is one page ID or a list of them; with children, the master sheet is split across the
+    child pages of those pages instead. The pages' versions are checked first (no bodies are
+    transferred); when output was already parsed from those versions it is reused as is, unless
+    force is set. Otherwise every page is fetched and parsed concurrently and the rows are merged.
+    """
     logging.basicConfig(level=logging.DEBUG)
+    page_ids = [str(page_id)] if isinstance(page_id, (str, int)) else [str(p) for p in page_id]
 
-    # Get environment variables
-    confluence_env = get_confluence_env()
-    
-    # Build the API URL
-    url = get_confluence_content_page_url(page_id=page_id, instance=confluence_env["instance"])
-    
-    # Authentication
-    auth = HTTPBasicAuth(confluence_env["email"], confluence_env["api_token"])
-    
     try:
-        # Fetch the Confluence page
-        page_data = fetch_confluence_page(url, auth)
-        
-        # Extract and print the HTML body content
-        html_body = get_page_html_content(page_data)
-        json_data = parse_table_to_dict(html_body)
-        logging.debug(f'JSON Data: {json_data}')
-        json.dump(json_data, open(output, 'w'))
-        
+        with ConfluenceClient(pool_size=workers) as client:
+            versions = None
+            if children or not force:
+                with pipeline_stage("read_confluence_db.version"):
+                    versions = get_master_sheet_versions(client, page_ids, children)
+                if not versions:
+                    raise ValueError(f"No master sheet pages under {', '.join(page_ids)}")
+                if not force and load_cached_versions(output) == versions:
+                    logging.info(f"{len(versions)} master sheet page(s) unchanged; reusing {output}")
+                    with open(output, 'r') as f:
+                        return json.load(f)
+
+            # Fetch and parse every page of the master sheet
+            shard_ids = list(versions) if children else page_ids
+            with pipeline_stage("read_confluence_db.fetch"):
+                with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+                    fetched = list(executor.map(
+                        lambda shard_id: timed_stage_item("read_confluence_db.fetch", fetch_master_sheet_page, client, shard_id),
+                        shard_ids))
+
+        with pipeline_stage("read_confluence_db.merge"):
+            json_data = merge_master_sheet_pages([(shard_id, rows) for shard_id, (_, rows) in zip(shard_ids, fetched)])
+        add_stage_items("read_confluence_db.merge", len(json_data))
+        versions = {shard_id: version for shard_id, (version, _) in zip(shard_ids, fetched)}
+        logging.info(f"Read {len(json_data)} HTML to ID rows from {len(versions)} master sheet page(s)")
+        save_json_atomic(json_data, output)
+        save_json_atomic({"pages": versions}, get_cache_meta_path(output))
+        return json_data
+
     except Exception as e:
         logging.error(f"An error occurred: {e}")
         raise
@@ -80,8 +207,19 @@ if __name__ == "__main__":
     import argparse
 
     parser = argparse.ArgumentParser()
-    parser.add_argument("-p", "--page_id", required=False, help="Confluence page ID",default="9994318")
+    parser.add_argument("-p", "--page_id", required=False, nargs="+", help="Confluence page ID(s) of the master sheet", default=["9994318"])
+    parser.add_argument("--children", action="store_true", help="Read the master sheet from the child pages of the given page(s)")
+    parser.add_argument("-w", "--workers", required=False, type=int, default=8, help="Pages fetched concurrently (default: 8)")
     parser.add_argument("-o", "--output", required=False, help="Output file path", default="html_to_ids.json")
+    parser.add_argument("--force", action="store_true", help="Fetch and parse the page even if its version is unchanged")
+    parser.add_argument("--timings", required=False, help="Write per-stage timings to this JSON report")
+    parser.add_argument("--profile", required=False, help="Dump cProfile output per stage into this directory")
     args = parser.parse_args()
 
-    get_webpage(page_id=args.page_id, output=args.output)
+    if args.timings or args.profile:
+        enable_pipeline_metrics(profile_dir=args.profile)
+    try:
+        get_webpage(page_id=args.page_id, output=args.output, force=args.force, children=args.children,
+                    workers=args.workers)
+    finally:
+        write_pipeline_metrics(args.timings)
@@ -1,19 +1,20 @@
 import os
 import json
 import logging
-import requests
-from requests.auth import HTTPBasicAuth
+import re
+import hashlib
+import threading
 import concurrent.futures
 import argparse
+from collections import namedtuple
 
-def get_confluence_env():
-    """Retrieve environment variables for Confluence."""
-    return {
-        "space": os.getenv('CONFLUENCE_SPACE'),
-        "email": os.getenv('CONFLUENCE_EMAIL'),
-        "instance": os.getenv('CONFLUENCE_INSTANCE'),
-        "api_token": os.getenv('CONFLUENCE_TOKEN'),
-    }
+try:
+    from pipeline_metrics import enable_pipeline_metrics, pipeline_stage, timed_stage_item, write_pipeline_metrics
+    from confluence_client import ConfluenceClient, PageVersionConflict
+    from permset_changeset import load_changeset
+except ImportError:
+    # Inlined ahead of this script in local_win_python.py
+    pass
 
 def read_html_from_file(file_path):
     """Read HTML content from a local file."""
@@ -24,50 +25,111 @@ def read_html_from_file(file_path):
     except Exception as e:
         raise Exception(f"Error reading file {file_path}: {e}")
 
-def get_confluence_page_url(page_id: str, instance: str):
-    """Construct the Confluence API URL to fetch the page content."""
-    return f"https://{instance}.atlassian.net/wiki/rest/api/content/{page_id}"
-
-def fetch_confluence_page(url, auth):
-    """Fetch the current version of a Confluence page."""
-    response = requests.get(url, auth=auth)
-    if response.status_code == 200:
-        return response.json()
-    else:
-        raise Exception(f"Failed to fetch the page: {response.status_code} - {response.text}")
-
-def update_confluence_page(page_id, html_content, current_version, page_title, instance):
-    """Update a Confluence page with new HTML content."""
-    url = get_confluence_page_url(page_id, instance)
-    confluence_env = get_confluence_env()
-
-    # Prepare data for updating the page
-    data = {
-        "version": {"number": current_version + 1},
-        "title": page_title,
-        "type": "page",
-        "space": {"key": confluence_env["space"]},
-        "body": {
-            "storage": {
-                "value": html_content,
-                "representation": "storage"
-            }
-        }
-    }
-
-    auth = HTTPBasicAuth(confluence_env["email"], confluence_env["api_token"])
-    headers = {"Content-Type": "application/json"}
-    response = requests.put(url, json=data, auth=auth, headers=headers)
-
-    if response.status_code == 200:
-        return "Page updated successfully."
-    else:
-        raise Exception(f"Failed to update the page: {response.status_code} - {response.text}")
-
-def process_page_update(item, path_prefix):
-    """Process page updates for each item in the JSON."""
-    logging.basicConfig(level=logging.DEBUG)
-    
+# Outcome of one page update; status is "updated", "skipped" (content unchanged) or "failed",
+# detail holds the error for failures
+PageUpdateResult = namedtuple('PageUpdateResult', ['page_id', 'html_file', 'status', 'version', 'detail'])
+
+# The "<date> | <org>" line json_to_html stamps on every report changes on every run
+PAGE_STAMP_PATTERN = re.compile(r'<p><small>[^<]*</small></p>')
+
+def hash_page_content(html_content):
+    """Hash a report with the volatile stamp line removed and whitespace runs collapsed."""
+    normalized = ' '.join(PAGE_STAMP_PATTERN.sub('', html_content, count=1).split())
+    return hashlib.sha256(normalized.encode('utf-8')).hexdigest()
+
+class PageLedger:
+    """Local record of what this tool last wrote to each page (content hash, version, title).
+
+    The recorded version lets the next run PUT version + 1 straight away instead of looking the
+    page up first. With no path the ledger starts empty and is never saved, so every page is
+    looked up and written.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.pages = {}
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            with open(path, "r") as f:
+                self.pages = json.load(f)
+
+    def is_unchanged(self, page_id, content_hash):
+        entry = self.pages.get(str(page_id))
+        return entry is not None and entry.get("hash") == content_hash
+
+    def known_versions(self):
+        """Return {page_id: (version, title)} for every page this ledger has written."""
+        with self._lock:
+            return {page_id: (entry["version"], entry["title"]) for page_id, entry in self.pages.items()
+                    if entry.get("version") is not None}
+
+    def record(self, page_id, content_hash, version, title):
+        with self._lock:
+            self.pages[str(page_id)] = {"hash": content_hash, "version": version, "title": title}
+
+    def save(self):
+        if not self.path:
+            return
+        with self._lock:
+            with open(f"{self.path}.tmp", "w") as f:
+                json.dump(self.pages, f, indent=4, sort_keys=True)
+            os.replace(f"{self.path}.tmp", self.path)
+
+def chunked(items, size):
+    """Split a list into consecutive chunks of at most size items."""
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+def lookup_page_versions(client, page_ids):
+    """Resolve {page_id: (version, title)} for a batch of pages with a single CQL search.
+
+    Only the version is expanded; the title is part of every search result.
+    """
+    cql = f"id in ({','.join(str(page_id) for page_id in page_ids)})"
+    return {str(page['id']): (page['version']['number'], page['title'])
+            for page in client.search_all_content(cql, expand="version", limit=len(page_ids))}
+
+def prefetch_page_versions(client, page_ids, workers, batch_size=50):
+    """Look up the current version and title of every page in batches, running batches concurrently.
+
+    A batch that fails is logged and left out; those pages fall back to a GET of their own.
+    """
+    page_versions = {}
+    batches = chunked(sorted({str(page_id) for page_id in page_ids}), batch_size)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(lookup_page_versions, client, batch): batch for batch in batches}
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                page_versions.update(future.result())
+            except Exception as e:
+                logging.warning(f"Version lookup failed for {len(futures[future])} pages, fetching them one by one: {e}")
+    logging.info(f"Prefetched versions for {len(page_versions)} of {len(page_ids)} pages in {len(batches)} searches")
+    return page_versions
+
+def get_page_version(client, page_id, page_versions):
+    """Return (version, title) for a page, from the prefetched lookup when it has the page."""
+    if str(page_id) in page_versions:
+        return page_versions[str(page_id)]
+    page_data = client.get_page(page_id)
+    return page_data['version']['number'], page_data['title']
+
+def update_confluence_page(client, page_id, html_content, current_version, page_title):
+    """Update a Confluence page with new HTML content, returning (new version number, title).
+
+    current_version may come from the ledger and be stale when someone edited the page by hand;
+    Confluence then answers 409 and the page is read back once to retry on its real version.
+    """
+    try:
+        client.update_page(page_id, html_content, current_version + 1, page_title)
+        return current_version + 1, page_title
+    except PageVersionConflict:
+        logging.info(f"Page {page_id} is no longer at version {current_version}; re-reading it")
+    page_data = client.get_page(page_id)
+    current_version, page_title = page_data['version']['number'], page_data['title']
+    client.update_page(page_id, html_content, current_version + 1, page_title)
+    return current_version + 1, page_title
+
+def process_page_update(item, path_prefix, client, ledger, page_versions):
+    """Process page updates for each item in the JSON; pages whose content is unchanged are skipped."""
     logging.debug(f"Prefix: {path_prefix}")
     html_file = os.path.join(path_prefix, item["HTML"])
     page_id = item["ID"]
@@ -78,28 +140,52 @@ def process_page_update(item, path_prefix):
     try:
         html_content = read_html_from_file(html_file)
     except Exception as e:
-        return f"Error reading HTML for page {page_id}: {e}"
+        return PageUpdateResult(page_id, html_file, "failed", None, f"Error reading HTML: {e}")
 
-    # Get environment variables and set up authentication
-    confluence_env = get_confluence_env()
-    auth = HTTPBasicAuth(confluence_env["email"], confluence_env["api_token"])
-    instance = confluence_env["instance"]
+    content_hash = hash_page_content(html_content)
+    if ledger.is_unchanged(page_id, content_hash):
+        logging.debug(f"Page {page_id} is unchanged; skipping")
+        return PageUpdateResult(page_id, html_file, "skipped", None, None)
 
     # Get the current version of the page
-    url = get_confluence_page_url(page_id, instance)
     try:
-        page_data = fetch_confluence_page(url, auth)
-        current_version = page_data['version']['number']
-        page_title = page_data['title']
-        instance = confluence_env["instance"]
-        logging.info("Instance: " + instance)
-        
+        current_version, page_title = get_page_version(client, page_id, page_versions)
+
         # Update the page with the new HTML content
-        result = update_confluence_page(page_id, html_content, current_version, page_title, instance)
-        logging.info(f"Page {page_id} updated successfully: {result}")
-        return f"Page {page_id} updated successfully: {result}"
+        version, page_title = update_confluence_page(client, page_id, html_content, current_version, page_title)
+        ledger.record(page_id, content_hash, version, page_title)
+        logging.info(f"Page {page_id} updated successfully to version {version}")
+        return PageUpdateResult(page_id, html_file, "updated", version, None)
     except Exception as e:
-        return f"Error updating page {page_id}: {e}"
+        return PageUpdateResult(page_id, html_file, "failed", None, str(e))
+
+def bounded_page_updates(items, path_prefix, client, ledger, page_versions, workers):
+    """Update the page of every master sheet row yielded by items, with at most workers updates in flight.
+
+    The next row is only taken from items once an update finished, and each update reads its
+    HTML file on its worker, so no more than workers reports are held in memory at once and a
+    lazy items (e.g. fed from a queue) is held back by a slow Confluence. Returns a
+    PageUpdateResult per row, in the order of items.
+    """
+    slots = threading.Semaphore(workers)
+    futures = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        for item in items:
+            slots.acquire()
+            future = executor.submit(timed_stage_item, "update_confluence.upload", process_page_update,
+                                     item, path_prefix, client, ledger, page_versions)
+            future.add_done_callback(lambda _: slots.release())
+            futures.append(future)
+    return [future.result() for future in futures]
+
+def log_page_update_results(results):
+    """Log failed updates and a summary line; returns the number of failures."""
+    failed = [result for result in results if result.status == "failed"]
+    skipped = sum(1 for result in results if result.status == "skipped")
+    for result in failed:
+        logging.error(f"Error updating page {result.page_id} ({result.html_file}): {result.detail}")
+    logging.info(f"Updated {len(results) - len(failed) - skipped} pages, skipped {skipped} unchanged, {len(failed)} failed")
+    return len(failed)
 
 def load_html_to_ids(file_path):
     """Load the JSON file containing HTML file paths and corresponding Confluence page IDs."""
@@ -110,29 +196,124 @@ def load_html_to_ids(file_path):
     except Exception as e:
         raise Exception(f"Error loading JSON file {file_path}: {e}")
 
-def parallel_confluence_html_updates(input_file, path_prefix):
-    """Parallelize the upload of HTML files to Confluence pages."""
-    logging.debug(f"Loading HTML to ID mappings from: {input_file}")
-    html_to_ids = load_html_to_ids(input_file)
+def lookup_html_page_versions(client, ledger, html_to_ids, workers):
+    """Return {page_id: (version, title)} from the ledger, prefetching only the pages missing from it."""
+    with pipeline_stage("update_confluence.lookup"):
+        page_versions = ledger.known_versions()
+        unknown = [item["ID"] for item in html_to_ids if str(item["ID"]) not in page_versions]
+        if unknown:
+            page_versions.update(prefetch_page_versions(client, unknown, workers))
+    return page_versions
+
+def parallel_confluence_html_updates(input_file, path_prefix, workers=None, ledger_file=None,
+                                     rate_limit=None, max_retries=5, changeset=None, html_to_ids=None):
+    """Parallelize the upload of HTML files to Confluence pages.
+
+    At most workers updates are in flight (see bounded_page_updates), sharing one
+    ConfluenceClient whose connection pool is sized to match. Returns a PageUpdateResult per page.
+
+    With a ledger_file, pages whose normalized content hash matches what was last written are not
+    PUT again, and the others are PUT on their recorded version + 1; only pages missing from the
+    ledger have their versions and titles prefetched with batched CQL searches. Either way each
+    update is normally a single PUT.
+
+    Throttled (429) and transient 5xx responses are retried by the client's scheduler, which also
+    backs concurrency off below workers while Confluence throttles and caps the request rate at
+    rate_limit per second when given.
+
+    With a changeset (see permset_changeset.py) only the pages of permission sets it lists as
+    changed are updated, and any failed update raises so the change set is not committed and
+    those pages are retried on the next run.
+
+    html_to_ids, when given, are the rows already read (e.g. returned by get_webpage) and
+    input_file is not read.
+    """
+    if html_to_ids is None:
+        logging.debug(f"Loading HTML to ID mappings from: {input_file}")
+        html_to_ids = load_html_to_ids(input_file)
+    if changeset is not None:
+        html_to_ids = [item for item in html_to_ids if item["HTML"].removesuffix('.html') in changeset.changed]
 
     logging.debug(f"Loaded HTML to ID mappings: {html_to_ids}")
 
-    # Parallelize the upload of HTML files to Confluence pages
-    with concurrent.futures.ThreadPoolExecutor() as executor:
-        futures = [executor.submit(process_page_update, item, path_prefix) for item in html_to_ids]
-        for future in concurrent.futures.as_completed(futures):
-            try:
-                result = future.result()
-                logging.info(result)
-            except Exception as e:
-                logging.error(f"Error in page update: {e}")
+    workers = workers or min(32, (os.cpu_count() or 1) + 4)
+    ledger = PageLedger(ledger_file)
+
+    with ConfluenceClient(pool_size=workers, rate_limit=rate_limit, max_retries=max_retries) as client:
+        page_versions = lookup_html_page_versions(client, ledger, html_to_ids, workers)
+
+        # Parallelize the upload of HTML files to Confluence pages
+        with pipeline_stage("update_confluence.upload"):
+            results = bounded_page_updates(html_to_ids, path_prefix, client, ledger, page_versions, workers)
+        logging.info(f"Request scheduler: {client.scheduler.stats()}")
+
+    ledger.save()
+    failures = log_page_update_results(results)
+    if changeset is not None and failures:
+        raise RuntimeError(f"Failed to update {failures} of {len(results)} changed pages")
+    return results
+
+def stream_confluence_html_updates(html_files, input_file, path_prefix, workers=None, ledger_file=None,
+                                   rate_limit=None, max_retries=5, changeset=None, html_to_ids=None):
+    """Update the page of each HTML file name yielded by html_files as soon as it arrives.
+
+    The streaming counterpart of parallel_confluence_html_updates, for HTML files that are still
+    being rendered: html_files is typically fed from a bounded queue. Only workers updates are
+    in flight at once and the next file is not taken from html_files until one of them finishes,
+    so a slow Confluence holds the producer back instead of letting files pile up. Files not on
+    the master sheet are ignored; ledger, rate limit, retries, changeset and html_to_ids work as
+    in parallel_confluence_html_updates.
+    """
+    if html_to_ids is None:
+        html_to_ids = load_html_to_ids(input_file)
+    if changeset is not None:
+        html_to_ids = [item for item in html_to_ids if item["HTML"].removesuffix('.html') in changeset.changed]
+    items = {item["HTML"]: item for item in html_to_ids}
+
+    def master_sheet_items():
+        for html_file in html_files:
+            item = items.get(html_file)
+            if item is None:
+                logging.debug(f"{html_file} is not on the master sheet; not uploading it")
+                continue
+            yield item
+
+    workers = workers or min(32, (os.cpu_count() or 1) + 4)
+    ledger = PageLedger(ledger_file)
+
+    with ConfluenceClient(pool_size=workers, rate_limit=rate_limit, max_retries=max_retries) as client:
+        page_versions = lookup_html_page_versions(client, ledger, html_to_ids, workers)
+
+        with pipeline_stage("update_confluence.upload"):
+            results = bounded_page_updates(master_sheet_items(), path_prefix, client, ledger, page_versions, workers)
+        logging.info(f"Request scheduler: {client.scheduler.stats()}")
+
+    ledger.save()
+    failures = log_page_update_results(results)
+    if changeset is not None and failures:
+        raise RuntimeError(f"Failed to update {failures} of {len(results)} changed pages")
+    return results
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Update Confluence pages with new HTML content.")
     parser.add_argument("-i", "--input", required=True, help="Path to the JSON file with HTML and page ID mappings")
     parser.add_argument("-p", "--prefix", required=False, help="Path prefix", default="")
+    parser.add_argument("-w", "--workers", required=False, type=int, help="Maximum number of updates in flight (default: CPU count + 4, max 32)")
+    parser.add_argument("--rate", required=False, type=float, help="Maximum Confluence requests per second (default: unlimited)")
+    parser.add_argument("--max_retries", required=False, type=int, default=5, help="Retries for throttled or failed requests (default: 5)")
+    parser.add_argument("--ledger", required=False, help="JSON ledger of content last written to each page; unchanged pages are skipped")
+    parser.add_argument("--changeset", required=False, help="Only update the pages of permission sets changed in this change set file")
+    parser.add_argument("--timings", required=False, help="Write per-stage timings to this JSON report")
+    parser.add_argument("--profile", required=False, help="Dump cProfile output per stage into this directory")
     args = parser.parse_args()
 
     logging.basicConfig(level=logging.DEBUG)
-    
-    parallel_confluence_html_updates(args.input, args.prefix)
+
+    if args.timings or args.profile:
+        enable_pipeline_metrics(profile_dir=args.profile)
+    try:
+        parallel_confluence_html_updates(args.input, args.prefix, workers=args.workers,
+                                         ledger_file=args.ledger, rate_limit=args.rate, max_retries=args.max_retries,
+                                         changeset=load_changeset(args.changeset))
+    finally:
+        write_pipeline_metrics(args.timings)
@@ -1,3 +1,15 @@
+try:
+    from permset_store import PermsetStoreWriter, encode_store_record, load_store_index
+    from permset_changeset import load_changeset, hash_file
+    from pipeline_metrics import (enable_pipeline_metrics, pipeline_stage, record_stage_item,
+                                  write_pipeline_metrics, memory_tracking_enabled, traced_call,
+                                  record_item_memory, MemoryBudget, estimate_item_memory,
+                                  submit_within_budget, get_profile_dir, profiled_stage_item,
+                                  profiled_worker_call)
+except ImportError:
+    # Inlined ahead of this script in local_win_python.py
+    pass
+
 def export_xml_to_json(xml_file, json_file):
     """Convert a single XML file to a JSON file."""
     import xmltodict
@@ -9,29 +21,428 @@ def export_xml_to_json(xml_file, json_file):
     with open(json_file, 'w', encoding='utf-8') as jsonf:
         json.dump(data_dict, jsonf, indent=4)
 
-def process_xml_to_json_files(input_dir, output_dir, extension):
-    """Process files with the specified extension in the input directory and save them as JSON in the output directory."""
+def _qualified_name(name, namespaces):
+    """Map an ElementTree '{uri}local' name back to the 'prefix:local' spelling xmltodict keeps."""
+    if not name.startswith('{'):
+        return name
+    uri, local = name[1:].split('}', 1)
+    prefix = namespaces.get(uri, '')
+    return f'{prefix}:{local}' if prefix else local
+
+def _element_to_dict_value(elem, namespaces, declarations):
+    """Convert an ElementTree element to the value xmltodict would produce for it."""
+    item = {}
+    for prefix, uri in declarations.get(id(elem), ()):
+        item['@xmlns:' + prefix if prefix else '@xmlns'] = uri
+    for name, value in elem.attrib.items():
+        item['@' + _qualified_name(name, namespaces)] = value
+
+    text = [elem.text or '']
+    for child in elem:
+        key = _qualified_name(child.tag, namespaces)
+        value = _element_to_dict_value(child, namespaces, declarations)
+        if key not in item:
+            item[key] = value
+        elif isinstance(item[key], list):
+            item[key].append(value)
+        else:
+            item[key] = [item[key], value]
+        text.append(child.tail or '')
+
+    text = ''.join(text).strip()
+    if not item:
+        return text or None
+    if text:
+        item['#text'] = text
+    return item
+
+class StreamingFallback(Exception):
+    """Raised when a document has a shape the streaming writer cannot reproduce byte-for-byte."""
+
+def _stream_xml_to_json(xml_file, out, compact=False):
+    """Write the indent=4 JSON for xml_file to out, holding at most one root child in memory.
+
+    With compact=True the JSON is written without whitespace instead, as encode_store_record does.
+    """
+    import json
+    import xml.etree.ElementTree as ET
+
+    namespaces = {}
+    declarations = {}
+    pending_declarations = []
+    depth = 0
+    root = None
+    members = 0
+    current_key = None
+    current_value = None
+    in_list = False
+    seen_keys = set()
+    if compact:
+        root_indent, member_indent, item_indent, newline, key_separator = '', '', '', '', ':'
+        encoder = json.JSONEncoder(separators=(',', ':'))
+    else:
+        root_indent, member_indent, item_indent, newline, key_separator = ' ' * 4, ' ' * 8, ' ' * 12, '\n', ': '
+        encoder = json.JSONEncoder(indent=4)
+
+    def dump(value, indent):
+        return encoder.encode(value).replace('\n', '\n' + indent) if indent else encoder.encode(value)
+
+    def write_member(key, text):
+        nonlocal members
+        if members:
+            out.write(',' + newline)
+        out.write(f'{member_indent}{json.dumps(key)}{key_separator}{text}')
+        members += 1
+
+    def flush_current():
+        if current_key is None:
+            return
+        if in_list:
+            out.write(f'{newline}{member_indent}]')
+        else:
+            write_member(current_key, dump(current_value, member_indent))
+
+    for event, item in ET.iterparse(xml_file, events=('start-ns', 'start', 'end')):
+        if event == 'start-ns':
+            prefix, uri = item
+            namespaces.setdefault(uri, prefix)
+            pending_declarations.append((prefix, uri))
+            continue
+
+        if event == 'start':
+            if pending_declarations:
+                declarations[id(item)] = pending_declarations
+                pending_declarations = []
+            depth += 1
+            if depth == 1:
+                root = item
+                out.write('{' + newline + root_indent + json.dumps(_qualified_name(root.tag, namespaces))
+                          + key_separator + '{' + newline)
+                for prefix, uri in declarations.pop(id(root), ()):
+                    write_member('@xmlns:' + prefix if prefix else '@xmlns', json.dumps(uri))
+                for name, value in root.attrib.items():
+                    write_member('@' + _qualified_name(name, namespaces), json.dumps(value))
+            continue
+
+        depth -= 1
+        if depth != 1:
+            if depth == 0 and (root.text or '').strip():
+                raise StreamingFallback('root element has text content')
+            continue
+
+        # A direct child of the root is complete: convert it and drop it from the tree.
+        key = _qualified_name(item.tag, namespaces)
+        value = _element_to_dict_value(item, namespaces, declarations)
+        if (item.tail or '').strip():
+            raise StreamingFallback('root element has mixed content')
+        for elem in item.iter():
+            declarations.pop(id(elem), None)
+        root.remove(item)
+
+        if key == current_key:
+            if not in_list:
+                # Second sibling with the same tag: xmltodict turns the key into a list.
+                write_member(key, '[' + newline + item_indent + dump(current_value, item_indent))
+                current_value = None
+                in_list = True
+            out.write(',' + newline + item_indent + dump(value, item_indent))
+            continue
+
+        if key in seen_keys:
+            raise StreamingFallback(f'non-contiguous <{key}> elements')
+        flush_current()
+        if current_key is not None:
+            seen_keys.add(current_key)
+        current_key, current_value, in_list = key, value, False
+
+    flush_current()
+    if not members:
+        raise StreamingFallback('root element has no attributes or children')
+    out.write(newline + root_indent + '}' + newline + '}')
+
+def export_xml_to_json_streaming(xml_file, json_file):
+    """Convert a single XML file to a JSON file without building the whole document in memory.
+
+    The output is byte-identical to export_xml_to_json. Documents the streaming writer cannot
+    reproduce exactly (e.g. repeated tags split by other tags) fall back to export_xml_to_json.
+    """
+    import os
+    import logging
+    tmp_file = f'{json_file}.tmp'
+    try:
+        with open(tmp_file, 'w', encoding='utf-8') as jsonf:
+            _stream_xml_to_json(xml_file, jsonf)
+    except StreamingFallback as e:
+        logging.debug(f"Streaming parse of {xml_file} not possible ({e}); using xmltodict")
+        os.remove(tmp_file)
+        export_xml_to_json(xml_file, json_file)
+        return
+    except Exception:
+        os.remove(tmp_file)
+        raise
+    os.replace(tmp_file, json_file)
+
+def export_xml_to_store_record(xml_file):
+    """Parse a single XML file and return it encoded as a permission set store record."""
+    import xmltodict
+    with open(xml_file, 'r', encoding='utf-8') as file:
+        return encode_store_record(xmltodict.parse(file.read()))
+
+def export_xml_to_store_record_streaming(xml_file):
+    """Return the same store record as export_xml_to_store_record without building the whole document.
+
+    Only the compact record itself is held in memory; documents the streaming writer cannot
+    reproduce exactly fall back to export_xml_to_store_record.
+    """
+    import io
+    import logging
+    out = io.StringIO()
+    try:
+        _stream_xml_to_json(xml_file, out, compact=True)
+    except StreamingFallback as e:
+        logging.debug(f"Streaming parse of {xml_file} not possible ({e}); using xmltodict")
+        return export_xml_to_store_record(xml_file)
+    return out.getvalue().encode('utf-8')
+
+def export_xml_to_json_batch(jobs, stream=False, store=False, memory=False):
+    """Convert a batch of (xml_file, target) pairs.
+
+    target is a JSON file path, or with store=True the permission set name; store records are
+    returned as (name, record) for the caller to append. Returns (records, failures, durations,
+    memory_use) where failures holds (xml_file, error) for each file that could not be converted,
+    durations the seconds spent on each file and, with memory=True, memory_use holds
+    (xml_file, traced peak bytes, RSS bytes) per file (see pipeline_metrics.traced_call).
+    """
+    import time
+    export = export_xml_to_json_streaming if stream else export_xml_to_json
+    export_record = export_xml_to_store_record_streaming if stream else export_xml_to_store_record
+    records = []
+    failures = []
+    durations = []
+    memory_use = []
+    for xml_file, target in jobs:
+        start = time.perf_counter()
+        try:
+            if store:
+                convert, convert_args = export_record, (xml_file,)
+            else:
+                convert, convert_args = export, (xml_file, target)
+            if memory:
+                result, traced_peak, rss = traced_call(convert, *convert_args)
+                memory_use.append((xml_file, traced_peak, rss))
+            else:
+                result = convert(*convert_args)
+            if store:
+                records.append((target, result))
+        except Exception as e:
+            failures.append((xml_file, f"{type(e).__name__}: {e}"))
+        durations.append(time.perf_counter() - start)
+    return records, failures, durations, memory_use
+
+def batch_files_by_size(jobs, workers):
+    """Split (xml_file, json_file) pairs into batches of roughly equal total byte size.
+
+    Files are taken largest first, so a handful of giant permission sets end up in batches of
+    their own instead of all landing on the same worker behind many small files.
+    """
+    import os
+    sized = sorted(((os.path.getsize(xml_file), (xml_file, json_file)) for xml_file, json_file in jobs),
+                   key=lambda pair: pair[0], reverse=True)
+    total = sum(size for size, _ in sized)
+    # Several batches per worker keeps every worker busy until the very end of the run.
+    target = max(1, total // max(1, workers * 4))
+
+    batches = []
+    batch, batch_size = [], 0
+    for size, job in sized:
+        if batch and batch_size + size > target:
+            batches.append(batch)
+            batch, batch_size = [], 0
+        batch.append(job)
+        batch_size += size
+    if batch:
+        batches.append(batch)
+    return batches
+
+def get_manifest_path(output_dir):
+    """Return the path of the conversion manifest kept in the output directory."""
+    import os
+    return os.path.join(output_dir, '.xml_to_json-manifest.json')
+
+def load_manifest(output_dir):
+    """Load the conversion manifest, returning an empty one when missing or unreadable."""
+    import json
+    import logging
+    try:
+        with open(get_manifest_path(output_dir), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        logging.warning(f"Ignoring unreadable manifest in {output_dir}: {e}")
+        return {}
+
+def save_manifest(output_dir, manifest):
+    """Atomically write the conversion manifest to the output directory."""
+    import os
+    import json
+    manifest_path = get_manifest_path(output_dir)
+    with open(f'{manifest_path}.tmp', 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=4, sort_keys=True)
+    os.replace(f'{manifest_path}.tmp', manifest_path)
+
+def process_xml_to_json_files(input_dir, output_dir, extension, stream=False, executor='thread', workers=None,
+                              full=False, store=False, changeset=None, memory_budget=None):
+    """Process files with the specified extension in the input directory and save them as JSON in the output directory.
+
+    With stream=True each file is converted with export_xml_to_json_streaming (or, with store=True,
+    export_xml_to_store_record_streaming), so peak memory stays flat regardless of how many
+    elements a permission set has.
+
+    executor selects how files are converted: 'thread' (default), 'process' for a process pool
+    that sidesteps the GIL, or 'serial'. Failed files are logged and reported with a RuntimeError
+    once every file has been attempted.
+
+    A manifest in the output directory records each source file's size, mtime and SHA-256. Files
+    whose content is unchanged are skipped and JSON for sources that disappeared is deleted;
+    full=True converts everything regardless of the manifest. Returns the converted, skipped and
+    removed counts.
+
+    With store=True permission sets are appended to a single permsets.ndjson store in the output
+    directory (see permset_store.py) instead of being written as one indented JSON file each.
+
+    With a changeset (see permset_changeset.py) only the permission sets it lists as changed are
+    looked at, and only those it lists as removed are deleted; everything else keeps its output
+    and manifest entry untouched.
+
+    memory_budget (bytes) caps the estimated memory of the files being converted at once (see
+    pipeline_metrics.MemoryBudget): while large permission sets are in flight fewer files run in
+    parallel, and a file larger than the budget runs on its own.
+    """
     import os
-    from concurrent.futures import ThreadPoolExecutor
+    from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
     import logging
+    if executor not in ('thread', 'process', 'serial'):
+        raise ValueError(f"Unknown executor: {executor}")
+
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
         logging.debug(f"Created output directory: {output_dir}")
     
     # Find files with the given extension in the input directory
     files = [f for f in os.listdir(input_dir) if f.endswith(extension)]
+    if changeset is not None:
+        files = [f for f in files if os.path.splitext(f)[0] in changeset.changed]
     logging.debug(f"Found {len(files)} files with extension {extension} in {input_dir} - {files}")
 
-    with ThreadPoolExecutor() as executor:
+    with pipeline_stage("xml_to_json.scan"):
+        manifest = load_manifest(output_dir)
+        store_index = load_store_index(output_dir) if store else {}
+        new_manifest = {}
+        jobs = []
+        skipped = 0
         for file in files:
             file_path = os.path.join(input_dir, file)
-            json_filename = os.path.splitext(file)[0] + '.json'
+            name = os.path.splitext(file)[0]
+            json_filename = name + '.json'
             json_path = os.path.join(output_dir, json_filename)
-            
-            # Submit each file for parallel processing
-            executor.submit(export_xml_to_json, file_path, json_path)
+            stat = os.stat(file_path)
+            entry = {"size": stat.st_size, "mtime": stat.st_mtime, "json": json_filename}
+
+            previous = manifest.get(file)
+            output_exists = name in store_index if store else os.path.exists(json_path)
+            if previous and not full and output_exists:
+                # Unchanged size and mtime means unchanged content; only hash when either moved.
+                if previous["size"] == stat.st_size and previous["mtime"] == stat.st_mtime:
+                    entry["sha256"] = previous["sha256"]
+                else:
+                    entry["sha256"] = hash_file(file_path)
+                if entry["sha256"] == previous["sha256"]:
+                    new_manifest[file] = entry
+                    skipped += 1
+                    continue
+            else:
+                entry["sha256"] = hash_file(file_path)
+
+            new_manifest[file] = entry
+            jobs.append((file_path, name if store else json_path))
+
+        writer = PermsetStoreWriter(output_dir) if store else None
+
+        # Remove JSON produced from sources that no longer exist
+        removed = 0
+        for file, previous in manifest.items():
+            if file in new_manifest:
+                continue
+            if changeset is not None and os.path.splitext(file)[0] not in changeset.removed:
+                new_manifest[file] = previous
+                continue
+            json_path = os.path.join(output_dir, previous["json"])
+            if writer:
+                writer.remove(previous["json"].removesuffix('.json'))
+            elif os.path.exists(json_path):
+                os.remove(json_path)
+                logging.debug(f"Removed {json_path}; {file} no longer exists")
+            removed += 1
+        logging.debug(f"{len(jobs)} files changed, {skipped} unchanged, {removed} removed since the last run")
+
+    def collect(result):
+        records, batch_failures, durations, memory_use = result
+        for name, record in records:
+            writer.append_record(name, record)
+        failures.extend(batch_failures)
+        for seconds in durations:
+            record_stage_item("xml_to_json.convert", seconds)
+        for xml_file, traced_peak, rss in memory_use:
+            record_item_memory("xml_to_json.convert", os.path.basename(xml_file), traced_peak, rss)
 
-    logging.info(f"Converted {len(files)} files to JSON in {output_dir}")
+    failures = []
+    memory = memory_tracking_enabled()
+    budget = MemoryBudget(memory_budget) if memory_budget else None
+    with pipeline_stage("xml_to_json.convert"):
+        if executor == 'serial':
+            collect(export_xml_to_json_batch(jobs, stream, store, memory))
+        else:
+            workers = workers or os.cpu_count() or 1
+            if executor == 'process':
+                pool = ProcessPoolExecutor(max_workers=workers)
+                batches = batch_files_by_size(jobs, workers)
+                # Each worker process dumps its own profile next to the stage's
+                task = ((profiled_worker_call, "xml_to_json.convert", get_profile_dir(), export_xml_to_json_batch)
+                        if get_profile_dir() else (export_xml_to_json_batch,))
+            else:
+                pool = ThreadPoolExecutor(max_workers=workers)
+                batches = [[job] for job in jobs]
+                task = (profiled_stage_item, "xml_to_json.convert", export_xml_to_json_batch)
+            logging.debug(f"Converting {len(jobs)} files in {len(batches)} batches on {workers} {executor} workers")
+
+            with pool:
+                # Submit each batch for parallel processing; a batch converts its files one at a
+                # time, so its largest file decides how much of the memory budget it needs
+                futures = {submit_within_budget(pool, budget, max(estimate_item_memory(xml_file) for xml_file, _ in batch),
+                                                *task, batch, stream, store, memory): batch
+                           for batch in batches}
+                for future in as_completed(futures):
+                    try:
+                        collect(future.result())
+                    except Exception as e:
+                        failures.extend((xml_file, f"{type(e).__name__}: {e}") for xml_file, _ in futures[future])
+
+        if writer:
+            writer.close()
+
+    for xml_file, error in failures:
+        logging.error(f"Failed to convert {xml_file}: {error}")
+        # Forget failed files so the next run retries them
+        new_manifest.pop(os.path.basename(xml_file), None)
+    save_manifest(output_dir, new_manifest)
+
+    counts = {"converted": len(jobs) - len(failures), "skipped": skipped, "removed": removed}
+    logging.info(f"Converted {counts['converted']} files to JSON in {output_dir} "
+                 f"({skipped} unchanged skipped, {removed} removed)")
+    if failures:
+        raise RuntimeError(f"Failed to convert {len(failures)} of {len(jobs)} files to JSON")
+    return counts
 
 def main():
     import argparse
@@ -40,8 +451,30 @@ def main():
     parser.add_argument('--input_dir', '-i', help="Directory containing files")
     parser.add_argument('--output_dir', '-o', help="Directory to save JSON files")
     parser.add_argument('--extension', '-e', default='.xml', help="File extension to process (default: .xml)")
-    
+    parser.add_argument('--stream', action='store_true', help="Use the bounded-memory streaming parser")
+    parser.add_argument('--executor', choices=['thread', 'process', 'serial'], default='thread', help="How files are converted in parallel (default: thread)")
+    parser.add_argument('--workers', '-w', type=int, default=None, help="Number of parallel workers (default: CPU count)")
+    parser.add_argument('--full', action='store_true', help="Ignore the manifest and convert every file")
+    parser.add_argument('--store', action='store_true', help="Append to a single permsets.ndjson store instead of writing one JSON file per permission set")
+    parser.add_argument('--changeset', default=None, help="Only convert the permission sets changed in this change set file")
+    parser.add_argument('--timings', default=None, help="Write per-stage timings to this JSON report")
+    parser.add_argument('--profile', default=None, help="Dump cProfile output per stage into this directory")
+    parser.add_argument('--memory', action='store_true', help="Also record peak memory per stage and per file in the --timings report")
+    parser.add_argument('--memory_budget', type=float, default=None, help="Limit parallel conversions to this estimated memory (MB)")
+
     args = parser.parse_args()
     
+    if args.timings or args.profile or args.memory:
+        enable_pipeline_metrics(profile_dir=args.profile, memory=args.memory)
+
     # Process the files with the specified extension and convert them to JSON in parallel
-    process_xml_to_json_files(args.input_dir, args.output_dir, args.extension)
+    try:
+        process_xml_to_json_files(args.input_dir, args.output_dir, args.extension, stream=args.stream,
+                                  executor=args.executor, workers=args.workers, full=args.full,
+                                  store=args.store, changeset=load_changeset(args.changeset),
+                                  memory_budget=args.memory_budget and int(args.memory_budget * 1024 * 1024))
+    finally:
+        write_pipeline_metrics(args.timings)
+
+if __name__ == "__main__":
+    main()
@@ -5,6 +5,7 @@
 #    python_text = inject_py_file(python_text, 'scripts/read_confluence_db.py')
 #    python_text = inject_py_file(python_text, 'scripts/update_confluence.py')
 #    python_text = inject_py_file(python_text, 'scripts/compare_delta.py')
+#    python_text = inject_py_file(python_text, 'scripts/permset_changeset.py')
 #
 #}
 
@@ -14,6 +15,9 @@ if __name__ == "__main__":
     from pathlib import Path
 
     logging.basicConfig(level=logging.DEBUG)
+    {%- if stage_timings %}
+    enable_pipeline_metrics({% if stage_profiles %}profile_dir="{{ stage_profiles }}"{% endif %}{% if memory_report %}{% if stage_profiles %}, {% endif %}memory=True{% endif %})
+    {%- endif %}
 
     os_ver = os.popen("ver").read()
     if "Microsoft Windows" in os_ver:
@@ -62,19 +66,50 @@ if __name__ == "__main__":
     # XML path
     permissionset_xml_dir = f"{sf_dir}/force-app/main/default/permissionsets"
 
-    # Convert XML to JSON
     permissionset_json_dir = f"{sf_dir}/permset-json"
-    process_xml_to_json_files(Path(permissionset_xml_dir), Path(permissionset_json_dir), ".permissionset-meta.xml")
+    permissionset_html_dir = f"{sf_dir}/permset-html"
+    {%- if incremental %}
+
+    # Read Confluence DB first, so that pages new since the last run are filled too
+    html_to_ids = get_webpage(page_id="{{ CONFLUENCE_MASTER_ID}}", output="html_to_ids.json"{% if CONFLUENCE_MASTER_CHILDREN %}, children=True{% endif %})
+
+    # Only process the permission sets changed since the last successful run, or whose page is new
+    changeset = compute_changeset(permissionset_xml_dir, ".xml", "{{ permset_state }}"{% if permset_snapshot %}, full=not os.path.exists("{{ permset_snapshot }}"){% endif %})
+    add_page_changes(changeset, html_to_ids{% if confluence_ledger %}, load_ledger_pages("{{ confluence_ledger }}"){% endif %})
+    write_changeset("changeset.json", changeset)
+    changeset = load_changeset("changeset.json")
+    {%- endif %}
+    {%- if fused_xml_to_html %}
+
+    # Convert XML straight to HTML, keeping JSON as a side output
+    process_xml_to_html_files(Path(permissionset_xml_dir), Path(permissionset_html_dir), ".permissionset-meta.xml", "{{ SF_ORG }}", json_dir=Path(permissionset_json_dir){% if incremental %}, changeset=changeset{% endif %}{% if memory_budget_mb %}, memory_budget={{ memory_budget_mb }} * 1024 * 1024{% endif %})
+    {%- else %}
+
+    # Convert XML to JSON
+    process_xml_to_json_files(Path(permissionset_xml_dir), Path(permissionset_json_dir), ".permissionset-meta.xml"{% if permset_store %}, store=True{% endif %}{% if incremental %}, changeset=changeset{% endif %}{% if memory_budget_mb %}, memory_budget={{ memory_budget_mb }} * 1024 * 1024{% endif %})
 
     # Convert JSON to HTML
-    permissionset_html_dir = f"{sf_dir}/permset-html"
-    process_json_to_html_files(Path(permissionset_json_dir), Path(permissionset_html_dir), ".permissionset-meta.json", "{{ SF_ORG }}")
+    process_json_to_html_files(Path(permissionset_json_dir), Path(permissionset_html_dir), ".permissionset-meta.json", "{{ SF_ORG }}"{% if permset_store %}, store=True{% endif %}{% if incremental %}, changeset=changeset{% endif %}{% if memory_budget_mb %}, memory_budget={{ memory_budget_mb }} * 1024 * 1024{% endif %})
+    {%- endif %}
+
+    {%- if not incremental %}
 
     # Read Confluence DB
-    get_webpage(page_id="{{ CONFLUENCE_MASTER_ID}}", output="html_to_ids.json")
+    get_webpage(page_id="{{ CONFLUENCE_MASTER_ID}}", output="html_to_ids.json"{% if CONFLUENCE_MASTER_CHILDREN %}, children=True{% endif %})
+    {%- endif %}
 
     # Update Confluence pages
-    parallel_confluence_html_updates("html_to_ids.json", "./permset-html/")
+    parallel_confluence_html_updates("html_to_ids.json", "./permset-html/"{% if confluence_ledger %}, ledger_file="{{ confluence_ledger }}"{% endif %}{% if incremental %}, changeset=changeset{% endif %})
 
     # Compare Delta
-    calculate_diffs(input_dir="permset-html", map_file="html_to_ids.json", output="differences.json")
\ No newline at end of file
+    calculate_diffs(input_dir="permset-html", map_file="html_to_ids.json", output="differences.json"{% if permset_snapshot %}, json_dir=permissionset_json_dir, snapshot="{{ permset_snapshot }}"{% if permset_store and not fused_xml_to_html %}, store=True{% endif %}{% endif %}{% if incremental %}, changeset=changeset{% endif %})
+    {%- if incremental %}
+
+    # Record this run's source file hashes for the next run
+    commit_changeset("changeset.json", "{{ permset_state }}")
+    {%- endif %}
+    {%- if stage_timings %}
+
+    # Per-stage timing report
+    write_pipeline_metrics("{{ stage_timings }}")
+    {%- endif %}
\ No newline at end of file
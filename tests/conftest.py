@@ -0,0 +1,8 @@
+import os
+import sys
+
+# The scripts are standalone files, not a package; import them (and the synthetic data
+# generator in benchmarks/) the way they import each other
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.join(ROOT, 'scripts'))
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
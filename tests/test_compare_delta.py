@@ -0,0 +1,85 @@
+import json
+
+import pytest
+
+import compare_delta
+from permset_model import FieldPermission
+
+
+def field(name, readable, editable):
+    """An Account field permission row as it is stored in a snapshot."""
+    return list(FieldPermission('Account', name, readable, editable))
+
+
+def as_dict(row):
+    return dict(zip(FieldPermission._fields, row))
+
+
+def test_diff_section_matches_rows_on_their_key():
+    old = [field('Name', 'true', 'false'), field('Phone', 'true', 'true')]
+    new = [field('Name', 'true', 'true'), field('Fax', 'true', 'false')]
+
+    assert compare_delta.diff_section(FieldPermission, 2, old, new) == {
+        "added": [as_dict(field('Fax', 'true', 'false'))],
+        "removed": [as_dict(field('Phone', 'true', 'true'))],
+        "changed": [{"before": as_dict(field('Name', 'true', 'false')), "after": as_dict(field('Name', 'true', 'true'))}],
+    }
+    assert compare_delta.diff_section(FieldPermission, 2, old, list(old)) is None
+
+
+def test_diff_section_reports_rows_with_repeated_keys():
+    # Account.Name is listed twice; adding, removing or changing one of the duplicates must show up
+    name, phone = field('Name', 'true', 'false'), field('Phone', 'true', 'true')
+    old = [name, name, phone]
+
+    assert compare_delta.diff_section(FieldPermission, 2, old, old + [name]) == {
+        "added": [as_dict(name)], "removed": [], "changed": []}
+    assert compare_delta.diff_section(FieldPermission, 2, old, [name, phone]) == {
+        "added": [], "removed": [as_dict(name)], "changed": []}
+    assert compare_delta.diff_section(FieldPermission, 2, old, [field('Name', 'true', 'true'), name, phone]) == {
+        "added": [as_dict(field('Name', 'true', 'true'))], "removed": [as_dict(name)], "changed": []}
+    assert compare_delta.diff_section(FieldPermission, 2, old, [phone, name, name]) is None
+
+
+def write_permission_set(json_dir, name, fields):
+    """Write a permission set's xml_to_json output with the given (field, readable, editable) rows."""
+    document = {"PermissionSet": {"label": name, "fieldPermissions": [
+        {"field": f"Account.{field}", "readable": readable, "editable": editable} for field, readable, editable in fields]}}
+    (json_dir / f"{name}.json").write_text(json.dumps(document))
+
+
+def test_rows_are_reported_again_when_the_alert_fails(tmp_path, monkeypatch):
+    html_dir, json_dir = tmp_path / "html", tmp_path / "json"
+    html_dir.mkdir()
+    json_dir.mkdir()
+    (html_dir / "Ops.html").write_text("<h1>Ops</h1>")
+    html_to_ids = [{"HTML": "Ops.html", "ID": "100"}]
+    snapshot, output = tmp_path / "snapshot.json", tmp_path / "differences.json"
+    alerts = []
+    monkeypatch.setattr(compare_delta, "send_permission_set_change_alert", alerts.append)
+
+    def run():
+        compare_delta.calculate_diffs(str(html_dir), None, str(output), json_dir=str(json_dir), snapshot=str(snapshot),
+                                      html_to_ids=html_to_ids)
+        return json.loads(output.read_text())
+
+    write_permission_set(json_dir, "Ops", [("Name", "true", "false")])
+    assert run() == []
+    baseline = snapshot.read_bytes()
+
+    write_permission_set(json_dir, "Ops", [("Name", "true", "true")])
+
+    def unreachable(changes):
+        raise compare_delta.requests.ConnectionError("webhook unreachable")
+    monkeypatch.setattr(compare_delta, "send_permission_set_change_alert", unreachable)
+    with pytest.raises(compare_delta.requests.ConnectionError):
+        run()
+    assert snapshot.read_bytes() == baseline
+
+    monkeypatch.setattr(compare_delta, "send_permission_set_change_alert", alerts.append)
+    differences = run()
+    assert [(difference["status"], difference["permission_set"]) for difference in differences] == [("changed", "Ops")]
+    assert differences[0]["sections"]["fieldPermissions"]["changed"] == [
+        {"before": as_dict(field('Name', 'true', 'false')), "after": as_dict(field('Name', 'true', 'true'))}]
+    assert alerts == [differences]
+    assert snapshot.read_bytes() != baseline
@@ -0,0 +1,75 @@
+import os
+import json
+import types
+import datetime
+
+import jinja2
+import pytest
+import xmltodict
+
+import json_to_html
+from generate_permission_sets import write_permission_sets
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+
+class FixedDatetime(datetime.datetime):
+    @classmethod
+    def now(cls, tz=None):
+        return cls(2024, 1, 15, 9, 30)
+
+
+@pytest.fixture
+def fixed_date(monkeypatch):
+    monkeypatch.setattr(json_to_html, 'datetime', types.SimpleNamespace(datetime=FixedDatetime))
+
+
+def normalize_whitespace(html):
+    return ' '.join(html.split())
+
+
+def test_report_matches_golden_file(tmp_path, fixed_date):
+    # The golden file was rendered by json_to_html.py as of the baseline commit (c9ca5e0), with
+    # the old str.replace post-processing that the cell filter replaced. The PermissionSet
+    # template rewrite changed blank lines and trailing spaces inside <tr>, so only the
+    # whitespace-normalized output must stay identical; streamed and buffered output must match
+    # byte for byte.
+    rendered = []
+    for stream in (False, True):
+        output_dir = tmp_path / str(stream)
+        output_dir.mkdir()
+        json_to_html.export_html_file(os.path.join(FIXTURES, 'Golden.permissionset-meta.json'), str(output_dir),
+                                      'PROD', stream=stream)
+        rendered.append((output_dir / 'Golden.permissionset-meta.html').read_bytes())
+    assert rendered[0] == rendered[1]
+
+    with open(os.path.join(FIXTURES, 'Golden.permissionset-meta.html'), 'r') as f:
+        golden = f.read()
+    assert normalize_whitespace(rendered[0].decode()) == normalize_whitespace(golden)
+
+
+def render_baseline_template(document, org_name):
+    """Render a parsed permission set with the report template and post-processing of the baseline commit (c9ca5e0)."""
+    with open(os.path.join(FIXTURES, 'baseline_report_template.html.jinja2'), 'r') as f:
+        template = jinja2.Environment().from_string(f.read())
+    html_content = template.render(permission_set=document['PermissionSet'])
+    html_content = html_content.replace('YYYY-MM-DD', FixedDatetime.now().strftime('%Y-%b-%d'))
+    html_content = html_content.replace('#ORG', org_name)
+    html_content = html_content.replace("<td>false</td>", "<td>FALSE</td>")
+    return html_content.replace("<td>true</td>", "<td><span style='color: #E08738; font-weight: bold'>TRUE</span></td>")
+
+
+def test_permission_set_template_matches_baseline_template(tmp_path, fixed_date):
+    # The PermissionSet template renders every section from normalized rows instead of branching
+    # on xmltodict's dict/list shapes; apart from whitespace its HTML must not change
+    with open(os.path.join(FIXTURES, 'Golden.permissionset-meta.json'), 'r') as f:
+        documents = [json.load(f)]
+    # Generated sets cover the single-row (dict) shape of every section as well as long lists
+    for file in write_permission_sets(str(tmp_path), sets=12, fields=20, objects=4, others=3, seed=3,
+                                      single_fraction=0.5, large_fraction=0):
+        with open(tmp_path / file, 'r', encoding='utf-8') as f:
+            documents.append(xmltodict.parse(f.read()))
+
+    for document in documents:
+        assert (normalize_whitespace(json_to_html.render_permission_set_html(document, 'PROD'))
+                == normalize_whitespace(render_baseline_template(document, 'PROD'))), document['PermissionSet']['label']
@@ -0,0 +1,139 @@
+import threading
+import time
+
+import pytest
+
+import update_confluence
+from confluence_client import ConfluenceClient
+from fake_confluence import FakeConfluence, start_fake_confluence
+
+
+class RecordingClient:
+    """Stands in for ConfluenceClient; records how many updates are in flight at once."""
+
+    def __init__(self):
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self._lock = threading.Lock()
+
+    def update_page(self, page_id, html_content, version, title):
+        with self._lock:
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        time.sleep(0.01)
+        with self._lock:
+            self.in_flight -= 1
+
+
+def test_bounded_page_updates_stays_within_workers(tmp_path, monkeypatch):
+    workers = 4
+    html_to_ids = [{"HTML": f"Set{i}.html", "ID": str(100 + i)} for i in range(20)]
+    for item in html_to_ids:
+        (tmp_path / item["HTML"]).write_text(f"<h1>{item['HTML']}</h1>")
+    page_versions = {item["ID"]: (1, item["HTML"]) for item in html_to_ids}
+    client = RecordingClient()
+    finished = []
+    process_page_update = update_confluence.process_page_update
+    monkeypatch.setattr(update_confluence, "process_page_update",
+                        lambda *args: finished.append(process_page_update(*args)) or finished[-1])
+
+    def items():
+        for taken, item in enumerate(html_to_ids):
+            # The next row is only taken once an update left the window
+            assert taken - len(finished) <= workers
+            yield item
+
+    results = update_confluence.bounded_page_updates(items(), str(tmp_path), client, update_confluence.PageLedger(),
+                                                     page_versions, workers)
+
+    assert client.peak_in_flight <= workers
+    assert [result.page_id for result in results] == [item["ID"] for item in html_to_ids]
+    assert [(result.status, result.version) for result in results] == [("updated", 2)] * len(html_to_ids)
+
+
+def test_bounded_page_updates_reports_missing_html(tmp_path):
+    item = {"HTML": "Missing.html", "ID": "7"}
+    results = update_confluence.bounded_page_updates([item], str(tmp_path), RecordingClient(),
+                                                     update_confluence.PageLedger(), {"7": (3, "Missing")}, 2)
+    assert len(results) == 1
+    assert results[0].status == "failed"
+    assert results[0].detail.startswith("Error reading HTML")
+
+
+@pytest.fixture
+def fake_confluence(monkeypatch):
+    """A fake Confluence server with 20 pages; yields (fake, base_url)."""
+    monkeypatch.setenv("CONFLUENCE_EMAIL", "bot@example.com")
+    monkeypatch.setenv("CONFLUENCE_TOKEN", "token")
+    fake = FakeConfluence(seed=1)
+    for i in range(20):
+        fake.add_page(str(100 + i), f"Set{i}")
+    server, base_url = start_fake_confluence(fake)
+    yield fake, base_url
+    server.shutdown()
+
+
+def test_client_retries_server_failures(fake_confluence):
+    fake, base_url = fake_confluence
+    fake.failure_rate = 0.3
+    with ConfluenceClient(pool_size=4, base_url=base_url, max_retries=10, backoff_base=0.001) as client:
+        pages = [client.get_page(page_id) for page_id in sorted(fake.pages)]
+
+    failures = sum(fake.counts[status] for status in ("502", "503", "504"))
+    assert [page["id"] for page in pages] == sorted(fake.pages)
+    assert failures > 0
+    # Every 5xx was retried once, and every retry counts as a throttled response
+    assert client.scheduler.retries == failures
+    assert client.scheduler.throttled == failures
+    assert fake.counts["get"] == len(pages) + failures
+
+
+def test_client_honours_retry_after(fake_confluence):
+    fake, base_url = fake_confluence
+    fake.max_concurrency = 1
+    fake.retry_after = 0.3
+    # Another client holds the only slot for 0.1s, so the first GET is answered with 429
+    fake.admit("held")
+    threading.Timer(0.1, fake.release).start()
+
+    with ConfluenceClient(pool_size=4, base_url=base_url, backoff_base=0.001) as client:
+        start = time.monotonic()
+        client.get_page("100")
+        elapsed = time.monotonic() - start
+
+    # Without the pause a backoff of at most 1ms would have retried into a second 429
+    assert fake.counts["429"] == 1
+    assert client.scheduler.retries == 1
+    assert elapsed >= 0.3
+
+
+def test_client_shrinks_and_regrows_concurrency_window(fake_confluence):
+    fake, base_url = fake_confluence
+    fake.max_concurrency = 2
+    fake.retry_after = None
+    fake.latency = 0.02
+    with ConfluenceClient(pool_size=8, base_url=base_url, max_retries=20, backoff_base=0.01) as client:
+        windows = []
+        release = client.scheduler.release
+
+        def recording_release(*args, **kwargs):
+            release(*args, **kwargs)
+            windows.append(client.scheduler.concurrency)
+        client.scheduler.release = recording_release
+
+        # Eight workers against a server that takes two requests at a time
+        workers = [threading.Thread(target=lambda: [client.get_page(page_id) for page_id in ("100", "101", "102")])
+                   for _ in range(8)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        assert fake.counts["429"] > 0
+        assert client.scheduler.throttled == fake.counts["429"]
+        assert min(windows) <= 4
+
+        # Once throttling stops, every success widens the window again up to pool_size
+        fake.latency = 0
+        for _ in range(60):
+            client.get_page("100")
+        assert windows[-1] == 8
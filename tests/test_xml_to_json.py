@@ -0,0 +1,121 @@
+import io
+import os
+import tracemalloc
+
+import pytest
+
+import xml_to_json
+from generate_permission_sets import write_permission_sets
+
+NAMESPACE = 'xmlns="http://soap.sforce.com/2006/04/metadata"'
+
+# Shapes the streaming writer has to reproduce exactly
+DOCUMENTS = {
+    "namespaces": f'<PermissionSet {NAMESPACE} xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance">'
+                  '<label xsi:nil="false">Ops</label><x:custom xmlns:x="urn:x">1</x:custom></PermissionSet>',
+    "attributes": f'<PermissionSet {NAMESPACE} version="2"><label lang="en">Ops</label>'
+                  '<userPermissions enabled="true"><name>ViewSetup</name></userPermissions></PermissionSet>',
+    "cdata": f'<PermissionSet {NAMESPACE}><description><![CDATA[R&D <Ops> "tier 2"]]></description>'
+             '<label>Ops &amp; Support</label></PermissionSet>',
+    "empty_elements": f'<PermissionSet {NAMESPACE}><description/><label></label>'
+                      '<fieldPermissions><editable/><field>Account.Name</field></fieldPermissions></PermissionSet>',
+    "repeated_tags": f'<PermissionSet {NAMESPACE}><classAccesses><apexClass>A</apexClass><enabled>true</enabled></classAccesses>'
+                     '<classAccesses><apexClass>B</apexClass><enabled>false</enabled></classAccesses>'
+                     '<classAccesses><apexClass>C</apexClass><enabled>true</enabled></classAccesses>'
+                     '<label>Ops</label></PermissionSet>',
+    "unicode": f'<PermissionSet {NAMESPACE}><description>Zugriff für Vertrieb – “EMEA”</description></PermissionSet>',
+}
+
+# Repeated tags split by another tag: xmltodict merges them, so the streaming writer falls back
+FALLBACK_DOCUMENT = (f'<PermissionSet {NAMESPACE}><classAccesses><apexClass>A</apexClass></classAccesses>'
+                     '<label>Ops</label><classAccesses><apexClass>B</apexClass></classAccesses></PermissionSet>')
+
+
+def convert_both(xml_file, tmp_path):
+    """Return the JSON bytes written by export_xml_to_json and by export_xml_to_json_streaming."""
+    outputs = []
+    for export in (xml_to_json.export_xml_to_json, xml_to_json.export_xml_to_json_streaming):
+        json_file = tmp_path / f'{export.__name__}.json'
+        export(str(xml_file), str(json_file))
+        outputs.append(json_file.read_bytes())
+    return outputs
+
+
+@pytest.mark.parametrize('name', sorted(DOCUMENTS))
+def test_streaming_matches_xmltodict(tmp_path, name):
+    xml_file = tmp_path / f'{name}.permissionset-meta.xml'
+    xml_file.write_text('<?xml version="1.0" encoding="UTF-8"?>\n' + DOCUMENTS[name], encoding='utf-8')
+
+    expected, streamed = convert_both(xml_file, tmp_path)
+    assert streamed == expected
+
+
+def test_streaming_matches_xmltodict_on_generated_permission_sets(tmp_path):
+    xml_dir = tmp_path / 'xml'
+    files = write_permission_sets(str(xml_dir), sets=60, fields=40, objects=8, others=3, seed=1)
+
+    for file in files:
+        expected, streamed = convert_both(xml_dir / file, tmp_path)
+        assert streamed == expected, file
+
+
+def test_streaming_falls_back_to_xmltodict(tmp_path):
+    xml_file = tmp_path / 'Fallback.permissionset-meta.xml'
+    xml_file.write_text(FALLBACK_DOCUMENT, encoding='utf-8')
+
+    with pytest.raises(xml_to_json.StreamingFallback):
+        xml_to_json._stream_xml_to_json(str(xml_file), io.StringIO())
+    expected, streamed = convert_both(xml_file, tmp_path)
+    assert streamed == expected
+    assert not os.path.exists(tmp_path / 'export_xml_to_json_streaming.json.tmp')
+
+
+@pytest.mark.parametrize('name', sorted(DOCUMENTS))
+def test_streaming_store_record_matches_xmltodict(tmp_path, name):
+    xml_file = tmp_path / f'{name}.permissionset-meta.xml'
+    xml_file.write_text('<?xml version="1.0" encoding="UTF-8"?>\n' + DOCUMENTS[name], encoding='utf-8')
+
+    assert (xml_to_json.export_xml_to_store_record_streaming(str(xml_file))
+            == xml_to_json.export_xml_to_store_record(str(xml_file)))
+
+
+def test_streaming_store_record_matches_xmltodict_on_generated_permission_sets(tmp_path):
+    files = write_permission_sets(str(tmp_path), sets=20, fields=40, objects=8, others=3, seed=2)
+    fallback = tmp_path / 'Fallback.permissionset-meta.xml'
+    fallback.write_text(FALLBACK_DOCUMENT, encoding='utf-8')
+
+    for file in files + [fallback.name]:
+        xml_file = str(tmp_path / file)
+        assert (xml_to_json.export_xml_to_store_record_streaming(xml_file)
+                == xml_to_json.export_xml_to_store_record(xml_file)), file
+
+
+class DiscardingWriter:
+    def write(self, text):
+        pass
+
+
+def test_streaming_peak_memory_is_flat(tmp_path):
+    """The streaming writer holds one root child at a time, so a 16x larger file needs no more memory."""
+    files = {}
+    for fields in (1000, 16000):
+        directory = tmp_path / str(fields)
+        file = write_permission_sets(str(directory), sets=1, fields=fields, objects=8, others=3, seed=1,
+                                     single_fraction=0, large_fraction=0)[0]
+        files[fields] = str(directory / file)
+
+    peaks = {}
+    tracemalloc.start()
+    try:
+        # Once first, so one-time allocations (imports, caches) do not count against the small file
+        xml_to_json._stream_xml_to_json(files[1000], DiscardingWriter())
+        for fields, xml_file in files.items():
+            tracemalloc.reset_peak()
+            baseline = tracemalloc.get_traced_memory()[0]
+            xml_to_json._stream_xml_to_json(xml_file, DiscardingWriter())
+            peaks[fields] = tracemalloc.get_traced_memory()[1] - baseline
+    finally:
+        tracemalloc.stop()
+
+    assert peaks[16000] < peaks[1000] * 1.5 + 64 * 1024
+    assert peaks[16000] < os.path.getsize(files[16000]) / 10